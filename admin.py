@@ -0,0 +1,387 @@
+# admin.py
+"""
+Обработчики организатора: команды игры, список участников, жеребьевка, рассылка.
+Импортируется при первом обращении к админке (см. admin_handler в bot.py):
+обычным участникам эти обработчики не нужны, и процесс запускается без них.
+"""
+import math
+import os
+import tempfile
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery, FSInputFile
+
+import app
+from bulk import ImportStats, file_format, read_participants
+from config import ADMIN_ID, DRAW_AVOID_REPEATS, PARTICIPANTS_PAGE_SIZE, REMINDER_INTERVAL, REMINDER_COOLDOWN
+from database import Database
+from draw import DrawError
+from keyboards import get_admin_keyboard, get_cancel_keyboard, get_participants_page_keyboard
+from states import Form
+from texts import CANCEL_BUTTONS, get_text, locale_of
+
+# Проверка прав: глобальный администратор (ADMIN_ID) или организатор игры
+async def is_admin(user_id, event_id):
+    return str(user_id) == ADMIN_ID or await app.db.is_event_admin(event_id, user_id)
+
+# Команда /newevent <название> - создать свою игру и стать ее организатором
+async def cmd_new_event(message: Message, state: FSMContext):
+    title = (message.text or "").partition(" ")[2].strip()
+    if not title:
+        await message.answer(get_text("newevent_usage", locale_of(message.from_user)))
+        return
+    
+    event_id, code = await app.db.create_event(title, message.from_user.id)
+    await app.db.set_current_event(message.from_user.id, event_id)
+    me = await app.bot.get_me()
+    await message.answer(get_text(
+        "event_created", locale_of(message.from_user),
+        title=title, link=f"https://t.me/{me.username}?start={code}"
+    ))
+
+# Команда /admin (только для администратора)
+async def cmd_admin(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        await message.answer(get_text("not_admin", locale_of(message.from_user)))
+        return
+    
+    event = await app.db.get_event(event_id)
+    await message.answer(
+        get_text("admin_panel", locale_of(message.from_user), title=event[2]),
+        reply_markup=get_admin_keyboard(locale_of(message.from_user))
+    )
+
+# Команда /exclude <id> <id> - запретить двум участникам дарить друг другу
+async def cmd_exclude(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    args = (message.text or "").split()[1:]
+    if len(args) != 2 or not all(arg.isdigit() for arg in args):
+        await message.answer(get_text("exclude_usage", locale_of(message.from_user)))
+        return
+    
+    await app.db.add_exclusion(event_id, int(args[0]), int(args[1]))
+    await message.answer(get_text("exclusion_added", locale_of(message.from_user)))
+
+# Команды /latejoin <id> и /dropout <id> - изменить проведенную жеребьевку без перераспределения всех пар
+async def change_draw(message: Message, change, done_key):
+    locale = locale_of(message.from_user)
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    command, _, arg = (message.text or "").partition(" ")
+    if not arg.strip().isdigit():
+        await message.answer(get_text("user_id_usage", locale, command=command))
+        return
+    
+    try:
+        assignments = await change(event_id, int(arg))
+    except DrawError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    await message.answer(get_text("draw_changed", locale, done=get_text(done_key, locale), count=len(assignments)))
+    # Уведомления только сантам, чьи пары изменились
+    await app.fan_out('notify_draw', event_id, message.chat.id, assignments)
+
+async def cmd_late_join(message: Message, state: FSMContext):
+    await change_draw(message, app.db.add_to_draw, "late_joined")
+
+async def cmd_dropout(message: Message, state: FSMContext):
+    await change_draw(message, app.db.remove_from_draw, "dropped_out")
+
+# Команда /qr <user_id> - посмотреть QR-код, который отправил санта.
+# Фото уходит по сохраненному file_id: Telegram не загружает его заново
+async def cmd_show_qr(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    arg = (message.text or "").partition(" ")[2].strip()
+    if not arg.isdigit():
+        await message.answer(get_text("user_id_usage", locale_of(message.from_user), command="/qr"))
+        return
+    
+    participant = await app.db.get_participant(event_id, int(arg))
+    if not participant or not participant.qr_file_id:
+        await message.answer(get_text("qr_not_sent", locale_of(message.from_user)))
+        return
+    
+    caption = get_text("qr_caption", locale_of(message.from_user), name=participant.full_name)
+    if participant.qr_payload:
+        caption += get_text("qr_caption_code", locale_of(message.from_user), code=participant.qr_payload)
+    await message.answer_photo(participant.qr_file_id, caption=caption)
+
+# Админ: список участников
+async def render_participants_page(event_id, locale, filter_name="all", after_id=0, before_id=None):
+    """Текст и клавиатура одной страницы списка участников"""
+    total, with_address, with_gift = await app.db.get_participants_summary(event_id)
+    rows, has_prev, has_next = await app.db.get_participants_page(
+        event_id, filter_name, after_id=after_id, before_id=before_id, limit=PARTICIPANTS_PAGE_SIZE
+    )
+    
+    response = get_text(
+        "participants_header", locale, total=total, with_address=with_address, with_gift=with_gift,
+        filter=get_text(f"filter_{filter_name}", locale)
+    )
+    lines = []
+    for user_id, username, full_name, has_address, has_gift in rows:
+        status = "✅" if has_address else "❌"
+        gift_status = "🎁" if has_gift else "⏳"
+        lines.append(get_text(
+            "participant_line", locale, name=full_name, username=username, address=status, gift=gift_status
+        ))
+    response += "\n".join(lines) if lines else get_text("nobody_found", locale)
+    
+    first_id = rows[0][0] if rows else 0
+    last_id = rows[-1][0] if rows else 0
+    keyboard = get_participants_page_keyboard(filter_name, first_id, last_id, has_prev, has_next, locale)
+    return response, keyboard
+
+async def list_participants(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    if not await app.db.count_active_participants(event_id):
+        await message.answer(get_text("no_participants", locale_of(message.from_user)))
+        return
+    
+    text, keyboard = await render_participants_page(event_id, locale_of(message.from_user))
+    await message.answer(text, reply_markup=keyboard)
+
+# Админ: листание и фильтры списка участников
+async def participants_page(callback: CallbackQuery, state: FSMContext):
+    event_id = await app.db.get_current_event(callback.from_user.id)
+    if not await is_admin(callback.from_user.id, event_id):
+        await callback.answer()
+        return
+    
+    _, filter_name, direction, anchor = callback.data.split(":")
+    locale = locale_of(callback.from_user)
+    if direction == "p":
+        text, keyboard = await render_participants_page(event_id, locale, filter_name, before_id=int(anchor))
+    else:
+        text, keyboard = await render_participants_page(event_id, locale, filter_name, after_id=int(anchor))
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        pass  # Страница не изменилась
+    await callback.answer()
+
+# Админ: выгрузка участников в CSV
+async def export_participants(callback: CallbackQuery, state: FSMContext):
+    event_id = await app.db.get_current_event(callback.from_user.id)
+    if not await is_admin(callback.from_user.id, event_id):
+        await callback.answer()
+        return
+    
+    await callback.answer(get_text("preparing_file", locale_of(callback.from_user)))
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        await app.db.export_participants_csv(event_id, path)
+        await app.bot.send_document(
+            callback.from_user.id,
+            FSInputFile(path, filename="participants.csv"),
+            caption=get_text("participants_caption", locale_of(callback.from_user))
+        )
+    finally:
+        os.remove(path)
+
+# Команда /import (подпись к файлу .csv/.jsonl) - загрузить участников списком
+async def cmd_import(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    document = message.document
+    if not document:
+        await message.answer(get_text("import_usage", locale_of(message.from_user)))
+        return
+    try:
+        file_format(document.file_name or "")
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(document.file_name)[1])
+    os.close(fd)
+    try:
+        await app.bot.download(document, destination=path)
+        # Файл читается и пишется в базу пачками в потоке базы
+        stats = ImportStats()
+        imported = await app.db.import_participants(event_id, read_participants(path, stats))
+    finally:
+        os.remove(path)
+    
+    await message.answer(
+        get_text("import_done", locale_of(message.from_user), imported=imported, skipped=stats.skipped)
+        + "".join(f"\n• {error}" for error in stats.errors)
+    )
+
+# Команда /export_draw - архив жеребьевки (пары с данными участников) в CSV
+async def cmd_export_draw(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        count = await app.db.export_draw_results(event_id, path)
+        if not count:
+            await message.answer(get_text("draw_not_done_admin", locale_of(message.from_user)))
+            return
+        await app.bot.send_document(
+            message.chat.id,
+            FSInputFile(path, filename="draw_results.csv"),
+            caption=get_text("draw_export_caption", locale_of(message.from_user), count=count)
+        )
+    finally:
+        os.remove(path)
+
+# Админ: провести жеребьевку
+async def perform_draw(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    if await app.db.count_active_participants(event_id) < 2:
+        await message.answer(get_text("draw_need_two", locale_of(message.from_user)))
+        return
+    
+    pairs = await app.db.perform_draw(event_id, avoid_previous=DRAW_AVOID_REPEATS)
+    
+    if pairs:
+        await message.answer(get_text("draw_done", locale_of(message.from_user), count=pairs))
+        # Уведомления уходят в фоне с учетом лимитов Telegram; пары читаются из базы страницами
+        await app.fan_out('notify_draw', event_id, message.chat.id)
+    else:
+        await message.answer(get_text("draw_failed", locale_of(message.from_user)))
+
+# Команда /undo_draw - вернуть пары, которые были до последней жеребьевки (по журналу изменений)
+async def cmd_undo_draw(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    try:
+        pairs = await app.db.restore_previous_draw(event_id)
+    except DrawError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    await message.answer(get_text("draw_restored", locale_of(message.from_user), count=pairs))
+    await app.fan_out('notify_draw', event_id, message.chat.id)
+
+# Админ: дослать результаты жеребьевки тем, кому они не дошли
+async def resend_draw_notifications(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    if not await app.db.count_assignments(event_id, undelivered_only=True):
+        await message.answer(get_text("all_notified", locale_of(message.from_user)))
+        return
+    
+    await app.fan_out('notify_draw', event_id, message.chat.id, None, True)
+
+# Команда /remind - напоминания по расписанию:
+# /remind address [часы] - тем, кто не указал адрес; /remind gift <дней> [часы] - сантам,
+# не отправившим подарок через <дней> после жеребьевки; /remind stop; /remind - список
+async def cmd_remind(message: Message, state: FSMContext):
+    locale = locale_of(message.from_user)
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    args = (message.text or "").split()[1:]
+    if not args:
+        jobs = await app.db.get_reminder_jobs(event_id)
+        lines = [
+            get_text(
+                "reminder_line", locale, title=get_text(f"reminder_{job['kind']}", locale),
+                hours=job['interval'] / 3600, sent=job['sent'],
+                status=get_text("reminder_active" if job['status'] == 'active' else "reminder_stopped", locale)
+            )
+            for job in jobs
+        ]
+        await message.answer(
+            get_text("reminders_list", locale) + "\n".join(lines) if lines else get_text("reminder_usage", locale)
+        )
+        return
+    if args[0] == "stop":
+        stopped = await app.db.stop_reminder_jobs(event_id)
+        await message.answer(get_text("reminders_stopped", locale, count=stopped))
+        return
+    
+    kind = {'address': 'no_address', 'gift': 'no_gift'}.get(args[0])
+    numbers = args[1:]
+    try:
+        values = [float(value) for value in numbers]
+    except ValueError:
+        values = None
+    if kind is None or values is None or len(values) > (2 if kind == 'no_gift' else 1) \
+            or (kind == 'no_gift' and not values):
+        await message.answer(get_text("reminder_usage", locale))
+        return
+    if not all(math.isfinite(value) and value > 0 for value in values):
+        await message.answer(get_text("reminder_bad_numbers", locale))
+        return
+    
+    delay = values.pop(0) * 86400 if kind == 'no_gift' else 0
+    interval = max(values[0] * 3600 if values else REMINDER_INTERVAL, Database.REMINDER_MIN_INTERVAL)
+    # Пауза для участника не длиннее интервала, иначе следующий проход пропустит всех, кому напомнили
+    await app.db.set_reminder_job(event_id, kind, interval, min(REMINDER_COOLDOWN, interval), delay)
+    await app.fan_out('wake_reminders')
+    await message.answer(
+        get_text("reminder_enabled", locale, title=get_text(f"reminder_{kind}", locale), hours=interval / 3600)
+        + (get_text("reminder_delay", locale, days=delay / 86400) if delay else "")
+    )
+
+# Админ: сделать рассылку
+async def start_broadcast(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        return
+    
+    await message.answer(
+        get_text("broadcast_prompt", locale_of(message.from_user)),
+        reply_markup=get_cancel_keyboard(locale_of(message.from_user))
+    )
+    await state.set_state(Form.admin_message)
+
+# Обработка рассылки
+async def process_broadcast(message: Message, state: FSMContext):
+    if message.text in CANCEL_BUTTONS:
+        await state.clear()
+        await message.answer(
+            get_text("cancelled", locale_of(message.from_user)),
+            reply_markup=get_admin_keyboard(locale_of(message.from_user))
+        )
+        return
+    
+    # Права проверяются еще раз: за время ввода права могли отозвать или текущая игра сменилась
+    event_id = await app.db.get_current_event(message.from_user.id)
+    if not await is_admin(message.from_user.id, event_id):
+        await state.clear()
+        return
+    # Рассылается только текст; на фото или стикер просим текст и ждем дальше
+    if not message.text:
+        await message.answer(get_text("broadcast_text_only", locale_of(message.from_user)))
+        return
+    
+    # Рассылка идет в фоне; прогресс обновляется в отдельном сообщении
+    await state.clear()
+    await message.answer(
+        get_text("broadcast_queued", locale_of(message.from_user)),
+        reply_markup=get_admin_keyboard(locale_of(message.from_user))
+    )
+    await app.fan_out('broadcast', event_id, message.text, message.chat.id)
@@ -0,0 +1,217 @@
+# app.py
+"""
+Объекты процесса бота: Bot, база, диспетчер, отправка сообщений.
+Создаются create_app() при запуске, а не при импорте, поэтому импорт обработчиков
+(bot.py) и утилит ничего не открывает и не подключает.
+"""
+import builtins
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+from config import (
+    BOT_TOKEN, DB_NAME, DB_WORKERS, DB_BATCH_WINDOW, DB_BATCH_SIZE, DB_CACHE_SIZE,
+    TELEGRAM_RATE, TELEGRAM_PER_CHAT_INTERVAL, BROADCAST_CONCURRENCY,
+    FSM_STORAGE, FSM_TTL, REDIS_URL,
+    BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, SHUTDOWN_TIMEOUT,
+    SHARD_ID, METRICS_HOST, METRICS_PORT, TELEGRAM_API_URL,
+    THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS, MEDIA_WORKERS, MEDIA_MAX_BYTES,
+    REMINDER_POLL_INTERVAL, AUDIT_SNAPSHOT_EVERY, AUDIT_RETENTION, AUDIT_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+bot = None
+db = None
+dp = None
+sender = None
+broadcaster = None
+gift_outbox = None
+reminders = None
+audit = None
+media = None
+inflight = None
+metrics_server = None
+# Передача задачи рассылки воркеру 0 (задает cluster.py); None - задачи выполняются в этом процессе
+fanout_forwarder = None
+
+# Замеры запуска для --profile-startup: [(этап, секунды)]
+STARTUP_TIMES = []
+# Время импорта по пакетам верхнего уровня (без вложенных импортов других пакетов)
+IMPORT_TIMES = {}
+
+
+@contextmanager
+def startup_step(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMES.append((name, time.perf_counter() - started))
+
+
+def profile_imports():
+    """
+    Включает замер импортов: время каждого нового модуля записывается в IMPORT_TIMES
+    на его пакет верхнего уровня. Вызывается до импорта aiogram и модулей бота.
+    """
+    original_import = builtins.__import__
+    # Время вложенных импортов для каждого уровня стека: вычитается из времени родителя
+    nested = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            package = name.partition('.')[0]
+            IMPORT_TIMES[package] = IMPORT_TIMES.get(package, 0.0) + elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+
+    builtins.__import__ = timed_import
+
+
+def create_app(*routers):
+    """
+    Создает объекты процесса и диспетчер с обработчиками routers.
+    Повторный вызов возвращает уже созданный диспетчер.
+    """
+    global bot, db, dp, sender, broadcaster, gift_outbox, reminders, audit, media, inflight
+    if dp is not None:
+        return dp
+
+    with startup_step('aiogram'):
+        from aiogram import Bot, Dispatcher
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+    with startup_step('modules'):
+        from audit import AuditCompactor
+        from broadcast import Broadcaster, Sender
+        from database import AsyncDatabase
+        from media import QRChecker
+        from metrics import FSM_STATES
+        from middlewares import HandlerMetricsMiddleware, InflightMiddleware, ThrottlingMiddleware
+        from outbox import GiftOutbox
+        from reminders import ReminderScheduler
+        from storage import SQLiteStorage, create_storage
+
+    # TELEGRAM_API_URL - свой сервер Bot API или фейковый для нагрузочного теста (loadtest.py)
+    with startup_step('bot'):
+        bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    with startup_step('database'):
+        db = AsyncDatabase(
+            DB_NAME,
+            workers=DB_WORKERS,
+            batch_window=DB_BATCH_WINDOW,
+            batch_size=DB_BATCH_SIZE,
+            cache_size=DB_CACHE_SIZE,
+        )
+    with startup_step('dispatcher'):
+        # Состояния FSM хранятся вне процесса: QR-код и шаг диалога не теряются при перезапуске
+        dp = Dispatcher(storage=create_storage(FSM_STORAGE, db=db, redis_url=REDIS_URL, ttl=FSM_TTL))
+        sender = Sender(
+            rate=TELEGRAM_RATE,
+            per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL,
+            concurrency=BROADCAST_CONCURRENCY,
+        )
+        broadcaster = Broadcaster(bot, db, sender)
+        gift_outbox = GiftOutbox(bot, db, sender)
+        reminders = ReminderScheduler(bot, db, sender, poll_interval=REMINDER_POLL_INTERVAL)
+        audit = AuditCompactor(db, AUDIT_SNAPSHOT_EVERY, AUDIT_RETENTION, AUDIT_INTERVAL)
+        media = QRChecker(MEDIA_WORKERS, MEDIA_MAX_BYTES, DB_CACHE_SIZE)
+        inflight = InflightMiddleware()
+        dp.update.outer_middleware(inflight)
+        # Частые нажатия отсекаются до фильтров и обращений к базе
+        throttling = ThrottlingMiddleware(THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS)
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
+        # Метрики: время обработчиков и число пользователей в каждом состоянии FSM
+        dp.message.middleware(HandlerMetricsMiddleware())
+        dp.callback_query.middleware(HandlerMetricsMiddleware())
+        if isinstance(dp.storage, SQLiteStorage):
+            FSM_STATES.collector = dp.storage.count_states
+        dp.startup.register(on_startup)
+        dp.shutdown.register(on_shutdown)
+        for router in routers:
+            dp.include_router(router)
+    return dp
+
+
+# Запуск и остановка (общие для polling и webhook)
+
+async def on_startup():
+    global metrics_server
+    if BOT_MODE == "webhook":
+        await bot.set_webhook(f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+    # Все массовые отправки (рассылки, напоминания, передачи подарков) и журнал изменений
+    # ведет один процесс - воркер 0 в cluster.py: ему достается весь лимит Telegram (см. fan_out)
+    if SHARD_ID == 0:
+        await broadcaster.resume()
+        reminders.start()
+        audit.start()
+        gift_outbox.start()
+    if METRICS_PORT:
+        from metrics import start_metrics_server
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT + SHARD_ID)
+    print(f"Бот Тайный Санта запущен ({BOT_MODE})...")
+
+
+async def fan_out(task, *args):
+    """
+    Запускает рассылку или будит фоновую очередь там, где работает Sender с лимитом Telegram:
+    в cluster.py задача уходит воркеру 0, иначе выполняется в этом процессе.
+    task - 'broadcast', 'notify_draw', 'wake_reminders' или 'wake_outbox'; args - аргументы метода.
+    """
+    if fanout_forwarder is not None:
+        fanout_forwarder(task, args)
+    else:
+        await run_fan_out(task, *args)
+
+
+async def run_fan_out(task, *args):
+    if task == 'broadcast':
+        await broadcaster.start(*args)
+    elif task == 'notify_draw':
+        await broadcaster.notify_draw(*args)
+    elif task == 'wake_reminders':
+        reminders.wake()
+    elif task == 'wake_outbox':
+        gift_outbox.wake()
+    else:
+        logger.error(f"Неизвестная задача рассылки: {task}")
+
+
+async def on_shutdown():
+    # Даем обработчикам закончить работу, и только потом закрываем базу
+    await inflight.drain(SHUTDOWN_TIMEOUT)
+    await broadcaster.stop()
+    await gift_outbox.stop()
+    await reminders.stop()
+    await audit.stop()
+    media.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    # aiogram закрывает хранилище FSM раньше on_shutdown: состояния, записанные
+    # обработчиками за время drain, сбрасываем в базу до ее закрытия
+    flush = getattr(dp.storage, 'flush', None)
+    if flush is not None:
+        await flush()
+    await db.close()
+
+
+def startup_report(started):
+    """Отчет --profile-startup: импорты по пакетам и этапы create_app()"""
+    lines = ["Импорт (мс, без вложенных пакетов):"]
+    for package, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1])[:25]:
+        lines.append(f"  {package:<24}{seconds * 1000:8.1f}")
+    lines.append("Инициализация (мс):")
+    for name, seconds in STARTUP_TIMES:
+        lines.append(f"  {name:<24}{seconds * 1000:8.1f}")
+    lines.append(f"Всего до готовности: {(time.perf_counter() - started) * 1000:.1f} мс")
+    return "\n".join(lines)
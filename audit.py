@@ -0,0 +1,170 @@
+# audit.py
+"""
+Журнал изменений игры (audit_log) и снимки состояния (audit_snapshots).
+
+Каждое изменение Database пишет запись в журнал той же транзакцией:
+регистрации, адреса, подарки, жеребьевки, точечные изменения пар, передачи и их доставка.
+Состояние игры на любой момент - последний снимок до него плюс записи после снимка
+(Database.rebuild_state), поэтому восстановление не читает журнал с самого начала.
+Снимки делает и старый журнал удаляет AuditCompactor (воркер 0) или вручную:
+
+    python audit.py history --event 2
+    python audit.py verify --event 2
+    python audit.py snapshot --event 2
+    python audit.py compact --retention-days 365 [--vacuum]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Поля участника в состоянии игры (как в таблице participants)
+PARTICIPANT_FIELDS = ('username', 'full_name', 'address', 'gift_code', 'is_active')
+
+
+def empty_state():
+    """Состояние игры: участники {user_id: {поле: значение}} и пары {santa_id: recipient_id}"""
+    return {'participants': {}, 'pairs': {}}
+
+
+def _participant(state, user_id):
+    participant = state['participants'].get(user_id)
+    if participant is None:
+        participant = state['participants'][user_id] = dict.fromkeys(PARTICIPANT_FIELDS)
+        participant['is_active'] = 1
+    return participant
+
+
+def apply_entry(state, kind, user_id, data):
+    """Применяет одну запись журнала к состоянию; записи только для истории ничего не меняют"""
+    if kind == 'join':
+        participant = _participant(state, user_id)
+        participant.update(username=data['username'], full_name=data['full_name'])
+    elif kind == 'import':
+        # Загрузка из файла: пустые поля не затирают данные (см. Database.import_participants)
+        participant = _participant(state, user_id)
+        for field in ('username', 'full_name', 'address'):
+            if data.get(field) is not None:
+                participant[field] = data[field]
+    elif kind == 'address':
+        _participant(state, user_id)['address'] = data['address']
+    elif kind in ('gift', 'handoff'):
+        _participant(state, user_id)['gift_code'] = data['gift_code']
+    elif kind == 'draw':
+        state['pairs'] = {santa_id: recipient_id for santa_id, recipient_id in data['pairs']}
+    elif kind == 'draw_change':
+        removed = data.get('removed')
+        if removed is not None:
+            state['pairs'].pop(removed, None)
+            _participant(state, removed)['is_active'] = 0
+        if user_id is not None:
+            # add_to_draw: встроенный в жеребьевку участник снова активен
+            _participant(state, user_id)['is_active'] = 1
+        state['pairs'].update((santa_id, recipient_id) for santa_id, recipient_id in data['pairs'])
+
+
+def dump_state(state):
+    """Снимок состояния для audit_snapshots: JSON, сжатый zlib"""
+    return zlib.compress(json.dumps({
+        'participants': [
+            [user_id, *(participant[field] for field in PARTICIPANT_FIELDS)]
+            for user_id, participant in state['participants'].items()
+        ],
+        'pairs': list(state['pairs'].items()),
+    }, ensure_ascii=False).encode('utf-8'))
+
+
+def load_state(blob):
+    raw = json.loads(zlib.decompress(blob))
+    return {
+        'participants': {row[0]: dict(zip(PARTICIPANT_FIELDS, row[1:])) for row in raw['participants']},
+        'pairs': {santa_id: recipient_id for santa_id, recipient_id in raw['pairs']},
+    }
+
+
+class AuditCompactor:
+    """
+    Фоновое обслуживание журнала раз в interval секунд:
+    снимок игры, накопившей snapshot_every записей после прошлого снимка,
+    и удаление записей и снимков старше retention секунд, уже покрытых более новым снимком.
+    Освободившиеся страницы SQLite использует для новых записей - файл базы перестает расти.
+    """
+
+    def __init__(self, db, snapshot_every=10_000, retention=365 * 86400, interval=3600.0):
+        self._db = db
+        self._snapshot_every = snapshot_every
+        self._retention = retention
+        self._interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Не удалось обслужить журнал изменений: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def run_once(self):
+        for event_id in await self._db.get_events_for_snapshot(self._snapshot_every):
+            await self._db.create_audit_snapshot(event_id)
+        deleted = await self._db.compact_audit_log(time.time() - self._retention)
+        if deleted:
+            logger.info(f"Из журнала изменений удалено записей: {deleted}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Журнал изменений Тайного Санты")
+    parser.add_argument('command', choices=('history', 'verify', 'snapshot', 'compact'))
+    parser.add_argument('--event', type=int, default=1, help="Номер игры")
+    parser.add_argument('--limit', type=int, default=50, help="Записей истории")
+    parser.add_argument('--retention-days', type=float, default=365, help="Сколько хранить журнал")
+    parser.add_argument('--vacuum', action='store_true', help="После сжатия уменьшить файл базы (VACUUM)")
+    args = parser.parse_args()
+
+    from config import DB_NAME
+    from database import Database
+
+    db = Database(DB_NAME)
+    try:
+        if args.command == 'history':
+            for entry_id, kind, user_id, data, created_at in db.get_audit_log(args.event, limit=args.limit):
+                moment = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))
+                print(f"#{entry_id} {moment} {kind} {user_id or ''} {data or ''}")
+        elif args.command == 'verify':
+            # Состояние из снимка и журнала должно совпасть с таблицами
+            started = time.perf_counter()
+            rebuilt = db.rebuild_state(args.event)
+            elapsed = time.perf_counter() - started
+            current = db.current_state(args.event)
+            print(f"Восстановлено за {elapsed * 1000:.1f} мс: участников {len(rebuilt['participants'])}, "
+                  f"пар {len(rebuilt['pairs'])}")
+            if rebuilt != current:
+                print("❌ Состояние по журналу не совпадает с таблицами")
+                raise SystemExit(1)
+            print("✅ Совпадает с таблицами")
+        elif args.command == 'snapshot':
+            print(f"Снимок по записи #{db.create_audit_snapshot(args.event)}")
+        else:
+            deleted = db.compact_audit_log(time.time() - args.retention_days * 86400)
+            print(f"Удалено записей журнала: {deleted}")
+            if args.vacuum:
+                db.conn.execute('VACUUM')
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,216 +1,235 @@
+import sys
+import time
+
+# --profile-startup: отсчет и замер импортов начинаются до импорта aiogram и модулей бота
+STARTED_AT = time.perf_counter()
+import app
+if __name__ == "__main__" and "--profile-startup" in sys.argv:
+    app.profile_imports()
+
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types, F
+
+from aiogram import Router, F
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery
 
-from config import BOT_TOKEN, ADMIN_ID
-from database import Database
-from keyboards import get_main_keyboard, get_admin_keyboard, get_confirm_keyboard, get_cancel_keyboard
+from config import BOT_MODE, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+from keyboards import get_main_keyboard, get_confirm_keyboard, get_cancel_keyboard
+from media import QR_TOO_LARGE, QR_UNREADABLE
+from states import Form
+from texts import BUTTON_ACTIONS, CANCEL_BUTTONS, get_text, locale_of
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-db = Database()
+# Обработчики; бот, база и диспетчер создаются при запуске (app.create_app)
+router = Router()
 
-# Состояния FSM
-class Form(StatesGroup):
-    waiting_for_address = State()
-    waiting_for_qr_photo = State()       # Для фото QR-кода
-    waiting_for_pickup_address = State()  # Для адреса пункта выдачи
-    admin_message = State()
+# Админка: admin.py импортируется при первом обращении, обычным участникам она не нужна
+def admin_handler(name):
+    """Обработчик из admin.py; сам модуль загружается при первом вызове"""
+    async def handler(event, state: FSMContext):
+        import admin
+        await getattr(admin, name)(event, state)
+    handler.__name__ = name
+    return handler
 
-# Команда /start
-@dp.message(CommandStart())
+# Команда /start (ссылка-приглашение в игру: /start <код игры>)
+@router.message(CommandStart())
 async def cmd_start(message: Message):
-    await message.answer(
-        "🎅 Добро пожаловать в Тайного Санту! 🎄\n\n"
-        "Я помогу организовать обмен подарками. Вот что вы можете сделать:\n\n"
-        "🎅 Стать участником - зарегистрироваться в игре\n"
-        "📦 Указать адрес доставки - куда отправить вам подарок\n"
-        "🎁 Узнать своего получателя - после жеребьевки\n"
-        "📦 Отправить QR-код и адрес выдачи - чтобы получатель мог забрать подарок\n\n"
-        "Для администрирования используйте /admin",
-        reply_markup=get_main_keyboard()
-    )
-    
-    # Регистрируем пользователя в базе
     user_id = message.from_user.id
+    args = message.text.split()[1:] if message.text and message.text.startswith("/start") else []
+    if args:
+        event = await app.db.get_event_by_code(args[0])
+        if not event:
+            await message.answer(get_text("event_not_found", locale_of(message.from_user)))
+            return
+        event_id = event[0]
+        await app.db.set_current_event(user_id, event_id)
+    else:
+        event_id = await app.db.get_current_event(user_id)
+        event = await app.db.get_event(event_id)
+    
+    # Регистрируем пользователя в игре до ответа: ошибка отправки (например, 429) не должна оставить его без записи
     username = message.from_user.username
     full_name = message.from_user.full_name
     
-    db.add_participant(user_id, username, full_name)
-
-# Команда /admin (только для администратора)
-@dp.message(Command("admin"))
-async def cmd_admin(message: Message):
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.answer("У вас нет прав администратора!")
-        return
+    await app.db.add_participant(event_id, user_id, username, full_name)
     
     await message.answer(
-        "Панель администратора:",
-        reply_markup=get_admin_keyboard()
+        get_text("start", locale_of(message.from_user), title=event[2]),
+        reply_markup=get_main_keyboard(locale_of(message.from_user))
     )
 
+# Команды организатора: /newevent <название>, /admin, /exclude <id> <id>, /latejoin <id>, /dropout <id>,
+# /import (подпись к файлу), /export_draw, /qr <id>, /remind, /undo_draw
+router.message(Command("newevent"))(admin_handler("cmd_new_event"))
+router.message(Command("admin"))(admin_handler("cmd_admin"))
+router.message(Command("exclude"))(admin_handler("cmd_exclude"))
+router.message(Command("latejoin"))(admin_handler("cmd_late_join"))
+router.message(Command("dropout"))(admin_handler("cmd_dropout"))
+router.message(Command("import"))(admin_handler("cmd_import"))
+router.message(Command("export_draw"))(admin_handler("cmd_export_draw"))
+router.message(Command("qr"))(admin_handler("cmd_show_qr"))
+router.message(Command("remind"))(admin_handler("cmd_remind"))
+router.message(Command("undo_draw"))(admin_handler("cmd_undo_draw"))
+
+# Кнопки меню: подпись кнопки (на любом языке) -> действие -> обработчик.
+# Один поиск в словаре вместо проверки фильтров F.text == "..." у каждого обработчика.
+# Регистрируется раньше обработчиков состояний: нажатие кнопки - всегда команда, а не ввод.
+BUTTON_HANDLERS = {}
+
+def on_button(action):
+    def register(handler):
+        BUTTON_HANDLERS[action] = handler
+        return handler
+    return register
+
+def button_handler(text):
+    action = BUTTON_ACTIONS.get(text)
+    return BUTTON_HANDLERS.get(action) if action else None
+
+@router.message(F.text.func(button_handler).as_("button"))
+async def dispatch_button(message: Message, state: FSMContext, button):
+    await button(message, state)
+
 # Кнопка "Стать участником"
-@dp.message(F.text == "🎅 Стать участником")
-async def become_participant(message: Message):
-    participant = db.get_participant(message.from_user.id)
+@on_button("join")
+async def become_participant(message: Message, state: FSMContext):
+    event_id = await app.db.get_current_event(message.from_user.id)
+    participant = await app.db.get_participant(event_id, message.from_user.id)
     if participant:
         await message.answer(
-            "✅ Вы уже зарегистрированы как участник!\n"
-            f"Ваше имя: {participant[2]}\n"
-            "Не забудьте указать адрес доставки!",
-            reply_markup=get_main_keyboard()
+            get_text("already_joined", locale_of(message.from_user), name=participant.full_name),
+            reply_markup=get_main_keyboard(locale_of(message.from_user))
         )
     else:
         await message.answer(
-            "🎅 Отлично! Вы хотите стать участником Тайного Санты?\n\n"
-            "Правила:\n"
-            "1. Вы получите имя другого участника\n"
-            "2. Пришлете ему подарок\n"
-            "3. Получите подарок от своего Тайного Санты\n\n"
-            "Подтвердите участие:",
-            reply_markup=get_confirm_keyboard()
+            get_text("join_rules", locale_of(message.from_user)),
+            reply_markup=get_confirm_keyboard(locale_of(message.from_user))
         )
 
 # Подтверждение участия
-@dp.callback_query(F.data == "confirm_participation")
+@router.callback_query(F.data == "confirm_participation")
 async def confirm_participation(callback: CallbackQuery):
     user_id = callback.from_user.id
     username = callback.from_user.username
     full_name = callback.from_user.full_name
     
-    db.add_participant(user_id, username, full_name)
+    event_id = await app.db.get_current_event(user_id)
+    await app.db.add_participant(event_id, user_id, username, full_name)
     
-    await callback.message.edit_text(
-        "🎉 Поздравляем! Вы стали участником Тайного Санты!\n\n"
-        "Теперь укажите адрес доставки, куда ваш Санта сможет отправить подарок."
-    )
+    await callback.message.edit_text(get_text("joined", locale_of(callback.from_user)))
     await callback.answer()
 
 # Кнопка "Указать адрес доставки"
-@dp.message(F.text == "📦 Указать адрес доставки")
+@on_button("set_address")
 async def request_address(message: Message, state: FSMContext):
     await message.answer(
-        "📝 Пожалуйста, введите ваш адрес доставки в формате:\n"
-        "Город, улица, дом, квартира, индекс\n\n"
-        "Пример: Москва, ул. Пушкина, д. 10, кв. 5, 123456",
-        reply_markup=get_cancel_keyboard()
+        get_text("address_prompt", locale_of(message.from_user)),
+        reply_markup=get_cancel_keyboard(locale_of(message.from_user))
     )
     await state.set_state(Form.waiting_for_address)
 
 # Получение адреса
-@dp.message(Form.waiting_for_address)
+@router.message(Form.waiting_for_address)
 async def process_address(message: Message, state: FSMContext):
-    if message.text == "❌ Отмена":
-        await message.answer("❌ Ввод адреса отменен.", reply_markup=get_main_keyboard())
+    if message.text in CANCEL_BUTTONS:
+        await message.answer(get_text("address_cancelled", locale_of(message.from_user)), reply_markup=get_main_keyboard(locale_of(message.from_user)))
         await state.clear()
         return
     
     address = message.text
-    db.update_address(message.from_user.id, address)
+    event_id = await app.db.get_current_event(message.from_user.id)
+    await app.db.update_address(event_id, message.from_user.id, address)
     
     await message.answer(
-        "✅ Адрес успешно сохранен!\n"
-        "Теперь ваш Тайный Санта знает, куда отправить подарок.",
-        reply_markup=get_main_keyboard()
+        get_text("address_saved", locale_of(message.from_user)),
+        reply_markup=get_main_keyboard(locale_of(message.from_user))
     )
     await state.clear()
 
 # Кнопка "Узнать своего получателя"
-@dp.message(F.text == "🎁 Узнать своего получателя")
-async def get_recipient_info(message: Message):
+@on_button("my_recipient")
+async def get_recipient_info(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
-    if not db.is_draw_completed():
-        await message.answer("Жеребьевка еще не проведена! Ожидайте начала.")
+    event_id = await app.db.get_current_event(user_id)
+    if not await app.db.is_draw_completed(event_id):
+        await message.answer(get_text("draw_not_done", locale_of(message.from_user)))
         return
     
-    recipient = db.get_recipient(user_id)
+    recipient = await app.db.get_recipient(event_id, user_id)
     if not recipient:
-        await message.answer("Вы не участвуете в текущей жеребьевке.")
+        await message.answer(get_text("not_in_draw", locale_of(message.from_user)))
         return
     
     # Отправляем информацию о получателе
-    recipient_info = (
-        f"🎅 Ваш получатель: {recipient[2]}\n"
-        f"👤 Username: @{recipient[1] if recipient[1] else 'не указан'}\n"
+    locale = locale_of(message.from_user)
+    recipient_info = get_text(
+        "recipient", locale, name=recipient.full_name,
+        username=recipient.username or get_text("username_unknown", locale)
     )
     
     # Проверяем, указал ли получатель адрес
-    if recipient[3]:  # address
-        recipient_info += f"📦 Адрес доставки: {recipient[3]}"
+    if recipient.address:
+        recipient_info += get_text("recipient_address", locale, address=recipient.address)
     else:
-        recipient_info += "📦 Адрес еще не указан. Напомните получателю указать адрес!"
+        recipient_info += get_text("recipient_no_address", locale)
     
     await message.answer(recipient_info)
 
 # Кнопка "Отправить QR-код и адрес выдачи"
-@dp.message(F.text == "📦 Отправить QR-код и адрес выдачи")
+@on_button("send_qr")
 async def request_qr_and_address(message: Message, state: FSMContext):
     await message.answer(
-        "📦 **Отправка данных для получения подарка**\n\n"
-        "1️⃣ **Сначала отправьте фото QR-кода**\n"
-        "(сфотографируйте или загрузите готовое изображение)\n\n"
-        "2️⃣ **Затем введите адрес пункта выдачи**\n"
-        "Формат: Город, адрес пункта, время работы\n\n"
-        "Пример QR-кода от СДЭК/Boxberry/Почты России:",
-        reply_markup=get_cancel_keyboard()
+        get_text("qr_prompt", locale_of(message.from_user)),
+        reply_markup=get_cancel_keyboard(locale_of(message.from_user))
     )
     await state.set_state(Form.waiting_for_qr_photo)
 
 # Обработка фото QR-кода
-@dp.message(Form.waiting_for_qr_photo, F.photo)
+@router.message(Form.waiting_for_qr_photo, F.photo)
 async def process_qr_photo(message: Message, state: FSMContext):
-    """Сохраняем фото QR-кода и запрашиваем адрес"""
-    # Сохраняем file_id фото во временное хранилище
+    """Проверяем фото QR-кода, сохраняем его и запрашиваем адрес"""
     photo = message.photo[-1]  # Самое качественное фото
-    await state.update_data(qr_photo_id=photo.file_id)
+    # Фото скачивается и распознается до того, как уйдет получателю (media.py)
+    status, qr_payload = await app.media.check(app.bot, photo)
+    if status == QR_UNREADABLE:
+        await message.answer(get_text("qr_unreadable", locale_of(message.from_user)))
+        return
+    if status == QR_TOO_LARGE:
+        await message.answer(get_text("qr_too_large", locale_of(message.from_user)))
+        return
+    # Сохраняем file_id (повторно отправляется без загрузки) и содержимое QR-кода
+    await state.update_data(qr_photo_id=photo.file_id, qr_payload=qr_payload)
     
     await message.answer(
-        "✅ **QR-код принят!**\n\n"
-        "Теперь введите адрес пункта выдачи:\n\n"
-        "**Формат:**\n"
-        "• Город\n"
-        "• Адрес пункта\n"
-        "• Время работы\n"
-        "• Дополнительная информация (если нужно)\n\n"
-        "Пример:\n"
-        "Москва, ул. Тверская, д. 10, ПВЗ СДЭК\n"
-        "Пн-Пт: 10:00-20:00, Сб: 11:00-18:00\n"
-        "Код для получения: 123-456",
-        reply_markup=get_cancel_keyboard()
+        get_text("qr_accepted", locale_of(message.from_user)),
+        reply_markup=get_cancel_keyboard(locale_of(message.from_user))
     )
     await state.set_state(Form.waiting_for_pickup_address)
 
 # Если отправили не фото в состоянии ожидания QR-кода
-@dp.message(Form.waiting_for_qr_photo)
+@router.message(Form.waiting_for_qr_photo)
 async def wrong_qr_format(message: Message, state: FSMContext):
     """Если отправили не фото"""
-    if message.text == "❌ Отмена":
-        await message.answer("❌ Отправка QR-кода отменена.", reply_markup=get_main_keyboard())
+    if message.text in CANCEL_BUTTONS:
+        await message.answer(get_text("qr_cancelled", locale_of(message.from_user)), reply_markup=get_main_keyboard(locale_of(message.from_user)))
         await state.clear()
         return
     
-    await message.answer(
-        "❌ Пожалуйста, отправьте именно **фото QR-кода**.\n"
-        "Нажмите на скрепку 📎 и выберите фото из галереи."
-    )
+    await message.answer(get_text("qr_wrong_format", locale_of(message.from_user)))
 
 # Обработка адреса пункта выдачи
-@dp.message(Form.waiting_for_pickup_address)
+@router.message(Form.waiting_for_pickup_address)
 async def process_pickup_address(message: Message, state: FSMContext):
     """Получаем адрес и отправляем всё получателю"""
-    if message.text == "❌ Отмена":
-        await message.answer("❌ Отправка данных отменена.", reply_markup=get_main_keyboard())
+    if message.text in CANCEL_BUTTONS:
+        await message.answer(get_text("handoff_cancelled", locale_of(message.from_user)), reply_markup=get_main_keyboard(locale_of(message.from_user)))
         await state.clear()
         return
     
@@ -219,190 +238,58 @@ async def process_pickup_address(message: Message, state: FSMContext):
     qr_photo_id = user_data.get('qr_photo_id')
     
     if not qr_photo_id:
-        await message.answer("❌ Ошибка: QR-код не найден. Начните заново.", reply_markup=get_main_keyboard())
+        await message.answer(get_text("qr_missing", locale_of(message.from_user)), reply_markup=get_main_keyboard(locale_of(message.from_user)))
         await state.clear()
         return
     
     santa_id = message.from_user.id
-    santa_info = db.get_participant(santa_id)
+    event_id = await app.db.get_current_event(santa_id)
     
     # Получаем информацию о получателе
-    recipient = db.get_recipient(santa_id)
-    
-    if recipient and recipient[0]:
-        recipient_id = recipient[0]
-        
-        try:
-            # Отправляем получателю ВСЁ одним сообщением
-            await bot.send_photo(
-                chat_id=recipient_id,
-                photo=qr_photo_id,
-                caption=(
-                    "🎁 **ВАШ ПОДАРОК ГОТОВ К ПОЛУЧЕНИЮ!**\n\n"
-                    f"🎅 **От Тайного Санты:** {santa_info[2]}\n"
-                    f"📱 @{santa_info[1] if santa_info[1] else 'без username'}\n\n"
-                    "📍 **АДРЕС ПУНКТА ВЫДАЧИ:**\n"
-                    f"{pickup_address}\n\n"
-                    "📷 **QR-код прикреплен выше**\n"
-                    "Покажите его на кассе для получения посылки.\n\n"
-                    "⏰ **Не забудьте взять с собой паспорт!**"
-                )
-            )
-            
-            # Сохраняем данные в базу
-            db.update_gift_code(santa_id, f"QR+ADDRESS:{qr_photo_id[:20]}...")
-            
-            await message.answer(
-                "✅ **Отлично! Данные отправлены получателю!**\n\n"
-                "Ваш получатель получил:\n"
-                "• Фото QR-кода\n"
-                "• Адрес пункта выдачи\n"
-                "• Инструкции по получению\n\n"
-                "Теперь осталось только ждать, когда он заберет подарок! 🎄",
-                reply_markup=get_main_keyboard()
-            )
-            
-        except Exception as e:
-            logger.error(f"Ошибка отправки: {e}")
-            await message.answer(
-                "❌ Не удалось отправить данные получателю.\n"
-                "Возможно, он заблокировал бота.",
-                reply_markup=get_main_keyboard()
-            )
-    else:
-        await message.answer(
-            "❌ Получатель не найден. Проверьте, проведена ли жеребьевка.",
-            reply_markup=get_main_keyboard()
+    recipient = await app.db.get_recipient(event_id, santa_id)
+    
+    if recipient and recipient.user_id:
+        # Передача записывается в очередь вместе с полным file_id и уходит получателю в фоне (outbox.py).
+        # Ключ по сообщению с адресом: повторно доставленный апдейт не создаст вторую передачу
+        await app.db.create_gift_handoff(
+            f"{event_id}:{santa_id}:{message.message_id}", event_id, santa_id, recipient.user_id,
+            qr_photo_id, pickup_address, user_data.get('qr_payload')
         )
-    
-    await state.clear()
-
-# Админ: список участников
-@dp.message(F.text == "👥 Список участников")
-async def list_participants(message: Message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    participants = db.get_all_participants()
-    
-    if not participants:
-        await message.answer("Участников пока нет.")
-        return
-    
-    response = "📋 Список участников:\n\n"
-    for p in participants:
-        status = "✅" if p[3] else "❌"  # p[3] = address
-        gift_status = "🎁" if p[4] else "⏳"  # p[4] = gift_code
-        response += f"{p[2]} (@{p[1]}) - Адрес: {status} Подарок: {gift_status}\n"
-    
-    await message.answer(response)
-
-# Админ: провести жеребьевку
-@dp.message(F.text == "🎲 Провести жеребьевку")
-async def perform_draw(message: Message):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    participants = db.get_all_participants()
-    
-    if len(participants) < 2:
-        await message.answer("❌ Для жеребьевки нужно минимум 2 участника!")
-        return
-    
-    success = db.perform_draw()
-    
-    if success:
-        # Отправляем каждому участнику информацию о его получателе
-        for participant in participants:
-            user_id = participant[0]
-            recipient = db.get_recipient(user_id)
-            
-            if recipient:
-                try:
-                    await bot.send_message(
-                        user_id,
-                        f"🎉 Жеребьевка проведена!\n\n"
-                        f"🎅 Ваш получатель: {recipient[2]}\n"
-                        f"👤 @{recipient[1] if recipient[1] else 'username не указан'}\n\n"
-                        "Теперь вы можете отправить подарок!\n"
-                        "Не забудьте потом отправить QR-код и адрес выдачи."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify {user_id}: {e}")
+        await app.fan_out('wake_outbox')
         
         await message.answer(
-            f"✅ Жеребьевка успешно проведена для {len(participants)} участников!\n"
-            "Все участники получили уведомления."
+            get_text("handoff_accepted", locale_of(message.from_user)),
+            reply_markup=get_main_keyboard(locale_of(message.from_user))
         )
     else:
-        await message.answer("❌ Ошибка при проведении жеребьевки!")
-
-# Админ: сделать рассылку
-@dp.message(F.text == "📢 Сделать рассылку")
-async def start_broadcast(message: Message, state: FSMContext):
-    if str(message.from_user.id) != ADMIN_ID:
-        return
-    
-    await message.answer(
-        "Введите сообщение для рассылки всем участникам:",
-        reply_markup=types.ReplyKeyboardRemove()
-    )
-    await state.set_state(Form.admin_message)
-
-# Обработка рассылки
-@dp.message(Form.admin_message)
-async def process_broadcast(message: Message, state: FSMContext):
-    participants = db.get_all_participants()
-    sent = 0
-    failed = 0
-    
-    for participant in participants:
-        try:
-            await bot.send_message(
-                participant[0],  # user_id
-                f"📢 Сообщение от организатора:\n\n{message.text}"
-            )
-            sent += 1
-            await asyncio.sleep(0.05)  # Защита от лимитов Telegram
-        except Exception as e:
-            failed += 1
-            logger.error(f"Failed to send to {participant[0]}: {e}")
+        await message.answer(
+            get_text("recipient_not_found", locale_of(message.from_user)),
+            reply_markup=get_main_keyboard(locale_of(message.from_user))
+        )
     
-    await message.answer(
-        f"✅ Рассылка завершена:\n"
-        f"• Отправлено: {sent}\n"
-        f"• Не удалось: {failed}",
-        reply_markup=get_admin_keyboard()
-    )
     await state.clear()
 
+# Кнопки и списки организатора
+on_button("participants")(admin_handler("list_participants"))
+on_button("draw")(admin_handler("perform_draw"))
+on_button("resend")(admin_handler("resend_draw_notifications"))
+on_button("broadcast")(admin_handler("start_broadcast"))
+router.callback_query(F.data.startswith("plist:"))(admin_handler("participants_page"))
+router.callback_query(F.data == "plist_export")(admin_handler("export_participants"))
+router.message(Form.admin_message)(admin_handler("process_broadcast"))
+
 # Кнопка "Назад" для админа
-@dp.message(F.text == "◀️ Назад")
-async def back_to_main(message: Message):
+@on_button("back")
+async def back_to_main(message: Message, state: FSMContext):
     await cmd_start(message)
 
 # Кнопка "Помощь"
-@dp.message(F.text == "ℹ️ Помощь")
-async def show_help(message: Message):
-    help_text = (
-        "🎅 **Помощь по Тайному Санте** 🎄\n\n"
-        "**Как это работает:**\n"
-        "1. 🎅 **Стать участником** - регистрация в игре\n"
-        "2. 📦 **Указать адрес доставки** - куда вам отправят подарок\n"
-        "3. 🎁 **Узнать своего получателя** - после жеребьевки\n"
-        "4. 📦 **Отправить QR-код и адрес выдачи** - когда отправили подарок\n\n"
-        "**Про отправку QR-кода:**\n"
-        "• Сфотографируйте QR-код из приложения доставки\n"
-        "• Отправьте фото боту\n"
-        "• Введите адрес пункта выдачи\n"
-        "• Получатель получит всё для получения подарка!\n\n"
-        "**Ваш Санта также отправит вам QR-код для получения!**\n\n"
-        "Вопросы? Обращайтесь к организатору."
-    )
-    await message.answer(help_text)
+@on_button("help")
+async def show_help(message: Message, state: FSMContext):
+    await message.answer(get_text("help", locale_of(message.from_user)))
 
 # Обработка команды отмены для всех состояний
-@dp.message(F.text == "❌ Отмена")
+@router.message(F.text.in_(CANCEL_BUTTONS))
 async def cancel_handler(message: Message, state: FSMContext):
     current_state = await state.get_state()
     if current_state is None:
@@ -410,14 +297,34 @@ async def cancel_handler(message: Message, state: FSMContext):
     
     await state.clear()
     await message.answer(
-        "❌ Действие отменено.",
-        reply_markup=get_main_keyboard()
+        get_text("cancelled", locale_of(message.from_user)),
+        reply_markup=get_main_keyboard(locale_of(message.from_user))
     )
 
 # Основная функция
 async def main():
-    print("Бот Тайный Санта запущен...")
-    await dp.start_polling(bot)
+    dp = app.create_app(router)
+    await dp.start_polling(app.bot)
+
+def run_webhook():
+    from aiohttp import web
+    from webhook import create_webhook_app
+    
+    dp = app.create_app(router)
+    web_app = create_webhook_app(dp, app.bot, app.inflight, WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    web.run_app(web_app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+
+async def profile_startup(started):
+    """python bot.py --profile-startup: время импортов и создания объектов, без запуска бота"""
+    app.create_app(router)
+    print(app.startup_report(started))
+    await app.db.close()
+    await app.bot.session.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if "--profile-startup" in sys.argv:
+        asyncio.run(profile_startup(STARTED_AT))
+    elif BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,292 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from metrics import TELEGRAM_RETRIES, TELEGRAM_SENDS
+
+logger = logging.getLogger(__name__)
+
+# Результаты доставки одного сообщения
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+def draw_text(recipient_name, recipient_username):
+    """Текст уведомления санте о его получателе"""
+    return (
+        f"🎉 Жеребьевка проведена!\n\n"
+        f"🎅 Ваш получатель: {recipient_name}\n"
+        f"👤 @{recipient_username if recipient_username else 'username не указан'}\n\n"
+        "Теперь вы можете отправить подарок!\n"
+        "Не забудьте потом отправить QR-код и адрес выдачи."
+    )
+
+
+class TokenBucket:
+    """
+    Ведро токенов: не более rate сообщений в секунду с запасом capacity.
+    pause() останавливает выдачу токенов целиком - так обрабатывается 429 (RetryAfter).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Sender:
+    """
+    Отправка сообщений с учетом лимитов Telegram:
+    общий лимит на бота, не чаще одного сообщения в чат за per_chat_interval
+    и не более concurrency одновременных запросов.
+    """
+
+    def __init__(self, rate=30, per_chat_interval=1.0, concurrency=20, max_retries=5):
+        self._bucket = TokenBucket(rate)
+        self._per_chat_interval = per_chat_interval
+        self._next_allowed = {}  # chat_id -> время, раньше которого в чат писать нельзя
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_retries = max_retries
+
+    async def _wait_for_chat(self, chat_id):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, 0.0)
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+            now = next_allowed
+        self._next_allowed[chat_id] = now + self._per_chat_interval
+        # Не даем словарю расти бесконечно: старые записи уже ничего не ограничивают
+        if len(self._next_allowed) > 10_000:
+            self._next_allowed = {c: t for c, t in self._next_allowed.items() if t > now}
+
+    async def deliver(self, chat_id, send):
+        """
+        Выполняет send() - фабрику корутины отправки в chat_id.
+        RetryAfter не считается ошибкой: ведро ставится на паузу и попытка повторяется.
+        """
+        result = await self._deliver(chat_id, send)
+        TELEGRAM_SENDS.inc(result)
+        return result
+
+    async def _deliver(self, chat_id, send):
+        async with self._semaphore:
+            for _ in range(self._max_retries):
+                await self._wait_for_chat(chat_id)
+                await self._bucket.acquire()
+                try:
+                    await send()
+                    return SENT
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Flood control, пауза {e.retry_after} с")
+                    TELEGRAM_RETRIES.inc()
+                    self._bucket.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    return BLOCKED
+                except Exception as e:
+                    logger.error(f"Failed to send to {chat_id}: {e}")
+                    return FAILED
+            return FAILED
+
+
+class Broadcaster:
+    """
+    Рассылки, переживающие перезапуск.
+    Задание хранится в broadcast_jobs; получатели берутся пачками по user_id,
+    после каждой пачки в базу записывается последний обработанный user_id.
+    """
+
+    # Сколько недоставленных участников перечислить в итоге рассылки жеребьевки
+    UNDELIVERED_SHOWN = 20
+
+    def __init__(self, bot, db, sender, chunk_size=500, progress_interval=5.0):
+        self._bot = bot
+        self._db = db
+        self._sender = sender
+        self._chunk_size = chunk_size
+        self._progress_interval = progress_interval
+        self._tasks = set()
+
+    async def start(self, event_id, text, admin_chat_id):
+        """Создает задание и сразу возвращает управление; рассылка идет в фоне"""
+        total = await self._db.count_active_participants(event_id)
+        progress = await self._bot.send_message(admin_chat_id, f"📢 Рассылка запущена: 0 из {total}")
+        job_id = await self._db.create_broadcast_job(event_id, text, admin_chat_id, progress.message_id, total)
+        self._spawn(self._run(await self._db.get_broadcast_job(job_id)))
+        return job_id
+
+    async def resume(self):
+        """Продолжает рассылки, прерванные остановкой бота"""
+        for job in await self._db.get_unfinished_broadcast_jobs():
+            logger.info(f"Продолжаем рассылку #{job['id']} с user_id > {job['last_user_id']}")
+            self._spawn(self._run(job))
+
+    async def stop(self):
+        """
+        Прерывает фоновые рассылки при остановке бота.
+        Рассылки продолжатся после запуска (resume), недоставленные результаты жеребьевки можно дослать.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        text = f"📢 Сообщение от организатора:\n\n{job['text']}"
+        last_user_id, sent, failed = job['last_user_id'], job['sent'], job['failed']
+        last_progress = time.monotonic()
+
+        while True:
+            user_ids = await self._db.get_active_user_ids(
+                job['event_id'], after_id=last_user_id, limit=self._chunk_size
+            )
+            if not user_ids:
+                break
+
+            results = await asyncio.gather(*(
+                self._sender.deliver(user_id, lambda user_id=user_id: self._bot.send_message(user_id, text))
+                for user_id in user_ids
+            ))
+            sent += results.count(SENT)
+            failed += len(results) - results.count(SENT)
+            last_user_id = user_ids[-1]
+            await self._db.update_broadcast_progress(job['id'], last_user_id, sent, failed)
+
+            if time.monotonic() - last_progress >= self._progress_interval:
+                last_progress = time.monotonic()
+                await self._edit_progress(job, f"📢 Рассылка идет: {sent + failed} из {job['total']}")
+
+        await self._db.finish_broadcast_job(job['id'])
+        await self._edit_progress(
+            job,
+            f"✅ Рассылка завершена:\n"
+            f"• Отправлено: {sent}\n"
+            f"• Не удалось: {failed}"
+        )
+
+    async def notify_draw(self, event_id, admin_chat_id, assignments=None, undelivered_only=False):
+        """
+        Рассылает участникам игры их получателей в фоне.
+        assignments - готовый список пар (точечные изменения); без него пары читаются
+        из базы страницами по chunk_size, и вся жеребьевка в память не загружается.
+        Статус доставки каждому санте сохраняется, чтобы потом дослать только недоставленные.
+        """
+        if assignments is not None:
+            total = len(assignments)
+        else:
+            total = await self._db.count_assignments(event_id, undelivered_only)
+        progress = await self._bot.send_message(
+            admin_chat_id, f"🎉 Рассылаем результаты жеребьевки: 0 из {total}"
+        )
+        job = {
+            'id': f'draw-{event_id}',
+            'event_id': event_id,
+            'admin_chat_id': admin_chat_id,
+            'progress_message_id': progress.message_id,
+            'total': total,
+        }
+        chunks = self._assignment_chunks(event_id, assignments, undelivered_only)
+        self._spawn(self._run_draw_notifications(job, chunks))
+
+    async def _assignment_chunks(self, event_id, assignments, undelivered_only):
+        if assignments is not None:
+            for start in range(0, len(assignments), self._chunk_size):
+                yield assignments[start:start + self._chunk_size]
+            return
+        after_id = 0
+        while True:
+            chunk = await self._db.get_assignments(
+                event_id, undelivered_only=undelivered_only, after_id=after_id, limit=self._chunk_size
+            )
+            if not chunk:
+                return
+            yield chunk
+            after_id = chunk[-1][0]
+
+    async def _run_draw_notifications(self, job, chunks):
+        sent = done = 0
+        undelivered = []  # (santa_id, status) первых UNDELIVERED_SHOWN недоставленных
+        last_progress = time.monotonic()
+        async for chunk in chunks:
+            results = await asyncio.gather(*(
+                self._sender.deliver(santa_id, lambda santa_id=santa_id, text=draw_text(name, username):
+                                     self._bot.send_message(santa_id, text))
+                for santa_id, _, name, username in chunk
+            ))
+            await self._db.set_notification_statuses(
+                job['event_id'], [(santa_id, status) for (santa_id, *_), status in zip(chunk, results)]
+            )
+            sent += results.count(SENT)
+            done += len(chunk)
+            undelivered.extend(
+                (santa_id, status) for (santa_id, *_), status in zip(chunk, results) if status != SENT
+            )
+            del undelivered[self.UNDELIVERED_SHOWN:]
+
+            if time.monotonic() - last_progress >= self._progress_interval:
+                last_progress = time.monotonic()
+                await self._edit_progress(
+                    job, f"🎉 Рассылаем результаты жеребьевки: {done} из {job['total']}"
+                )
+
+        failed = done - sent
+        text = (
+            f"✅ Результаты жеребьевки разосланы:\n"
+            f"• Доставлено: {sent}\n"
+            f"• Не доставлено: {failed}"
+        )
+        if failed:
+            text += "\n\nНе получили уведомление:\n" + await self._undelivered_list(job['event_id'], undelivered)
+            if failed > len(undelivered):
+                text += f"\n…и еще {failed - len(undelivered)}"
+            text += "\n\nДослать недоставленные: кнопка «📨 Дослать уведомления»"
+        await self._edit_progress(job, text)
+
+    async def _undelivered_list(self, event_id, undelivered):
+        lines = []
+        for santa_id, status in undelivered:
+            participant = await self._db.get_participant(event_id, santa_id)
+            if participant is None:
+                name = str(santa_id)
+            elif participant.username:
+                name = f"@{participant.username}"
+            else:
+                name = participant.full_name or str(santa_id)
+            if len(name) > 40:
+                name = name[:39] + "…"
+            lines.append(f"• {name} ({santa_id})" + (" - заблокировал бота" if status == BLOCKED else ""))
+        return "\n".join(lines)
+
+    async def _edit_progress(self, job, text):
+        try:
+            await self._bot.edit_message_text(
+                text, chat_id=job['admin_chat_id'], message_id=job['progress_message_id']
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки #{job['id']}: {e}")
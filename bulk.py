@@ -0,0 +1,123 @@
+# bulk.py
+"""
+Массовая загрузка участников и выгрузка результатов из файлов CSV/JSONL.
+
+    python bulk.py import employees.csv --event 2
+    python bulk.py export-participants participants.jsonl --event 2
+    python bulk.py export-draw draw-2024.csv --event 2
+
+Файл читается построчно, в базу пишется пачками (Database.import_participants),
+поэтому память не зависит от размера файла. Колонки: user_id (обязательно),
+username, full_name, address - как в выгрузке участников, ее можно загрузить обратно.
+Пока бот запущен, лучше загружать через команду /import: она сбрасывает кэши бота.
+"""
+import argparse
+import csv
+import json
+import os
+
+FORMATS = {'.csv': 'csv', '.txt': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+COLUMNS = ('username', 'full_name', 'address')
+
+
+def file_format(path):
+    """csv или jsonl по расширению файла"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Неизвестный формат файла {extension or path}: нужен .csv или .jsonl")
+    return FORMATS[extension]
+
+
+class ImportStats:
+    """Счетчики загрузки: сколько строк пропущено и примеры ошибок (не больше max_errors)"""
+
+    def __init__(self, max_errors=5):
+        self.skipped = 0
+        self.errors = []
+        self._max_errors = max_errors
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        if len(self.errors) < self._max_errors:
+            self.errors.append(f"строка {line}: {reason}")
+
+
+def _raw_rows(f, fmt):
+    """(номер строки, словарь) из открытого файла; разделитель CSV определяется по началу файла"""
+    if fmt == 'jsonl':
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+        return
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(f, dialect=dialect)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_participants(path, stats=None):
+    """
+    Участники из файла по одному: {'user_id', 'username', 'full_name', 'address'}.
+    Строки без числового user_id пропускаются и учитываются в stats.
+    """
+    stats = stats or ImportStats()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line, row in _raw_rows(f, file_format(path)):
+            if not isinstance(row, dict):
+                stats.skip(line, "не удалось разобрать строку")
+                continue
+            try:
+                user_id = int(str(row.get('user_id') or '').strip())
+            except (ValueError, AttributeError):
+                stats.skip(line, "нет user_id")
+                continue
+            participant = {'user_id': user_id}
+            for column in COLUMNS:
+                value = row.get(column)
+                value = str(value).strip() if value is not None else ''
+                participant[column] = value or None
+            if participant['username']:
+                participant['username'] = participant['username'].lstrip('@')
+            yield participant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка и выгрузка участников Тайного Санты")
+    parser.add_argument('command', choices=('import', 'export-participants', 'export-draw'))
+    parser.add_argument('path', help="Файл .csv или .jsonl")
+    parser.add_argument('--event', type=int, default=1, help="Номер игры")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Строк в одной транзакции")
+    args = parser.parse_args()
+
+    from config import DB_NAME
+    from database import Database
+
+    db = Database(DB_NAME)
+    try:
+        if args.command == 'import':
+            stats = ImportStats()
+            imported = db.import_participants(args.event, read_participants(args.path, stats), args.chunk_size)
+            print(f"Загружено участников: {imported}, пропущено строк: {stats.skipped}")
+            for error in stats.errors:
+                print(f"  {error}")
+        elif args.command == 'export-participants':
+            count = db.export_participants(args.event, args.path, file_format(args.path), args.chunk_size)
+            print(f"Выгружено участников: {count}")
+        else:
+            count = db.export_draw_results(args.event, args.path, file_format(args.path), args.chunk_size)
+            print(f"Выгружено пар: {count}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
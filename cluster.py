@@ -0,0 +1,286 @@
+# cluster.py
+"""
+Запуск бота в нескольких процессах: python cluster.py
+
+Супервизор получает апдейты (polling или webhook, как в bot.py) и раскладывает их
+по воркерам по user_id, поэтому все апдейты одного пользователя (и его состояние FSM)
+обрабатывает один и тот же процесс. Воркеры работают с общей базой SQLite.
+
+Координация между воркерами:
+- сброс кэшей (адрес, жеребьевка) пересылается через супервизор всем остальным воркерам;
+- рассылки, уведомления о жеребьевке, напоминания и передачи подарков отправляет только
+  воркер 0 (app.fan_out): у него весь лимит Telegram и единый интервал между сообщениями в чат.
+  Остальные воркеры передают ему задачи через супервизор.
+
+Упавший воркер супервизор запускает заново с новой очередью: старую мог оставить
+заблокированной процесс, убитый во время чтения, поэтому ее апдейты теряются (число - в логе).
+Воркер забирает из очереди следующий апдейт, только когда в обработке меньше
+WORKER_CONCURRENCY апдейтов, поэтому необработанные апдейты ждут в очереди, а не в памяти воркера.
+Очередь воркера ограничена (WORKER_QUEUE_SIZE): если воркер не успевает,
+новые апдейты его пользователей отклоняются с записью в лог (webhook отвечает 503,
+и Telegram повторит их позже).
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+
+import aiohttp
+from aiohttp import web
+
+import config
+from config import (
+    BOT_TOKEN, BOT_MODE, WORKERS, WORKER_QUEUE_SIZE, WORKER_CONCURRENCY, TELEGRAM_API_URL,
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, SHUTDOWN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Где в апдейте искать пользователя
+USER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request',
+)
+
+
+def shard_for(update, workers):
+    """Номер воркера для апдейта: по user_id отправителя"""
+    for field in USER_FIELDS:
+        obj = update.get(field)
+        if obj:
+            user = obj.get('from') or obj.get('user')
+            if user:
+                return user['id'] % workers
+    return 0
+
+
+# Воркер
+
+def worker_main(shard_id, workers, inbox, control):
+    # Настройки воркера меняются до импорта бота: app.py берет их из config при импорте
+    config.SHARD_ID = shard_id
+    config.BOT_MODE = 'worker'  # Webhook регистрирует супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Останавливает супервизор
+
+    import app
+    import bot
+    app.create_app(bot.router)
+    asyncio.run(_run_worker(app, shard_id, inbox, control))
+
+
+async def _run_worker(app, shard_id, inbox, control):
+    loop = asyncio.get_running_loop()
+    await app.db.set_invalidation_listener(
+        lambda event_id, user_id: control.put(('invalidate', shard_id, (event_id, user_id)))
+    )
+    if shard_id != 0:
+        app.fanout_forwarder = lambda task, args: control.put(('fanout', shard_id, (task, args)))
+    await app.dp.emit_startup(bot=app.bot, **app.dp.workflow_data)
+
+    tasks = set()
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+
+    def done(task):
+        tasks.discard(task)
+        slots.release()
+
+    while True:
+        # Место в обработке занимается до чтения очереди: иначе медленный воркер
+        # перекладывал бы всю очередь в задачи, и она никогда не переполнялась бы
+        await slots.acquire()
+        item = await loop.run_in_executor(None, inbox.get)
+        if item is None:
+            break
+        kind, payload = item
+        if kind == 'update':
+            task = asyncio.create_task(app.dp.feed_raw_update(app.bot, payload))
+        elif kind == 'fanout':
+            task = asyncio.create_task(app.run_fan_out(payload[0], *payload[1]))
+        else:
+            await app.db.apply_invalidation(*payload)
+            slots.release()
+            continue
+        tasks.add(task)
+        task.add_done_callback(done)
+
+    if tasks:
+        await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+    await app.dp.emit_shutdown(bot=app.bot, **app.dp.workflow_data)
+    await app.bot.session.close()
+
+
+# Супервизор
+
+class Supervisor:
+    # Как часто проверять, живы ли воркеры (секунды)
+    WATCH_INTERVAL = 1.0
+
+    def __init__(self, workers, queue_size=WORKER_QUEUE_SIZE):
+        self.workers = workers
+        self._queue_size = queue_size
+        self._context = multiprocessing.get_context('spawn')
+        self.inboxes = [self._context.Queue(queue_size) for _ in range(workers)]
+        self.control = self._context.Queue()
+        self.processes = [self._spawn(i) for i in range(workers)]
+        self.restarts = 0
+        self._stopping = threading.Event()
+
+    def _spawn(self, shard_id):
+        return self._context.Process(
+            target=worker_main, args=(shard_id, self.workers, self.inboxes[shard_id], self.control),
+            name=f'santa-{shard_id}',
+        )
+
+    def route(self, update):
+        """Кладет апдейт в очередь воркера; False - очередь переполнена, апдейт отклонен"""
+        shard_id = shard_for(update, self.workers)
+        try:
+            # put_nowait не ждет: порядок апдейтов одного пользователя сохраняется
+            self.inboxes[shard_id].put_nowait(('update', update))
+        except queue.Full:
+            logger.warning(f"Очередь воркера {shard_id} переполнена, апдейт {update.get('update_id')} отклонен")
+            return False
+        return True
+
+    def _put(self, shard_id, item):
+        # Служебные сообщения ждут места в очереди, но недолго: зависший воркер не должен останавливать остальных
+        try:
+            self.inboxes[shard_id].put(item, timeout=self.WATCH_INTERVAL)
+        except queue.Full:
+            logger.warning(f"Очередь воркера {shard_id} переполнена, {item[0]} не доставлено")
+
+    def _forward_control(self):
+        """Пересылает сброс кэша от одного воркера всем остальным, задачи рассылки - воркеру 0"""
+        while True:
+            message = self.control.get()
+            if message is None:
+                return
+            kind, origin, payload = message
+            if kind == 'fanout':
+                self._put(0, (kind, payload))
+                continue
+            for shard_id in range(self.workers):
+                if shard_id != origin:
+                    self._put(shard_id, (kind, payload))
+
+    def _watch(self):
+        """Запускает заново упавшие воркеры"""
+        while not self._stopping.wait(self.WATCH_INTERVAL):
+            for shard_id, process in enumerate(self.processes):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                logger.error(
+                    f"Воркер {shard_id} завершился (код {process.exitcode}), запускаем заново; "
+                    f"потеряно апдейтов из его очереди: {self.inboxes[shard_id].qsize()}"
+                )
+                self.inboxes[shard_id] = self._context.Queue(self._queue_size)
+                self.processes[shard_id] = self._spawn(shard_id)
+                self.processes[shard_id].start()
+                self.restarts += 1
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self._forward_control, daemon=True).start()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+        for shard_id, inbox in enumerate(self.inboxes):
+            try:
+                inbox.put(None, timeout=SHUTDOWN_TIMEOUT)
+            except queue.Full:
+                logger.error(f"Воркер {shard_id} не разбирает очередь, останавливаем принудительно")
+                self.processes[shard_id].terminate()
+        for process in self.processes:
+            process.join(SHUTDOWN_TIMEOUT + 5)
+        self.control.put(None)
+
+    def alive(self):
+        return sum(process.is_alive() for process in self.processes)
+
+
+async def poll_updates(session, supervisor, stop):
+    """Long polling напрямую через Bot API: апдейты остаются JSON и сразу уходят воркерам"""
+    url = f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/getUpdates'
+    offset = None
+    while not stop.is_set():
+        params = {'timeout': 30}
+        if offset is not None:
+            params['offset'] = offset
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=40)) as response:
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"getUpdates: {e}")
+            await asyncio.sleep(1)
+            continue
+        if not data.get('ok'):
+            logger.error(f"getUpdates: {data.get('description')}")
+            await asyncio.sleep(1)
+            continue
+        for update in data['result']:
+            offset = update['update_id'] + 1
+            supervisor.route(update)
+
+
+async def serve_webhook(session, supervisor, stop):
+    async def receive(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        # Переполненная очередь: 503, и Telegram доставит апдейт повторно
+        return web.Response(status=200 if supervisor.route(await request.json()) else 503)
+
+    async def health(request):
+        alive = supervisor.alive()
+        return web.json_response(
+            {'status': 'ok' if alive == supervisor.workers else 'degraded', 'workers': alive,
+             'restarts': supervisor.restarts},
+            status=200 if alive else 503,
+        )
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    app.router.add_get('/health', health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    params = {'url': f'{WEBHOOK_BASE_URL}{WEBHOOK_PATH}'}
+    if WEBHOOK_SECRET:
+        params['secret_token'] = WEBHOOK_SECRET
+    async with session.post(f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/setWebhook', json=params) as response:
+        logger.info(f"setWebhook: {await response.text()}")
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main(workers=WORKERS):
+    logging.basicConfig(level=logging.INFO)
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    print(f"Бот Тайный Санта запущен: {workers} воркеров ({BOT_MODE})...")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    ingress = serve_webhook if BOT_MODE == 'webhook' else poll_updates
+    async with aiohttp.ClientSession() as session:
+        task = asyncio.create_task(ingress(session, supervisor, stop))
+        await stop.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    await loop.run_in_executor(None, supervisor.stop)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
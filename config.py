@@ -5,4 +5,67 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-ADMIN_ID = os.getenv('ADMIN_ID')  # ID администратора для управления
\ No newline at end of file
+ADMIN_ID = os.getenv('ADMIN_ID')  # ID администратора для управления
+
+# База данных
+DB_NAME = os.getenv('DB_NAME', 'santa.db')
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))  # Потоки для запросов к SQLite и число соединений-читателей
+DB_BATCH_WINDOW = float(os.getenv('DB_BATCH_WINDOW_MS', '10')) / 1000  # Окно группового коммита
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '100'))  # Максимум записей в одной транзакции (1 - без группировки)
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '10000'))  # Размер каждого LRU-кэша чтения
+
+# Жеребьевка
+DRAW_AVOID_REPEATS = os.getenv('DRAW_AVOID_REPEATS', '0') == '1'  # Не повторять пары прошлой жеребьевки
+
+# Админка
+PARTICIPANTS_PAGE_SIZE = int(os.getenv('PARTICIPANTS_PAGE_SIZE', '20'))  # Участников на странице списка
+
+# Лимиты Telegram для рассылок
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE', '30'))  # Сообщений в секунду на бота
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv('TELEGRAM_PER_CHAT_INTERVAL', '1'))  # Секунд между сообщениями в один чат
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))  # Одновременных запросов к Bot API
+
+# Защита от частых нажатий (ThrottlingMiddleware): корзина токенов на пользователя
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))  # Апдейтов в секунду в среднем
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))  # Сколько апдейтов подряд можно без ожидания
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', '100000'))  # Сколько корзин держать в памяти
+
+# Напоминания по расписанию (reminders.py, команда /remind)
+REMINDER_INTERVAL = float(os.getenv('REMINDER_INTERVAL_HOURS', '24')) * 3600  # Как часто повторять проход по умолчанию
+REMINDER_COOLDOWN = float(os.getenv('REMINDER_COOLDOWN_HOURS', '20')) * 3600  # Не напоминать одному участнику чаще
+REMINDER_POLL_INTERVAL = float(os.getenv('REMINDER_POLL_INTERVAL', '60'))  # Секунд между проверками расписания
+
+# Журнал изменений (audit.py): снимки состояния и удаление старых записей
+AUDIT_SNAPSHOT_EVERY = int(os.getenv('AUDIT_SNAPSHOT_EVERY', '10000'))  # Записей журнала между снимками игры
+AUDIT_RETENTION = float(os.getenv('AUDIT_RETENTION_DAYS', '365')) * 86400  # Сколько хранить историю
+AUDIT_INTERVAL = float(os.getenv('AUDIT_INTERVAL', '3600'))  # Секунд между проверками журнала
+
+# Проверка фото QR-кода (media.py): распознавание в пуле процессов, нужны pyzbar и Pillow
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))  # Процессов для распознавания
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(10 * 1024 * 1024)))  # Максимальный размер скачиваемого фото
+
+# Режим работы: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')  # Публичный адрес, например https://santa.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))  # Сколько ждать незавершенные обработчики при остановке
+
+# Хранилище состояний FSM: memory, sqlite (в базе бота) или redis
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_TTL = int(os.getenv('FSM_TTL', str(7 * 24 * 3600)))  # Через сколько секунд брошенное состояние забывается
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Метрики Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 - выключено).
+# В cluster.py воркер N слушает METRICS_PORT + N
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+# Несколько процессов (python cluster.py): апдейты делятся между воркерами по user_id
+WORKERS = int(os.getenv('WORKERS', '4'))
+SHARD_ID = int(os.getenv('SHARD_ID', '0'))  # Номер воркера; задается супервизором
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '10000'))  # Апдейтов в очереди воркера, лишние отклоняются
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '500'))  # Апдейтов в обработке у воркера одновременно
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')  # Адрес Bot API
@@ -1,133 +1,1971 @@
 # database.py
+import asyncio
+import csv
+import functools
+import json
+import os
+import queue
+import secrets
 import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+from audit import apply_entry, dump_state, empty_state, load_state
+from draw import draw_pairs, DrawCycle, DrawError
+from metrics import DB_LATENCY
+
+# Игра, в которую попадают пользователи без ссылки-приглашения (и все данные до появления игр)
+DEFAULT_EVENT_ID = 1
+
+# Настройки SQLite, применяемые при открытии соединения
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',     # Читатели не блокируют писателя
+    'PRAGMA synchronous = FULL',     # fsync на каждый коммит: подтверждение записи означает, что она на диске
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',    # ~16 МБ страничного кэша
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Миграции схемы: функция с номером N переводит базу с версии N-1 на N.
+# Изменения схемы добавляются только новой функцией в конец MIGRATIONS.
+
+def _migration_1(cursor):
+    """Исходные таблицы (IF NOT EXISTS - базы, созданные до миграций, тоже подходят)"""
+    # Таблица участников
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS participants (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            address TEXT,
+            gift_code TEXT,
+            recipient_id INTEGER,
+            santa_id INTEGER,
+            is_active BOOLEAN DEFAULT 1,
+            registered_at TIMESTAMP
+        )
+    ''')
+
+    # Таблица жеребьевки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS draw_results (
+            santa_id INTEGER,
+            recipient_id INTEGER,
+            draw_date TIMESTAMP,
+            PRIMARY KEY (santa_id, recipient_id)
+        )
+    ''')
+
+    # Доставка уведомлений о результатах жеребьевки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS draw_notifications (
+            santa_id INTEGER PRIMARY KEY,
+            status TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+    # Задания рассылки: позволяют продолжить рассылку после перезапуска
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            admin_chat_id INTEGER,
+            progress_message_id INTEGER,
+            total INTEGER DEFAULT 0,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+    # Исключения для жеребьевки: кому нельзя дарить (пары, коллеги)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS draw_exclusions (
+            user_id INTEGER,
+            excluded_id INTEGER,
+            PRIMARY KEY (user_id, excluded_id)
+        )
+    ''')
+
+
+def _migration_2(cursor):
+    """Колонка gift_type, индекс по получателю и частичные индексы на горячие выборки"""
+    _add_column(cursor, 'participants', 'gift_type', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_draw_results_recipient ON draw_results (recipient_id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_participants_active
+        ON participants (user_id) WHERE is_active = 1
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_running
+        ON broadcast_jobs (id) WHERE status = 'running'
+    ''')
+
+
+def _migration_3(cursor):
+    """
+    Игры (events): у каждой свои админы, участники, исключения, жеребьевка и рассылки.
+    Все существующие данные переносятся в игру №1.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE,
+            title TEXT,
+            admin_id INTEGER,
+            created_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO events (id, code, title, created_at)
+        VALUES (1, 'default', 'Тайный Санта', ?)
+    ''', (datetime.now(),))
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_admin ON events (admin_id)')
+
+    # Текущая игра пользователя: куда он пришел по ссылке /start <код>
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_events (
+            user_id INTEGER PRIMARY KEY,
+            event_id INTEGER
+        )
+    ''')
+
+    # Пересоздаем таблицы с event_id в составе ключа (SQLite не умеет менять PRIMARY KEY)
+    cursor.execute('''
+        CREATE TABLE participants_new (
+            user_id INTEGER,
+            username TEXT,
+            full_name TEXT,
+            address TEXT,
+            gift_code TEXT,
+            recipient_id INTEGER,
+            santa_id INTEGER,
+            is_active BOOLEAN DEFAULT 1,
+            registered_at TIMESTAMP,
+            gift_type TEXT,
+            event_id INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (event_id, user_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO participants_new
+        SELECT user_id, username, full_name, address, gift_code, recipient_id, santa_id,
+               is_active, registered_at, gift_type, 1
+        FROM participants
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE draw_results_new (
+            event_id INTEGER NOT NULL DEFAULT 1,
+            santa_id INTEGER,
+            recipient_id INTEGER,
+            draw_date TIMESTAMP,
+            PRIMARY KEY (event_id, santa_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO draw_results_new (event_id, santa_id, recipient_id, draw_date)
+        SELECT 1, santa_id, recipient_id, draw_date FROM draw_results
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE draw_notifications_new (
+            event_id INTEGER NOT NULL DEFAULT 1,
+            santa_id INTEGER,
+            status TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (event_id, santa_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO draw_notifications_new (event_id, santa_id, status, updated_at)
+        SELECT 1, santa_id, status, updated_at FROM draw_notifications
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE draw_exclusions_new (
+            event_id INTEGER NOT NULL DEFAULT 1,
+            user_id INTEGER,
+            excluded_id INTEGER,
+            PRIMARY KEY (event_id, user_id, excluded_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO draw_exclusions_new (event_id, user_id, excluded_id)
+        SELECT 1, user_id, excluded_id FROM draw_exclusions
+    ''')
+
+    for table in ('participants', 'draw_results', 'draw_notifications', 'draw_exclusions'):
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    _add_column(cursor, 'broadcast_jobs', 'event_id', 'INTEGER NOT NULL DEFAULT 1')
+
+    cursor.execute('''
+        CREATE INDEX idx_participants_active
+        ON participants (event_id, user_id) WHERE is_active = 1
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX idx_draw_results_recipient ON draw_results (event_id, recipient_id)')
+
+
+def _migration_4(cursor):
+    """Состояния FSM: переживают перезапуск и общие для всех процессов бота"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+
+def _migration_5(cursor):
+    """Очередь передачи подарков (QR-код + адрес выдачи): доставляется фоновым воркером"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gift_handoffs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            event_id INTEGER NOT NULL,
+            santa_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            qr_file_id TEXT NOT NULL,
+            pickup_address TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_gift_handoffs_due
+        ON gift_handoffs (next_attempt_at) WHERE status = 'pending'
+    ''')
+
+
+def _migration_6(cursor):
+    """QR-код подарка у участника: полный file_id фото и распознанное содержимое"""
+    _add_column(cursor, 'participants', 'qr_file_id', 'TEXT')
+    _add_column(cursor, 'participants', 'qr_payload', 'TEXT')
+    _add_column(cursor, 'gift_handoffs', 'qr_payload', 'TEXT')
+
+
+def _migration_7(cursor):
+    """
+    Напоминания по расписанию: задания reminder_jobs и время последнего напоминания участнику.
+    Частичные индексы содержат только тех, кому есть о чем напоминать: получивший адрес
+    или отправивший подарок участник выпадает из индекса и больше не просматривается.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            delay REAL NOT NULL DEFAULT 0,
+            interval REAL NOT NULL,
+            cooldown REAL NOT NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            next_run_at REAL NOT NULL,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TIMESTAMP,
+            UNIQUE (event_id, kind)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reminder_jobs_due
+        ON reminder_jobs (next_run_at) WHERE status = 'active'
+    ''')
+    _add_column(cursor, 'participants', 'reminded_at', 'REAL')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_participants_no_address
+        ON participants (event_id, user_id, reminded_at)
+        WHERE is_active = 1 AND (address IS NULL OR address = '')
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_participants_no_gift
+        ON participants (event_id, user_id, reminded_at)
+        WHERE is_active = 1 AND gift_code IS NULL
+    ''')
+
+
+def _migration_8(cursor):
+    """
+    Журнал изменений (только добавление) и снимки состояния игр.
+    Для существующих игр сразу делается снимок: их прошлое в журнал не попало.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            user_id INTEGER,
+            data TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_event ON audit_log (event_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_kind ON audit_log (event_id, kind, id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            last_log_id INTEGER NOT NULL,
+            state BLOB NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_audit_snapshots_event ON audit_snapshots (event_id, last_log_id)
+    ''')
+    cursor.execute('SELECT id FROM events')
+    for (event_id,) in cursor.fetchall():
+        _take_snapshot(cursor, event_id)
+
+
+def _add_column(cursor, table, column, definition):
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+MIGRATIONS = [
+    _migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6, _migration_7,
+    _migration_8,
+]
+
+
+# Журнал изменений: запись делается курсором изменения, то есть в той же транзакции
+
+def _log(cursor, event_id, kind, user_id=None, data=None):
+    _log_many(cursor, [(event_id, kind, user_id, data)])
+
+
+def _log_many(cursor, entries):
+    """entries: [(event_id, вид, user_id, данные)]"""
+    now = time.time()
+    cursor.executemany('''
+        INSERT INTO audit_log (event_id, kind, user_id, data, created_at) VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (event_id, kind, user_id, json.dumps(data, ensure_ascii=False) if data is not None else None, now)
+        for event_id, kind, user_id, data in entries
+    ])
+
+
+def _read_state(cursor, event_id):
+    """Текущее состояние игры из таблиц, в формате audit.empty_state()"""
+    state = empty_state()
+    cursor.execute('''
+        SELECT user_id, username, full_name, address, gift_code, is_active FROM participants WHERE event_id = ?
+    ''', (event_id,))
+    for user_id, username, full_name, address, gift_code, is_active in cursor:
+        state['participants'][user_id] = {
+            'username': username, 'full_name': full_name, 'address': address,
+            'gift_code': gift_code, 'is_active': int(is_active),
+        }
+    cursor.execute('SELECT santa_id, recipient_id FROM draw_results WHERE event_id = ?', (event_id,))
+    state['pairs'] = dict(cursor)
+    return state
+
+
+def _take_snapshot(cursor, event_id):
+    """Снимок игры по последней записи журнала; вызывается в транзакции записи. Возвращает номер записи"""
+    cursor.execute('SELECT MAX(id) FROM audit_log WHERE event_id = ?', (event_id,))
+    last_log_id = cursor.fetchone()[0] or 0
+    cursor.execute('''
+        INSERT INTO audit_snapshots (event_id, last_log_id, state, created_at) VALUES (?, ?, ?, ?)
+    ''', (event_id, last_log_id, dump_state(_read_state(cursor, event_id)), time.time()))
+    return last_log_id
+
+
+_MISSING = object()
+
+
+class Participant:
+    """
+    Строка участника с именованными полями. __slots__ - без словаря на каждый объект:
+    в кэше их десятки тысяч. Выбираются только эти колонки, а не SELECT *.
+    """
+    __slots__ = (
+        'event_id', 'user_id', 'username', 'full_name', 'address', 'gift_code', 'gift_type',
+        'recipient_id', 'santa_id', 'is_active', 'registered_at', 'qr_file_id', 'qr_payload',
+    )
+    COLUMNS = ', '.join(__slots__)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"Participant(event_id={self.event_id}, user_id={self.user_id}, full_name={self.full_name!r})"
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш со счетчиками попаданий и промахов.
+    Потокобезопасный: к базе обращаются несколько потоков одновременно.
+    """
+
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Растет при каждом сбросе: значение, прочитанное из базы до сброса, в кэш не попадает
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """version - значение self.version, снятое перед чтением value из базы"""
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.version += 1
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            self.version += 1
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+def _write_rows(cursor, path, fmt, chunk_size):
+    """Пишет результат запроса в CSV (с заголовком) или JSONL частями по chunk_size; возвращает число строк"""
+    columns = [column[0] for column in cursor.description]
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig' if fmt == 'csv' else 'utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+
 class Database:
-    def __init__(self, db_name='santa.db'):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-    
-    def create_tables(self):
-        # Таблица участников
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS participants (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                address TEXT,
-                gift_code TEXT,
-                recipient_id INTEGER,
-                santa_id INTEGER,
-                is_active BOOLEAN DEFAULT 1,
-                registered_at TIMESTAMP
-            )
-        ''')
-        
-        # Таблица жеребьевки
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS draw_results (
-                santa_id INTEGER,
-                recipient_id INTEGER,
-                draw_date TIMESTAMP,
-                PRIMARY KEY (santa_id, recipient_id)
-            )
-        ''')
-        
-        self.conn.commit()
+    """
+    Одно соединение-писатель и пул соединений-читателей (WAL: чтение не ждет записи).
+    Каждый вызов берет свой короткоживущий курсор, поэтому методы можно вызывать
+    из нескольких потоков одновременно. Записи выполняются в transaction().
+    """
+
+    def __init__(self, db_name='santa.db', cache_size=10_000, readers=4):
+        # Кэши чтения: строки участников, пары санта -> получатель и получатель -> санта.
+        # Пары после жеребьевки не меняются, поэтому почти все нажатия кнопок обслуживаются из памяти.
+        self._participants = LRUCache(cache_size)
+        self._recipient_of = LRUCache(cache_size)
+        self._santa_of = LRUCache(cache_size)
+        self._draw_completed = LRUCache(cache_size)
+        # Игры и текущая игра пользователя нужны почти каждому апдейту
+        self._events = LRUCache(cache_size)
+        self._current_event = LRUCache(cache_size)
+        # Назначения жеребьевки по играм (DrawCycle) для точечных изменений; меняются только под _write_lock
+        self._cycles = {}
+        # Вызывается при каждом сбросе кэша (event_id, user_id или None - вся игра):
+        # в режиме нескольких процессов так сбрасываются кэши остальных процессов
+        self.on_invalidate = None
+
+        self.conn = self._connect(db_name)
+        # Писатель один; RLock - чтобы вложенные transaction() в том же потоке не блокировали друг друга
+        self._write_lock = threading.RLock()
+        # Глубина вложенности transaction() и отложенные до коммита сбросы кэша - у каждого потока свои
+        self._local = threading.local()
+        self.migrate()
+
+        # Читатели открываются по мере надобности (не больше readers), запуск их не ждет.
+        # База в памяти у каждого соединения своя, поэтому для ':memory:' все запросы идут через писателя.
+        self._db_name = db_name
+        self._readers = queue.Queue() if db_name != ':memory:' and readers > 0 else None
+        self._max_readers = readers
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+    @staticmethod
+    def _connect(db_name):
+        conn = sqlite3.connect(db_name, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
     
-    def add_participant(self, user_id, username, full_name):
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO participants 
-            (user_id, username, full_name, registered_at) 
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, username, full_name, datetime.now()))
-        self.conn.commit()
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Транзакция на соединении-писателе: возвращает курсор, коммит один раз в конце.
+        Вложенный вызов в том же потоке становится частью внешней транзакции.
+        immediate - сразу взять блокировку записи (чтения внутри не устареют и в других процессах).
+        Кэши сбрасываются после коммита, чтобы читатели не закэшировали старые данные.
+        """
+        with self._write_lock:
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                self._local.invalidations = []
+            self._local.depth = depth + 1
+            cursor = self.conn.cursor()
+            try:
+                if immediate and not self.conn.in_transaction:
+                    cursor.execute('BEGIN IMMEDIATE')
+                yield cursor
+            except BaseException:
+                if not depth:
+                    self.conn.rollback()
+                    # Индекс жеребьевки мог измениться до отката
+                    self._cycles.clear()
+                raise
+            else:
+                if not depth:
+                    self.conn.commit()
+            finally:
+                cursor.close()
+                self._local.depth = depth
+                if not depth:
+                    for event_id, user_id in self._local.invalidations:
+                        self._invalidate(event_id, user_id)
+    
+    @contextmanager
+    def _read(self):
+        """
+        Курсор для чтения из пула читателей.
+        Внутри transaction() чтение идет через писателя, чтобы видеть свои незакоммиченные изменения.
+        """
+        if self._readers is None or getattr(self._local, 'depth', 0):
+            with self._write_lock:
+                cursor = self.conn.cursor()
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+            return
+        conn = self._get_reader()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self._readers.put(conn)
+    
+    def _get_reader(self):
+        """Свободный читатель из пула; новый открывается, пока их меньше максимума"""
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self._max_readers:
+                self._reader_count += 1
+                reader = self._connect(self._db_name)
+                reader.execute('PRAGMA query_only = 1')
+                return reader
+        return self._readers.get()
+    
+    def migrate(self):
+        """
+        Применяет недостающие миграции схемы.
+        Номер версии хранится в PRAGMA user_version, поэтому повторный запуск ничего не делает.
+        """
+        # Схема актуальна (обычный перезапуск): ни транзакций, ни DDL
+        if self._schema_version() == len(MIGRATIONS):
+            return
+        cursor = self.conn.cursor()
+        for number in range(self._schema_version() + 1, len(MIGRATIONS) + 1):
+            # IMMEDIATE: если несколько процессов стартуют одновременно, миграцию выполнит один
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if self._schema_version() < number:
+                    MIGRATIONS[number - 1](cursor)
+                    cursor.execute(f'PRAGMA user_version = {number}')
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        cursor.close()
+    
+    def _schema_version(self):
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    # Игры
+    
+    def create_event(self, title, admin_id):
+        """Создает игру; возвращает (event_id, код для ссылки /start <код>)"""
+        code = secrets.token_urlsafe(6)
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO events (code, title, admin_id, created_at) VALUES (?, ?, ?, ?)
+            ''', (code, title, admin_id, datetime.now()))
+            event_id = cursor.lastrowid
+            _log(cursor, event_id, 'event', admin_id, {'title': title})
+            # Начальный снимок: состояние любой игры восстанавливается от снимка
+            _take_snapshot(cursor, event_id)
+            return event_id, code
+    
+    def get_event(self, event_id):
+        """(id, code, title, admin_id)"""
+        event = self._events.get(event_id)
+        if event is _MISSING:
+            version = self._events.version
+            with self._read() as cursor:
+                cursor.execute('SELECT id, code, title, admin_id FROM events WHERE id = ?', (event_id,))
+                event = cursor.fetchone()
+            self._events.put(event_id, event, version)
+        return event
+    
+    def get_event_by_code(self, code):
+        with self._read() as cursor:
+            cursor.execute('SELECT id, code, title, admin_id FROM events WHERE code = ?', (code,))
+            return cursor.fetchone()
+    
+    def is_event_admin(self, event_id, user_id):
+        event = self.get_event(event_id)
+        return bool(event) and event[3] == user_id
+    
+    def set_current_event(self, user_id, event_id):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO user_events (user_id, event_id) VALUES (?, ?)
+            ''', (user_id, event_id))
+        self._current_event.invalidate(user_id)
+    
+    def get_current_event(self, user_id):
+        """Игра, в которой сейчас действует пользователь (по умолчанию - игра №1)"""
+        event_id = self._current_event.get(user_id)
+        if event_id is _MISSING:
+            version = self._current_event.version
+            with self._read() as cursor:
+                cursor.execute('SELECT event_id FROM user_events WHERE user_id = ?', (user_id,))
+                row = cursor.fetchone()
+            event_id = row[0] if row else DEFAULT_EVENT_ID
+            self._current_event.put(user_id, event_id, version)
+        return event_id
     
-    def update_address(self, user_id, address):
-        self.cursor.execute('''
-            UPDATE participants SET address = ? WHERE user_id = ?
-        ''', (address, user_id))
-        self.conn.commit()
+    # Участники
     
-    def update_gift_code(self, user_id, gift_data):
+    def add_participant(self, event_id, user_id, username, full_name):
+        """
+        Регистрирует участника; повторный вызов обновляет имя, но не стирает адрес, подарок и пары.
+        Исключенного из жеребьевки (remove_from_draw) не возвращает - это делает только add_to_draw.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO participants (event_id, user_id, username, full_name, registered_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (event_id, user_id) DO UPDATE SET
+                    username = excluded.username, full_name = excluded.full_name
+            ''', (event_id, user_id, username, full_name, datetime.now()))
+            _log(cursor, event_id, 'join', user_id, {'username': username, 'full_name': full_name})
+            self._invalidate_after_commit(event_id, user_id)
+    
+    def update_address(self, event_id, user_id, address):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE participants SET address = ? WHERE event_id = ? AND user_id = ?
+            ''', (address, event_id, user_id))
+            if cursor.rowcount:
+                _log(cursor, event_id, 'address', user_id, {'address': address})
+            self._invalidate_after_commit(event_id, user_id)
+    
+    def update_gift_code(self, event_id, user_id, gift_data):
         """Сохраняет данные о подарке (текст, QR, адрес)"""
-        self.cursor.execute('''
-            UPDATE participants 
-            SET gift_code = ?, gift_type = 'qr_with_address' 
-            WHERE user_id = ?
-        ''', (gift_data, user_id))
-        self.conn.commit()
-    
-    def get_participant(self, user_id):
-        self.cursor.execute('SELECT * FROM participants WHERE user_id = ?', (user_id,))
-        return self.cursor.fetchone()
-    
-    def get_all_participants(self):
-        self.cursor.execute('SELECT * FROM participants WHERE is_active = 1')
-        return self.cursor.fetchall()
-    
-    def perform_draw(self):
-        """Проводит жеребьевку"""
-        participants = self.get_all_participants()
-        if len(participants) < 2:
-            return False
-        
-        # Получаем ID участников
-        user_ids = [p[0] for p in participants]
-        
-        # Создаем пары (санта -> получатель)
-        import random
-        shuffled = user_ids.copy()
-        
-        # Гарантируем, что никто не выпадет сам себе
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE participants 
+                SET gift_code = ?, gift_type = 'qr_with_address' 
+                WHERE event_id = ? AND user_id = ?
+            ''', (gift_data, event_id, user_id))
+            if cursor.rowcount:
+                _log(cursor, event_id, 'gift', user_id, {'gift_code': gift_data})
+            self._invalidate_after_commit(event_id, user_id)
+    
+    def get_participant(self, event_id, user_id):
+        participant = self._participants.get((event_id, user_id))
+        if participant is _MISSING:
+            version = self._participants.version
+            with self._read() as cursor:
+                cursor.execute(f'''
+                    SELECT {Participant.COLUMNS} FROM participants WHERE event_id = ? AND user_id = ?
+                ''', (event_id, user_id))
+                row = cursor.fetchone()
+            participant = Participant(*row) if row else None
+            self._participants.put((event_id, user_id), participant, version)
+        return participant
+    
+    def iter_participants(self, event_id, chunk_size=1000):
+        """
+        Активные участники игры (Participant) по одному. Читаются пачками по user_id,
+        каждая пачка - отдельный короткий запрос: в памяти не больше chunk_size строк.
+        """
+        after_id = 0
         while True:
-            random.shuffle(shuffled)
-            valid = all(s != r for s, r in zip(user_ids, shuffled))
-            if valid:
-                break
-        
-        # Очищаем предыдущие результаты
-        self.cursor.execute('DELETE FROM draw_results')
+            with self._read() as cursor:
+                cursor.execute(f'''
+                    SELECT {Participant.COLUMNS} FROM participants
+                    WHERE event_id = ? AND is_active = 1 AND user_id > ?
+                    ORDER BY user_id LIMIT ?
+                ''', (event_id, after_id, chunk_size))
+                rows = cursor.fetchall()
+            for row in rows:
+                yield Participant(*row)
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][1]
+    
+    # Фильтры списка участников для админа
+    PARTICIPANT_FILTERS = {
+        'all': '',
+        'no_address': "AND (address IS NULL OR address = '')",
+        'no_gift': 'AND gift_code IS NULL',
+    }
+    
+    def get_participants_page(self, event_id, filter_name='all', after_id=0, before_id=None, limit=20):
+        """
+        Страница списка участников (постраничная выборка по ключу user_id, без OFFSET).
+        Возвращает (строки, есть_предыдущая, есть_следующая);
+        строка: (user_id, username, full_name, есть_адрес, есть_подарок).
+        before_id - листание назад: страница, заканчивающаяся перед этим user_id.
+        """
+        condition = self.PARTICIPANT_FILTERS[filter_name]
+        backwards = before_id is not None
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT user_id, username, full_name,
+                       address IS NOT NULL AND address != '', gift_code IS NOT NULL
+                FROM participants
+                WHERE event_id = ? AND is_active = 1 AND user_id {'<' if backwards else '>'} ? {condition}
+                ORDER BY user_id {'DESC' if backwards else 'ASC'}
+                LIMIT ?
+            ''', (event_id, before_id if backwards else after_id, limit + 1))
+            rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+            return rows, has_more, True
+        return rows, after_id > 0, has_more
+    
+    def get_participants_summary(self, event_id):
+        """Сводка одним агрегирующим запросом: (всего, с адресом, отправили подарок)"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT COUNT(*),
+                       COALESCE(SUM(address IS NOT NULL AND address != ''), 0),
+                       COALESCE(SUM(gift_code IS NOT NULL), 0)
+                FROM participants WHERE event_id = ? AND is_active = 1
+            ''', (event_id,))
+            return cursor.fetchone()
+    
+    def export_participants_csv(self, event_id, path, chunk_size=1000):
+        """Выгружает участников в CSV по частям: память не зависит от числа участников"""
+        self.export_participants(event_id, path, 'csv', chunk_size)
+    
+    def export_participants(self, event_id, path, fmt='csv', chunk_size=1000):
+        """Выгружает участников в CSV или JSONL (fmt='jsonl'); возвращает число строк"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT user_id, username, full_name, address, gift_code, recipient_id, santa_id, registered_at
+                FROM participants WHERE event_id = ? AND is_active = 1 ORDER BY user_id
+            ''', (event_id,))
+            return _write_rows(cursor, path, fmt, chunk_size)
+    
+    def export_draw_results(self, event_id, path, fmt='csv', chunk_size=1000):
+        """
+        Архив жеребьевки: пары вместе с данными санты и получателя, в CSV или JSONL.
+        Строки читаются и пишутся частями; возвращает число пар.
+        """
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT dr.santa_id, s.username AS santa_username, s.full_name AS santa_name,
+                       dr.recipient_id, r.username AS recipient_username, r.full_name AS recipient_name,
+                       r.address AS recipient_address, s.gift_code, dr.draw_date
+                FROM draw_results dr
+                JOIN participants s ON s.event_id = dr.event_id AND s.user_id = dr.santa_id
+                JOIN participants r ON r.event_id = dr.event_id AND r.user_id = dr.recipient_id
+                WHERE dr.event_id = ?
+                ORDER BY dr.santa_id
+            ''', (event_id,))
+            return _write_rows(cursor, path, fmt, chunk_size)
+    
+    def import_participants(self, event_id, rows, chunk_size=1000):
+        """
+        Загружает участников из итератора словарей (user_id, username, full_name, address)
+        пачками по chunk_size: executemany и коммит на пачку, в памяти только одна пачка.
+        Существующие участники обновляются (пустые поля файла не затирают данные);
+        исключенные из жеребьевки остаются исключенными (вернуть - add_to_draw).
+        Для новых пользователей эта игра становится текущей (у кого текущая уже выбрана - не меняется).
+        Возвращает число загруженных строк.
+        """
+        imported = 0
+        chunk = []
+        for row in rows:
+            chunk.append((
+                event_id, row['user_id'], row.get('username'), row.get('full_name'), row.get('address'),
+                datetime.now(),
+            ))
+            if len(chunk) >= chunk_size:
+                imported += self._import_chunk(event_id, chunk)
+                chunk = []
+        if chunk:
+            imported += self._import_chunk(event_id, chunk)
+        return imported
+    
+    def _import_chunk(self, event_id, chunk):
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO participants (event_id, user_id, username, full_name, address, registered_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (event_id, user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    full_name = COALESCE(excluded.full_name, full_name),
+                    address = COALESCE(excluded.address, address)
+            ''', chunk)
+            # Иначе загруженные пользователи попадали бы в игру по умолчанию
+            cursor.executemany('''
+                INSERT OR IGNORE INTO user_events (user_id, event_id) VALUES (?, ?)
+            ''', [(user_id, event_id) for _, user_id, *_ in chunk])
+            _log_many(cursor, [
+                (event_id, 'import', user_id, {'username': username, 'full_name': full_name, 'address': address})
+                for _, user_id, username, full_name, address, _ in chunk
+            ])
+            # Один сброс кэша игры на пачку вместо сброса по каждому участнику;
+            # он же сбрасывает текущие игры пользователей во всех процессах (см. apply_invalidation)
+            self._invalidate_after_commit(event_id)
+        return len(chunk)
+    
+    def count_active_participants(self, event_id):
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT COUNT(*) FROM participants WHERE event_id = ? AND is_active = 1
+            ''', (event_id,))
+            return cursor.fetchone()[0]
+    
+    def iter_active_user_ids(self, event_id, chunk_size=5000):
+        """Все активные user_id по возрастанию, пачками get_active_user_ids"""
+        after_id = 0
+        while True:
+            user_ids = self.get_active_user_ids(event_id, after_id, chunk_size)
+            yield from user_ids
+            if len(user_ids) < chunk_size:
+                return
+            after_id = user_ids[-1]
+    
+    def get_active_user_ids(self, event_id, after_id=0, limit=500):
+        """Следующая пачка активных user_id по возрастанию (постраничная выборка по ключу)"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT user_id FROM participants
+                WHERE event_id = ? AND is_active = 1 AND user_id > ?
+                ORDER BY user_id LIMIT ?
+            ''', (event_id, after_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+    
+    # Жеребьевка
+    
+    def add_exclusion(self, event_id, user_id, excluded_id, mutual=True):
+        """Запрещает user_id дарить подарок excluded_id (например, паре)"""
+        pairs = [(event_id, user_id, excluded_id)]
+        if mutual:
+            pairs.append((event_id, excluded_id, user_id))
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO draw_exclusions (event_id, user_id, excluded_id) VALUES (?, ?, ?)
+            ''', pairs)
+            _log(cursor, event_id, 'exclusion', user_id, {'excluded_id': excluded_id, 'mutual': mutual})
+    
+    def get_exclusions(self, event_id, include_previous_draw=False):
+        """Возвращает {santa_id: множество запрещенных получателей}"""
+        exclusions = {}
+        queries = ['SELECT user_id, excluded_id FROM draw_exclusions WHERE event_id = ?']
+        if include_previous_draw:
+            # Прошлая жеребьевка: не дарим тому же человеку второй раз подряд
+            queries.append('SELECT santa_id, recipient_id FROM draw_results WHERE event_id = ?')
+        with self._read() as cursor:
+            for query in queries:
+                # Строки читаются курсором по одной, без промежуточного списка
+                for user_id, excluded_id in cursor.execute(query, (event_id,)):
+                    exclusions.setdefault(user_id, set()).add(excluded_id)
+        return exclusions
+    
+    def perform_draw(self, event_id, avoid_previous=False):
+        """
+        Проводит жеребьевку в игре.
+        Возвращает число пар или None, если провести не удалось. Сами пары для рассылки
+        читаются постранично (get_assignments с after_id), а не одним списком.
+        """
+        # Участники читаются внутри транзакции записи: состав не изменится до записи пар.
+        # user_id - в массиве int64 (8 байт на участника), строки читаются курсором по одной
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT user_id FROM participants WHERE event_id = ? AND is_active = 1
+            ''', (event_id,))
+            user_ids = array('q', (row[0] for row in cursor))
+            if len(user_ids) < 2:
+                return None
+            
+            # Создаем пары (санта -> получатель) за один проход, с учетом исключений
+            try:
+                recipient_of = draw_pairs(user_ids, self.get_exclusions(event_id, avoid_previous))
+            except DrawError:
+                return None
+            self._write_draw(cursor, event_id, recipient_of)
+        return len(recipient_of)
+    
+    def _write_draw(self, cursor, event_id, recipient_of, restored_from=None):
+        """Заменяет все пары игры на recipient_of и записывает жеребьевку в журнал"""
+        draw_date = datetime.now()
         
-        # Сохраняем новые пары
-        for santa_id, recipient_id in zip(user_ids, shuffled):
-            self.cursor.execute('''
-                INSERT INTO draw_results (santa_id, recipient_id, draw_date)
-                VALUES (?, ?, ?)
-            ''', (santa_id, recipient_id, datetime.now()))
+        cursor.execute('DELETE FROM draw_results WHERE event_id = ?', (event_id,))
+        cursor.execute('DELETE FROM draw_notifications WHERE event_id = ?', (event_id,))
+        # Параметры - генератором: executemany не строит список на все пары
+        cursor.executemany('''
+            INSERT INTO draw_results (event_id, santa_id, recipient_id, draw_date)
+            VALUES (?, ?, ?, ?)
+        ''', ((event_id, santa_id, recipient_id, draw_date) for santa_id, recipient_id in recipient_of.items()))
+        # Пары участников переносятся из draw_results в самой SQLite, без обратного словаря в памяти
+        cursor.execute('''
+            UPDATE participants
+            SET recipient_id = (SELECT recipient_id FROM draw_results dr
+                                WHERE dr.event_id = participants.event_id AND dr.santa_id = participants.user_id),
+                santa_id = (SELECT santa_id FROM draw_results dr
+                            WHERE dr.event_id = participants.event_id AND dr.recipient_id = participants.user_id)
+            WHERE event_id = ? AND is_active = 1
+        ''', (event_id,))
+        data = {'pairs': list(recipient_of.items())}
+        if restored_from is not None:
+            data['restored_from'] = restored_from
+        _log(cursor, event_id, 'draw', None, data)
+        self._invalidate_after_commit(event_id)
+    
+    def restore_previous_draw(self, event_id):
+        """
+        Отменяет последнюю жеребьевку: пары восстанавливаются по журналу на момент перед ней
+        (вместе с точечными изменениями, сделанными до нее). Возвращает число пар
+        или бросает DrawError, если прошлой жеребьевки нет или состав участников с тех пор изменился.
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT id FROM audit_log WHERE event_id = ? AND kind = 'draw' ORDER BY id DESC LIMIT 1
+            ''', (event_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise DrawError("Жеребьевка еще не проведена")
+            try:
+                previous = self.rebuild_state(event_id, until_id=row[0] - 1)['pairs']
+            except ValueError as e:
+                raise DrawError(str(e))
+            if not previous:
+                raise DrawError("Предыдущей жеребьевки нет")
+            cursor.execute('SELECT santa_id FROM draw_results WHERE event_id = ?', (event_id,))
+            if {santa_id for (santa_id,) in cursor} != set(previous):
+                raise DrawError("Состав жеребьевки изменился, вернуть прошлые пары нельзя")
+            self._write_draw(cursor, event_id, previous, restored_from=row[0])
+        return len(previous)
+    
+    def get_assignments(self, event_id, undelivered_only=False, santa_ids=None, after_id=0, limit=-1):
+        """
+        Пары игры по santa_id: [(santa_id, recipient_id, имя получателя, username получателя)].
+        undelivered_only - только те санты, кому уведомление о жеребьевке еще не доставлено.
+        santa_ids - только пары этих сант. after_id и limit - страница по santa_id (limit=-1 - все).
+        """
+        params = [event_id, after_id]
+        santa_filter = ""
+        if santa_ids is not None:
+            santa_ids = list(santa_ids)
+            santa_filter = f"AND dr.santa_id IN ({', '.join('?' * len(santa_ids))})"
+            params += santa_ids
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT dr.santa_id, dr.recipient_id, p.full_name, p.username
+                FROM draw_results dr
+                JOIN participants p ON p.event_id = dr.event_id AND p.user_id = dr.recipient_id
+                {"LEFT JOIN draw_notifications n ON n.event_id = dr.event_id AND n.santa_id = dr.santa_id"
+                 if undelivered_only else ""}
+                WHERE dr.event_id = ? AND dr.santa_id > ? {santa_filter}
+                      {"AND n.status IS NOT 'sent'" if undelivered_only else ""}
+                ORDER BY dr.santa_id LIMIT ?
+            ''', [*params, limit])
+            return cursor.fetchall()
+    
+    def count_assignments(self, event_id, undelivered_only=False):
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM draw_results dr
+                {"LEFT JOIN draw_notifications n ON n.event_id = dr.event_id AND n.santa_id = dr.santa_id"
+                 if undelivered_only else ""}
+                WHERE dr.event_id = ? {"AND n.status IS NOT 'sent'" if undelivered_only else ""}
+            ''', (event_id,))
+            return cursor.fetchone()[0]
+    
+    # Точечные изменения после жеребьевки
+    
+    def add_to_draw(self, event_id, user_id):
+        """
+        Встраивает опоздавшего участника в проведенную жеребьевку, не трогая остальные пары.
+        Исключенный ранее (remove_from_draw) участник снова становится активным.
+        Возвращает назначения для рассылки (см. get_assignments) - только 2 санты, чьи пары изменились.
+        Если добавить нельзя, бросает DrawError с причиной.
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT 1 FROM participants WHERE event_id = ? AND user_id = ?
+            ''', (event_id, user_id))
+            if not cursor.fetchone():
+                raise DrawError("Пользователь не участвует в игре")
+            pairs = self._change_draw(
+                event_id, cursor,
+                lambda cycle, exclusions: cycle.plan_insert(user_id, exclusions),
+                joined=user_id,
+            )
+            cursor.execute('''
+                UPDATE participants SET is_active = 1 WHERE event_id = ? AND user_id = ?
+            ''', (event_id, user_id))
+        return self.get_assignments(event_id, santa_ids=pairs)
+    
+    def remove_from_draw(self, event_id, user_id):
+        """
+        Исключает выбывшего участника: его санта получает его получателя, остальные пары не меняются.
+        Участник становится неактивным. Возвращает назначения для рассылки (1-2 санты) или бросает DrawError.
+        """
+        with self.transaction(immediate=True) as cursor:
+            pairs = self._change_draw(
+                event_id, cursor,
+                lambda cycle, exclusions: cycle.plan_remove(user_id, exclusions),
+                removed=user_id,
+            )
+            cursor.execute('''
+                UPDATE participants SET is_active = 0, recipient_id = NULL, santa_id = NULL
+                WHERE event_id = ? AND user_id = ?
+            ''', (event_id, user_id))
+        return self.get_assignments(event_id, santa_ids=pairs)
+    
+    def _change_draw(self, event_id, cursor, plan, joined=None, removed=None):
+        """
+        Подбирает новые пары по DrawCycle игры и записывает только их (O(1) строк).
+        Вызывается внутри transaction(immediate=True). Индекс в памяти мог устареть
+        (изменения из другого процесса), поэтому затрагиваемые пары сверяются с базой;
+        при расхождении индекс перечитывается из draw_results.
+        """
+        for attempt in range(2):
+            cycle = self._cycles.get(event_id)
+            if cycle is None or attempt:
+                cursor.execute('''
+                    SELECT santa_id, recipient_id FROM draw_results WHERE event_id = ?
+                ''', (event_id,))
+                cycle = self._cycles[event_id] = DrawCycle(cursor.fetchall())
+            error = (
+                "Жеребьевка еще не проведена" if not cycle else
+                "Участник уже есть в жеребьевке" if joined in cycle else
+                "Участника нет в жеребьевке" if removed is not None and removed not in cycle else
+                None
+            )
+            if error:
+                if attempt:
+                    raise DrawError(error)
+                continue
+            pairs = plan(cycle, self.get_exclusions(event_id))
             
-            # Обновляем в таблице participants
-            self.cursor.execute('''
-                UPDATE participants 
-                SET recipient_id = ?, santa_id = ? 
-                WHERE user_id = ?
-            ''', (recipient_id, santa_id, santa_id))
+            # Пары, которые сейчас в индексе у затрагиваемых сант, должны совпадать с базой
+            santa_ids = [santa_id for santa_id in pairs if santa_id != joined]
+            if removed is not None:
+                santa_ids.append(removed)
+            cursor.execute(f'''
+                SELECT santa_id, recipient_id FROM draw_results
+                WHERE event_id = ? AND santa_id IN ({', '.join('?' * len(santa_ids))})
+            ''', [event_id, *santa_ids])
+            stored = dict(cursor.fetchall())
+            if joined is not None:
+                cursor.execute('''
+                    SELECT EXISTS (SELECT 1 FROM draw_results WHERE event_id = ? AND recipient_id = ?)
+                ''', (event_id, joined))
+                if cursor.fetchone()[0]:
+                    stored[joined] = None
+            if stored == {santa_id: cycle.recipient_of[santa_id] for santa_id in santa_ids}:
+                break
+        else:
+            raise DrawError("Назначения изменились во время операции, повторите")
         
-        self.conn.commit()
-        return True
+        # Сначала удаляем старые пары затронутых сант: уникальность получателя не нарушится
+        changed = [*santa_ids, *([joined] if joined is not None else [])]
+        draw_date = datetime.now()
+        cursor.executemany('DELETE FROM draw_results WHERE event_id = ? AND santa_id = ?',
+                           [(event_id, santa_id) for santa_id in changed])
+        cursor.executemany('''
+            INSERT INTO draw_results (event_id, santa_id, recipient_id, draw_date) VALUES (?, ?, ?, ?)
+        ''', [(event_id, santa_id, recipient_id, draw_date) for santa_id, recipient_id in pairs.items()])
+        cursor.executemany('''
+            UPDATE participants SET recipient_id = ? WHERE event_id = ? AND user_id = ?
+        ''', [(recipient_id, event_id, santa_id) for santa_id, recipient_id in pairs.items()])
+        cursor.executemany('''
+            UPDATE participants SET santa_id = ? WHERE event_id = ? AND user_id = ?
+        ''', [(santa_id, event_id, recipient_id) for santa_id, recipient_id in pairs.items()])
+        _log(cursor, event_id, 'draw_change', joined, {'pairs': list(pairs.items()), 'removed': removed})
+        # Уведомления затронутым сантам отправляются заново
+        cursor.executemany('DELETE FROM draw_notifications WHERE event_id = ? AND santa_id = ?',
+                           [(event_id, santa_id) for santa_id in changed])
+        
+        affected = set(changed) | set(pairs.values())
+        for user_id in affected:
+            self._invalidate_after_commit(event_id, user_id)
+        # Индекс меняется на месте; при откате транзакции он сбрасывается (см. transaction)
+        cycle.apply(pairs, removed)
+        return pairs
+    
+    def set_notification_statuses(self, event_id, statuses):
+        """Сохраняет результат доставки уведомлений: [(santa_id, status)]"""
+        now = datetime.now()
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO draw_notifications (event_id, santa_id, status, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(event_id, santa_id, status, now) for santa_id, status in statuses])
     
-    def get_recipient(self, santa_id):
+    def get_recipient(self, event_id, santa_id):
         """Получаем информацию о получателе для данного санты"""
-        self.cursor.execute('''
-            SELECT p.* FROM participants p
-            JOIN draw_results dr ON p.user_id = dr.recipient_id
-            WHERE dr.santa_id = ?
-        ''', (santa_id,))
-        return self.cursor.fetchone()
-    
-    def get_santa(self, recipient_id):
+        recipient_id = self._recipient_of.get((event_id, santa_id))
+        if recipient_id is _MISSING:
+            version = self._recipient_of.version
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT recipient_id FROM draw_results WHERE event_id = ? AND santa_id = ?
+                ''', (event_id, santa_id))
+                row = cursor.fetchone()
+            recipient_id = row[0] if row else None
+            self._recipient_of.put((event_id, santa_id), recipient_id, version)
+        return self.get_participant(event_id, recipient_id) if recipient_id is not None else None
+    
+    def get_santa(self, event_id, recipient_id):
         """Получаем информацию о санте для данного получателя"""
-        self.cursor.execute('''
-            SELECT p.* FROM participants p
-            JOIN draw_results dr ON p.user_id = dr.santa_id
-            WHERE dr.recipient_id = ?
-        ''', (recipient_id,))
-        return self.cursor.fetchone()
+        santa_id = self._santa_of.get((event_id, recipient_id))
+        if santa_id is _MISSING:
+            version = self._santa_of.version
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT santa_id FROM draw_results WHERE event_id = ? AND recipient_id = ?
+                ''', (event_id, recipient_id))
+                row = cursor.fetchone()
+            santa_id = row[0] if row else None
+            self._santa_of.put((event_id, recipient_id), santa_id, version)
+        return self.get_participant(event_id, santa_id) if santa_id is not None else None
+    
+    def is_draw_completed(self, event_id):
+        completed = self._draw_completed.get(event_id)
+        if completed is _MISSING:
+            version = self._draw_completed.version
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT EXISTS (SELECT 1 FROM draw_results WHERE event_id = ?)
+                ''', (event_id,))
+                completed = bool(cursor.fetchone()[0])
+            self._draw_completed.put(event_id, completed, version)
+        return completed
+    
+    def _invalidate_after_commit(self, event_id, user_id=None):
+        """Сброс кэша из transaction(): выполняется после коммита"""
+        self._local.invalidations.append((event_id, user_id))
+    
+    def _invalidate(self, event_id, user_id=None):
+        self.apply_invalidation(event_id, user_id)
+        if self.on_invalidate is not None:
+            self.on_invalidate(event_id, user_id)
+    
+    def apply_invalidation(self, event_id, user_id=None):
+        """Сбрасывает кэш участника или (user_id=None) всей игры только в этом процессе"""
+        if user_id is not None:
+            # Пары участника тоже: точечные изменения жеребьевки сбрасывают только затронутых
+            for cache in (self._participants, self._recipient_of, self._santa_of):
+                cache.invalidate((event_id, user_id))
+            return
+        for cache in (self._participants, self._recipient_of, self._santa_of):
+            cache.invalidate_where(lambda key: key[0] == event_id)
+        self._draw_completed.invalidate(event_id)
+        self._cycles.pop(event_id, None)
+        # Массовые изменения (загрузка участников) меняют и текущую игру пользователей,
+        # а кэш хранит ее по user_id без номера игры - сбрасывается целиком
+        self._current_event.clear()
+    
+    def set_invalidation_listener(self, listener):
+        self.on_invalidate = listener
+    
+    def invalidate_cache(self):
+        """Сбрасывает все кэши чтения (после массовых изменений в обход методов Database)"""
+        for cache in (
+            self._participants, self._recipient_of, self._santa_of, self._draw_completed,
+            self._current_event, self._events,
+        ):
+            cache.clear()
+        self._cycles.clear()
+    
+    def cache_stats(self):
+        return {
+            'participants': self._participants.stats(),
+            'recipient_of': self._recipient_of.stats(),
+            'santa_of': self._santa_of.stats(),
+            'draw_completed': self._draw_completed.stats(),
+            'current_event': self._current_event.stats(),
+        }
+    
+    # Состояния FSM (см. storage.SQLiteStorage)
+    
+    def get_fsm_record(self, key):
+        """(state, data в JSON, updated_at) или None"""
+        with self._read() as cursor:
+            cursor.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+            return cursor.fetchone()
+    
+    def save_fsm_records(self, records):
+        """Сохраняет пачку [(key, state, data, updated_at)] одной транзакцией; пустые записи удаляются"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ''', [record for record in records if record[1] is not None or record[2] is not None])
+            cursor.executemany('DELETE FROM fsm_states WHERE key = ?', [
+                (record[0],) for record in records if record[1] is None and record[2] is None
+            ])
+    
+    def count_fsm_states(self, since):
+        """{state: число пользователей} по состояниям, менявшимся не раньше since"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT state, COUNT(*) FROM fsm_states
+                WHERE updated_at >= ? AND state IS NOT NULL GROUP BY state
+            ''', (since,))
+            return dict(cursor.fetchall())
+    
+    def delete_expired_fsm_records(self, before):
+        """Удаляет брошенные состояния, не менявшиеся с момента before"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (before,))
+    
+    # Передача подарков: очередь (outbox) для фоновой доставки получателю
+    
+    def create_gift_handoff(self, idempotency_key, event_id, santa_id, recipient_id, qr_file_id, pickup_address,
+                            qr_payload=None):
+        """
+        Ставит передачу подарка в очередь и отмечает подарок санты - одной транзакцией.
+        У санты сохраняются полный file_id фото (повторная отправка без загрузки) и содержимое QR-кода;
+        gift_code - код получения: содержимое QR-кода, а если его не распознали - file_id.
+        Повтор с тем же idempotency_key (повторно доставленный апдейт) ничего не меняет.
+        Возвращает True, если передача добавлена.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO gift_handoffs
+                (idempotency_key, event_id, santa_id, recipient_id, qr_file_id, qr_payload, pickup_address,
+                 next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (idempotency_key, event_id, santa_id, recipient_id, qr_file_id, qr_payload, pickup_address,
+                  time.time(), datetime.now()))
+            if not cursor.rowcount:
+                return False
+            handoff_id = cursor.lastrowid
+            cursor.execute('''
+                UPDATE participants
+                SET gift_code = ?, gift_type = 'qr_with_address', qr_file_id = ?, qr_payload = ?
+                WHERE event_id = ? AND user_id = ?
+            ''', (qr_payload or qr_file_id, qr_file_id, qr_payload, event_id, santa_id))
+            _log(cursor, event_id, 'handoff', santa_id, {
+                'handoff_id': handoff_id, 'recipient_id': recipient_id, 'gift_code': qr_payload or qr_file_id,
+                'pickup_address': pickup_address,
+            })
+            self._invalidate_after_commit(event_id, santa_id)
+            return True
+    
+    def claim_gift_handoffs(self, now, limit=50, lease=60.0):
+        """
+        Забирает до limit передач, которым пора уходить, и откладывает их на lease секунд:
+        другой процесс их не возьмет, а если этот упадет - передачи вернутся в очередь.
+        """
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT h.id, h.event_id, h.santa_id, h.recipient_id, h.qr_file_id, h.qr_payload, h.pickup_address,
+                       h.attempts, p.full_name, p.username
+                FROM gift_handoffs h
+                LEFT JOIN participants p ON p.event_id = h.event_id AND p.user_id = h.santa_id
+                WHERE h.status = 'pending' AND h.next_attempt_at <= ?
+                ORDER BY h.next_attempt_at
+                LIMIT ?
+            ''', (now, limit))
+            columns = [c[0] for c in cursor.description]
+            handoffs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.executemany('UPDATE gift_handoffs SET next_attempt_at = ? WHERE id = ?', [
+                (now + lease, handoff['id']) for handoff in handoffs
+            ])
+            return handoffs
+    
+    def retry_gift_handoff(self, handoff_id, next_attempt_at, error):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE gift_handoffs SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            ''', (next_attempt_at, error, handoff_id))
+    
+    def finish_gift_handoff(self, handoff_id, status, error=None):
+        """status: 'sent' - доставлено, 'dead' - доставить не удалось, больше не пытаемся"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE gift_handoffs
+                SET status = ?, attempts = attempts + 1, last_error = ?, finished_at = ?
+                WHERE id = ?
+            ''', (status, error, datetime.now(), handoff_id))
+            cursor.execute('SELECT event_id, recipient_id FROM gift_handoffs WHERE id = ?', (handoff_id,))
+            row = cursor.fetchone()
+            if row:
+                _log(cursor, row[0], 'delivery', row[1], {'handoff_id': handoff_id, 'status': status, 'error': error})
+    
+    # Задания рассылки
+    
+    def create_broadcast_job(self, event_id, text, admin_chat_id, progress_message_id, total):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO broadcast_jobs (event_id, text, admin_chat_id, progress_message_id, total, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (event_id, text, admin_chat_id, progress_message_id, total, datetime.now()))
+            return cursor.lastrowid
+    
+    def _broadcast_jobs(self, where, params=()):
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT id, event_id, text, admin_chat_id, progress_message_id, total, last_user_id, sent, failed
+                FROM broadcast_jobs WHERE {where}
+            ''', params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    def get_broadcast_job(self, job_id):
+        jobs = self._broadcast_jobs('id = ?', (job_id,))
+        return jobs[0] if jobs else None
+    
+    def get_unfinished_broadcast_jobs(self):
+        return self._broadcast_jobs("status = 'running'")
+    
+    def update_broadcast_progress(self, job_id, last_user_id, sent, failed):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE broadcast_jobs SET last_user_id = ?, sent = ?, failed = ? WHERE id = ?
+            ''', (last_user_id, sent, failed, job_id))
+    
+    def finish_broadcast_job(self, job_id):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE id = ?
+            ''', (datetime.now(), job_id))
+    
+    # Напоминания по расписанию (reminders.py)
+    
+    # Кому напоминать: выборка по частичному индексу, условие совпадает с условием индекса.
+    # no_gift - только санты, чья пара назначена не позже cutoff (delay секунд после жеребьевки)
+    REMINDER_TARGETS = {
+        'no_address': '''
+            SELECT user_id FROM participants
+            WHERE event_id = ? AND is_active = 1 AND (address IS NULL OR address = '')
+              AND user_id > ? AND (reminded_at IS NULL OR reminded_at < ?)
+            ORDER BY user_id LIMIT ?
+        ''',
+        'no_gift': '''
+            SELECT p.user_id FROM participants p
+            JOIN draw_results dr ON dr.event_id = p.event_id AND dr.santa_id = p.user_id
+            WHERE p.event_id = ? AND p.is_active = 1 AND p.gift_code IS NULL
+              AND p.user_id > ? AND (p.reminded_at IS NULL OR p.reminded_at < ?) AND dr.draw_date <= ?
+            ORDER BY p.user_id LIMIT ?
+        ''',
+    }
+    
+    # Меньше нельзя: иначе проход повторялся бы сразу и одному участнику приходило бы по сообщению в секунду
+    REMINDER_MIN_INTERVAL = 600
+    
+    def set_reminder_job(self, event_id, kind, interval, cooldown, delay=0):
+        """
+        Включает напоминание игры (одно на вид); первый проход - сразу.
+        interval и cooldown не меньше REMINDER_MIN_INTERVAL секунд.
+        """
+        interval = max(interval, self.REMINDER_MIN_INTERVAL)
+        cooldown = max(cooldown, self.REMINDER_MIN_INTERVAL)
+        delay = max(delay, 0)
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO reminder_jobs (event_id, kind, delay, interval, cooldown, next_run_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (event_id, kind) DO UPDATE SET
+                    delay = excluded.delay, interval = excluded.interval, cooldown = excluded.cooldown,
+                    last_user_id = 0, next_run_at = excluded.next_run_at, status = 'active'
+            ''', (event_id, kind, delay, interval, cooldown, time.time(), datetime.now()))
+    
+    def stop_reminder_jobs(self, event_id):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE reminder_jobs SET status = 'stopped' WHERE event_id = ? AND status = 'active'
+            ''', (event_id,))
+            return cursor.rowcount
+    
+    def _reminder_jobs(self, where, params=()):
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT id, event_id, kind, delay, interval, cooldown, last_user_id, next_run_at, sent, failed, status
+                FROM reminder_jobs WHERE {where}
+            ''', params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    def get_reminder_jobs(self, event_id):
+        return self._reminder_jobs('event_id = ? ORDER BY id', (event_id,))
+    
+    def get_due_reminder_jobs(self, now, limit=20):
+        return self._reminder_jobs(
+            "status = 'active' AND next_run_at <= ? ORDER BY next_run_at LIMIT ?", (now, limit)
+        )
+    
+    def get_reminder_targets(self, job, now, limit=200):
+        """Следующие limit адресатов задания после job['last_user_id'], кому давно не напоминали"""
+        params = [job['event_id'], job['last_user_id'], now - job['cooldown']]
+        if job['kind'] == 'no_gift':
+            params.append(datetime.fromtimestamp(now - job['delay']))
+        with self._read() as cursor:
+            cursor.execute(self.REMINDER_TARGETS[job['kind']], [*params, limit])
+            return [row[0] for row in cursor.fetchall()]
+    
+    def advance_reminder_job(self, job, last_user_id, reminded, failed, now, finished):
+        """
+        Итог одной пачки напоминаний одной транзакцией: отметка reminded_at доставленным
+        и позиция задания. finished - проход окончен: следующий через interval с начала списка.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE participants SET reminded_at = ? WHERE event_id = ? AND user_id = ?
+            ''', [(now, job['event_id'], user_id) for user_id in reminded])
+            cursor.execute('''
+                UPDATE reminder_jobs
+                SET last_user_id = ?, next_run_at = ?, sent = sent + ?, failed = failed + ?
+                WHERE id = ?
+            ''', (0 if finished else last_user_id, now + job['interval'] if finished else job['next_run_at'],
+                  len(reminded), failed, job['id']))
+    
+    # Журнал изменений и снимки (audit.py)
+    
+    def get_audit_log(self, event_id, after_id=0, limit=100):
+        """Записи журнала игры по возрастанию: [(id, вид, user_id, данные JSON, время)]"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT id, kind, user_id, data, created_at FROM audit_log
+                WHERE event_id = ? AND id > ? ORDER BY id LIMIT ?
+            ''', (event_id, after_id, limit))
+            return cursor.fetchall()
+    
+    def current_state(self, event_id):
+        """Состояние игры из таблиц - для сверки с rebuild_state"""
+        with self._read() as cursor:
+            return _read_state(cursor, event_id)
+    
+    def rebuild_state(self, event_id, until_id=None):
+        """
+        Состояние игры после записи журнала until_id (None - текущее): ближайший снимок
+        до нее и записи после снимка. Время - по числу записей после снимка, а не по всей истории.
+        Если история до until_id уже сжата (compact_audit_log), бросает ValueError.
+        """
+        if until_id is None:
+            until_id = 2 ** 63 - 1  # Наибольший INTEGER SQLite: без ограничения
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT last_log_id, state FROM audit_snapshots
+                WHERE event_id = ? AND last_log_id <= ? ORDER BY last_log_id DESC LIMIT 1
+            ''', (event_id, until_id))
+            snapshot = cursor.fetchone()
+            if snapshot is None:
+                raise ValueError(f"История игры до записи #{until_id} уже удалена из журнала")
+            state = load_state(snapshot[1])
+            cursor.execute('''
+                SELECT kind, user_id, data FROM audit_log WHERE event_id = ? AND id > ? AND id <= ? ORDER BY id
+            ''', (event_id, snapshot[0], until_id))
+            for kind, user_id, data in cursor:
+                apply_entry(state, kind, user_id, json.loads(data) if data else None)
+        return state
     
-    def is_draw_completed(self):
-        self.cursor.execute('SELECT COUNT(*) FROM draw_results')
-        return self.cursor.fetchone()[0] > 0
+    def create_audit_snapshot(self, event_id):
+        """Снимок текущего состояния игры; возвращает номер последней учтенной записи журнала"""
+        with self.transaction(immediate=True) as cursor:
+            return _take_snapshot(cursor, event_id)
+    
+    def get_events_for_snapshot(self, min_entries):
+        """Игры, у которых после последнего снимка не меньше min_entries записей журнала"""
+        with self._read() as cursor:
+            # OFFSET по индексу: для каждой игры читается не больше min_entries записей
+            cursor.execute('''
+                SELECT DISTINCT event_id FROM audit_snapshots s
+                WHERE last_log_id = (SELECT MAX(last_log_id) FROM audit_snapshots WHERE event_id = s.event_id)
+                  AND (SELECT id FROM audit_log WHERE event_id = s.event_id AND id > s.last_log_id
+                       ORDER BY id LIMIT 1 OFFSET ?) IS NOT NULL
+            ''', (min_entries - 1,))
+            return [row[0] for row in cursor.fetchall()]
+    
+    def compact_audit_log(self, before):
+        """
+        Удаляет снимки старше before (кроме последнего снимка игры) и записи журнала,
+        покрытые самым старым из оставшихся снимков: восстановить можно любой момент после него.
+        Возвращает число удаленных записей журнала.
+        """
+        deleted = 0
+        with self._read() as cursor:
+            cursor.execute('SELECT event_id, MAX(last_log_id) FROM audit_snapshots GROUP BY event_id')
+            events = cursor.fetchall()
+        for event_id, newest in events:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    DELETE FROM audit_snapshots WHERE event_id = ? AND last_log_id < ? AND created_at < ?
+                ''', (event_id, newest, before))
+                cursor.execute('SELECT MIN(last_log_id) FROM audit_snapshots WHERE event_id = ?', (event_id,))
+                horizon = cursor.fetchone()[0]
+                cursor.execute('''
+                    DELETE FROM audit_log WHERE event_id = ? AND id <= ? AND created_at < ?
+                ''', (event_id, horizon, before))
+                deleted += cursor.rowcount
+        return deleted
     
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        if self._readers is not None:
+            for _ in range(self._reader_count):
+                self._readers.get().close()
+        self.conn.close()
+
+
+def _timed(name, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        DB_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обертка над Database.
+    Каждый вызов выполняется в ограниченном пуле потоков, поэтому
+    commit() и fetchall() не блокируют цикл событий aiogram.
+    Чтения идут параллельно через соединения-читатели, записи - через одного писателя.
+    Методы повторяют интерфейс Database, но возвращают корутины.
+
+    Однострочные записи (регистрация, адрес, подарок) не коммитятся по одной:
+    они копятся batch_window секунд или до batch_size штук и пишутся
+    одной транзакцией. Вызов завершается только после коммита своей пачки.
+    """
+
+    BATCHED_METHODS = frozenset({'add_participant', 'update_address', 'update_gift_code'})
+
+    def __init__(self, db_name='santa.db', workers=4, batch_window=0.01, batch_size=100, cache_size=10_000):
+        self._db = Database(db_name, cache_size=cache_size, readers=workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self._batch_window = batch_window
+        self._batch_size = batch_size
+        self._pending = []  # [(func, args, kwargs, future)]
+        self._flush_timer = None
+        self._flushes = set()
+
+    def _write_batch(self, ops):
+        """Выполняет пачку записей одной транзакцией; возвращает [(ok, результат или ошибка)]"""
+        try:
+            with self._db.transaction():
+                return [(True, func(*args, **kwargs)) for func, args, kwargs in ops]
+        except Exception:
+            pass
+        # Пачка откатилась целиком: повторяем по одной, чтобы ошибку получил только виновный вызов
+        results = []
+        for func, args, kwargs in ops:
+            try:
+                results.append((True, func(*args, **kwargs)))
+            except Exception as e:
+                results.append((False, e))
+        return results
+
+    def _schedule_flush(self):
+        self._flush_timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        loop = asyncio.get_running_loop()
+        ops = [(func, args, kwargs) for func, args, kwargs, _ in batch]
+        try:
+            results = await loop.run_in_executor(
+                self._executor, functools.partial(_timed, 'write_batch', self._write_batch, ops)
+            )
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        for (_, _, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def _enqueue_write(self, func, args, kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, args, kwargs, future))
+        if len(self._pending) >= self._batch_size:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._schedule_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self._batch_window, self._schedule_flush)
+        return await future
+
+    def __getattr__(self, name):
+        if name.startswith('iter_'):
+            # Генератор читал бы базу в потоке цикла событий: асинхронно - только постранично
+            raise AttributeError(f"{name} доступен только в Database; используйте постраничные методы")
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+        # Время выполнения в потоке базы, без ожидания свободного потока
+        attr = functools.partial(_timed, name, attr)
+
+        if name in self.BATCHED_METHODS:
+            async def method(*args, **kwargs):
+                return await self._enqueue_write(attr, args, kwargs)
+        else:
+            async def method(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, functools.partial(attr, *args, **kwargs)
+                )
+
+        method.__name__ = name
+        return method
+
+    async def flush(self):
+        """Дожидается записи всех накопленных изменений"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._db.close)
+        self._executor.shutdown(wait=True)
+
+
+# Что разрешено читать целиком: CONSTANT ROW - SELECT без таблицы
+FULL_SCAN_TABLES = {'CONSTANT'}
+
+
+def check_query_plans():
+    """
+    Проверка планов запросов: выполняет методы Database на временной базе,
+    записывает все запросы и возвращает [(запрос, шаг плана)] для тех,
+    что читают таблицу целиком без индекса.
+    """
+    db = Database(':memory:')
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+
+    event_id, code = db.create_event('Офис', admin_id=1)
+    db.get_event_by_code(code)
+    db.is_event_admin(event_id, 1)
+    db.set_current_event(1, event_id)
+    db.get_current_event(1)
+    for user_id in range(1, 6):
+        db.add_participant(event_id, user_id, f'user{user_id}', f'Участник {user_id}')
+    db.update_address(event_id, 1, 'Москва')
+    db.update_gift_code(event_id, 1, 'QR')
+    db.get_participant(event_id, 1)
+    list(db.iter_participants(event_id, chunk_size=2))
+    list(db.iter_active_user_ids(event_id, chunk_size=2))
+    for filter_name in Database.PARTICIPANT_FILTERS:
+        db.get_participants_page(event_id, filter_name, after_id=1, limit=2)
+        db.get_participants_page(event_id, filter_name, before_id=4, limit=2)
+    db.get_participants_summary(event_id)
+    db.import_participants(event_id, [{'user_id': 7, 'username': 'user7', 'full_name': 'Участник 7'}])
+    db.add_exclusion(event_id, 1, 2)
+    db.get_exclusions(event_id, include_previous_draw=True)
+    db.perform_draw(event_id)
+    db.set_notification_statuses(event_id, [(1, 'sent')])
+    db.get_assignments(event_id, undelivered_only=True)
+    db.get_assignments(event_id, after_id=2, limit=2)
+    db.count_assignments(event_id, undelivered_only=True)
+    db.add_participant(event_id, 6, 'user6', 'Участник 6')
+    db.add_to_draw(event_id, 6)
+    db.remove_from_draw(event_id, 3)
+    with tempfile.TemporaryDirectory() as directory:
+        db.export_participants(event_id, os.path.join(directory, 'participants.jsonl'), 'jsonl')
+        db.export_draw_results(event_id, os.path.join(directory, 'draw.csv'))
+    db.invalidate_cache()
+    db.get_recipient(event_id, 1)
+    db.get_santa(event_id, 1)
+    db.is_draw_completed(event_id)
+    db.count_active_participants(event_id)
+    db.get_active_user_ids(event_id, after_id=2)
+    job_id = db.create_broadcast_job(event_id, 'Текст', 1, 1, 5)
+    db.update_broadcast_progress(job_id, 3, 3, 0)
+    db.get_broadcast_job(job_id)
+    db.get_unfinished_broadcast_jobs()
+    db.finish_broadcast_job(job_id)
+    for kind in Database.REMINDER_TARGETS:
+        db.set_reminder_job(event_id, kind, interval=3600, cooldown=3600)
+    for job in db.get_due_reminder_jobs(time.time() + 1):
+        targets = db.get_reminder_targets(job, time.time(), limit=2)
+        db.advance_reminder_job(job, targets[-1] if targets else 0, targets, 0, time.time(), finished=False)
+    db.get_reminder_jobs(event_id)
+    db.stop_reminder_jobs(event_id)
+
+    db.perform_draw(event_id)
+    db.restore_previous_draw(event_id)
+    db.get_audit_log(event_id, after_id=1)
+    db.create_audit_snapshot(event_id)
+    db.get_events_for_snapshot(1)
+    db.rebuild_state(event_id)
+    db.current_state(event_id)
+    db.compact_audit_log(time.time() + 1)
+
+    db.create_gift_handoff('1:2:10', event_id, 2, 3, 'AgACAgIAAxkBAAI', 'Москва, ПВЗ', 'CDEK:123456')
+    for handoff in db.claim_gift_handoffs(now=time.time() + 1):
+        db.retry_gift_handoff(handoff['id'], 0, 'failed')
+        db.finish_gift_handoff(handoff['id'], 'sent')
+
+    db.save_fsm_records([('1:1:1:default', 'Form:waiting_for_address', '{}', 1.0), ('1:2:2:default', None, None, 1.0)])
+    db.get_fsm_record('1:1:1:default')
+    db.count_fsm_states(0.5)
+    db.delete_expired_fsm_records(0.5)
+
+    db.conn.set_trace_callback(None)
+    problems = []
+    for sql in dict.fromkeys(statements):
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        for *_, detail in db.conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall():
+            if (detail.startswith('SCAN ') and ' USING ' not in detail
+                    and detail.split()[1] not in FULL_SCAN_TABLES):
+                problems.append((' '.join(sql.split()), detail))
+    db.close()
+    return problems
+
+
+def memory_benchmark(n):
+    """
+    Пиковая память Python (tracemalloc) на операциях со всеми участниками игры из n человек:
+    прежний способ (fetchall всех колонок, список пар целиком) против потокового.
+    """
+    results = []
+
+    def measure(title, func):
+        tracemalloc.start()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((title, peak / 1024 / 1024, elapsed * 1000))
+
+    def fetch_all_rows():
+        with db._read() as cursor:
+            rows = cursor.execute('SELECT * FROM participants WHERE event_id = ? AND is_active = 1', (event_id,))
+            rows = rows.fetchall()
+        return [row[0] for row in rows]
+
+    def stream_participants():
+        for _ in db.iter_participants(event_id):
+            pass
+
+    def all_assignments():
+        db.get_assignments(event_id)
+
+    def paged_assignments():
+        after_id = 0
+        while True:
+            page = db.get_assignments(event_id, after_id=after_id, limit=500)
+            if not page:
+                break
+            after_id = page[-1][0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'))
+        event_id = DEFAULT_EVENT_ID
+        db.import_participants(event_id, (
+            {'user_id': user_id, 'username': f'user{user_id}', 'full_name': f'Участник {user_id}',
+             'address': f'Москва, ул. Тверская, д. {user_id}'}
+            for user_id in range(1, n + 1)
+        ), chunk_size=5000)
+        db.perform_draw(event_id)
+        measure("SELECT * fetchall -> список user_id (было)", fetch_all_rows)
+        measure("iter_participants, пачки по 1000", stream_participants)
+        measure("user_id списком", lambda: list(db.iter_active_user_ids(event_id)))
+        measure("user_id в array('q')", lambda: array('q', db.iter_active_user_ids(event_id)))
+        measure("get_assignments целиком (было)", all_assignments)
+        measure("get_assignments страницами по 500", paged_assignments)
+        measure("perform_draw", lambda: db.perform_draw(event_id))
+        db.close()
+    return results
+
+
+def write_benchmark(n, concurrency=100):
+    """
+    Регистрации в секунду через AsyncDatabase: групповой коммит против транзакции на каждую запись
+    (batch_size=1 - та же очередь и пул потоков, но пачка из одной записи).
+    concurrency вызовов add_participant одновременно, как при наплыве /start.
+    Возвращает [(название, строк в секунду, p99 вызова в мс)].
+    """
+    async def measure(batch_size, directory):
+        db = AsyncDatabase(os.path.join(directory, f'write-{batch_size}.db'), batch_size=batch_size)
+        latencies = []
+
+        async def register(user_ids):
+            for user_id in user_ids:
+                began = time.perf_counter()
+                await db.add_participant(DEFAULT_EVENT_ID, user_id, f'user{user_id}', f'Участник {user_id}')
+                latencies.append(time.perf_counter() - began)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(register(range(first, n + 1, concurrency)) for first in range(1, concurrency + 1)))
+        elapsed = time.perf_counter() - started
+        await db.close()
+        latencies.sort()
+        return n / elapsed, latencies[int(len(latencies) * 0.99)] * 1000
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for title, batch_size in (('Групповой коммит (batch_size=100)', 100), ('Коммит на запись (batch_size=1)', 1)):
+            results.append((title, *asyncio.run(measure(batch_size, directory))))
+    return results
+
+
+def latency_benchmark(levels=(10, 100, 1000), reply_latency=0.03):
+    """
+    Задержка обработчиков при n одновременных /start: прежний путь (методы Database прямо
+    в цикле событий, коммит блокирует цикл) против AsyncDatabase (пул потоков, групповой коммит).
+    Обработчик /start читает текущую игру, регистрирует участника и отвечает (ответ - reply_latency секунд).
+    Пока они идут, проба раз в 5 мс замеряет, насколько опаздывает цикл событий -
+    столько ждет любой другой апдейт, например нажатие кнопки меню.
+    Возвращает [(путь, n, p99 /start в мс, p99 опоздания цикла в мс)].
+    """
+    def p99(values):
+        values = sorted(values)
+        return values[int(len(values) * 0.99)] * 1000 if values else 0.0
+
+    async def measure(path, n, directory):
+        if path == 'blocking':
+            db = Database(os.path.join(directory, f'{path}-{n}.db'))
+
+            async def call(name, *args):
+                return getattr(db, name)(*args)
+        else:
+            db = AsyncDatabase(os.path.join(directory, f'{path}-{n}.db'))
+
+            async def call(name, *args):
+                return await getattr(db, name)(*args)
+
+        async def start(user_id):
+            began = time.perf_counter()
+            event_id = await call('get_current_event', user_id)
+            await call('get_event', event_id)
+            await call('add_participant', event_id, user_id, f'user{user_id}', f'Участник {user_id}')
+            await asyncio.sleep(reply_latency)
+            return time.perf_counter() - began
+
+        lags = []
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                began = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - began - 0.005)
+
+        probing = asyncio.create_task(probe())
+        await asyncio.sleep(0.02)
+        latencies = await asyncio.gather(*(start(user_id) for user_id in range(1, n + 1)))
+        done.set()
+        await probing
+        if path == 'blocking':
+            db.close()
+        else:
+            await db.close()
+        return p99(latencies), p99(lags)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for path in ('blocking', 'async'):
+            for n in levels:
+                results.append((path, n, *asyncio.run(measure(path, n, directory))))
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    # python database.py --latency-bench - задержка обработчиков с пулом потоков и без него
+    if '--latency-bench' in sys.argv:
+        print("Одновременных /start, p99 обработчика /start и p99 опоздания цикла событий:")
+        for path, n, start_p99, lag_p99 in latency_benchmark():
+            print(f"  {path:<9}{n:6}{start_p99:10.1f} мс{lag_p99:10.1f} мс")
+        raise SystemExit(0)
+    # python database.py --write-bench [N] - регистрации в секунду с групповым коммитом и без него
+    if '--write-bench' in sys.argv:
+        position = sys.argv.index('--write-bench') + 1
+        n = int(sys.argv[position]) if position < len(sys.argv) else 10_000
+        print(f"{n} регистраций, по 100 одновременно:")
+        for title, rows_per_second, p99 in write_benchmark(n):
+            print(f"  {title:<40}{rows_per_second:10.0f} строк/с  p99 {p99:7.1f} мс")
+        raise SystemExit(0)
+    # python database.py --memory [N] - замер памяти на игре из N участников
+    if '--memory' in sys.argv:
+        position = sys.argv.index('--memory') + 1
+        n = int(sys.argv[position]) if position < len(sys.argv) else 100_000
+        print(f"Игра из {n} участников, пик памяти Python:")
+        for title, megabytes, milliseconds in memory_benchmark(n):
+            print(f"  {title:<46}{megabytes:8.1f} МБ{milliseconds:9.0f} мс")
+        raise SystemExit(0)
+    # python database.py - проверить, что все запросы используют индексы
+    problems = check_query_plans()
+    for sql, detail in problems:
+        print(f"{detail}: {sql}")
+    print("Все запросы используют индексы" if not problems else f"Запросов без индекса: {len(problems)}")
+    raise SystemExit(1 if problems else 0)
@@ -0,0 +1,200 @@
+# draw.py
+import random
+from array import array
+from collections import deque
+
+
+class DrawError(Exception):
+    """Жеребьевку невозможно провести с заданными ограничениями"""
+
+
+def draw_pairs(user_ids, exclusions=None, rng=None):
+    """
+    Распределяет получателей: возвращает словарь {santa_id: recipient_id}.
+
+    Без ограничений строится случайный гамильтонов цикл за один проход:
+    никто не достается сам себе, повторные перемешивания не нужны.
+    exclusions - словарь {santa_id: множество запрещенных recipient_id}
+    (пары, прошлогодние получатели). Ребра цикла, нарушающие ограничения,
+    снимаются и достраиваются увеличивающими путями в двудольном графе.
+    """
+    rng = rng or random
+    # Порядок - массив int64, а не список объектов int: 8 байт на участника
+    order = array('q', user_ids)
+    n = len(order)
+    if n < 2:
+        raise DrawError("Для жеребьевки нужно минимум 2 участника")
+
+    rng.shuffle(order)
+    recipient_of = dict(zip(order, order[1:] + order[:1]))
+    if not exclusions:
+        return recipient_of
+
+    # Снимаем запрещенные пары, остальная часть цикла остается паросочетанием
+    unmatched = [s for s, r in recipient_of.items() if r in exclusions.get(s, ())]
+    for santa_id in unmatched:
+        del recipient_of[santa_id]
+    santa_of = {r: s for s, r in recipient_of.items()}
+
+    for santa_id in unmatched:
+        if not _augment(santa_id, order, recipient_of, santa_of, exclusions, rng):
+            raise DrawError("Ограничения не позволяют провести жеребьевку")
+    return recipient_of
+
+
+def _augment(start, user_ids, recipient_of, santa_of, exclusions, rng):
+    """
+    Ищет поиском в ширину увеличивающий путь от санты без получателя.
+    Граф неявный: санте доступны все, кроме него самого и исключений.
+    Каждый получатель посещается один раз, поэтому поиск занимает O(n + исключения).
+    """
+    unvisited = set(user_ids)
+    came_from = {}
+    queue = deque([start])
+    while queue:
+        santa_id = queue.popleft()
+        banned = exclusions.get(santa_id, ())
+        reachable = [r for r in unvisited if r != santa_id and r not in banned]
+        # Начинаем со случайного места, чтобы исход не зависел от порядка хешей
+        offset = rng.randrange(len(reachable)) if reachable else 0
+        for recipient_id in reachable[offset:] + reachable[:offset]:
+            unvisited.discard(recipient_id)
+            came_from[recipient_id] = santa_id
+            if recipient_id not in santa_of:
+                # Свободный получатель найден: переставляем пары вдоль пути
+                while True:
+                    santa_id = came_from[recipient_id]
+                    previous = recipient_of.get(santa_id)
+                    recipient_of[santa_id] = recipient_id
+                    santa_of[recipient_id] = santa_id
+                    if santa_id == start:
+                        return True
+                    recipient_id = previous
+            queue.append(santa_of[recipient_id])
+    return False
+
+
+class DrawCycle:
+    """
+    Назначения жеребьевки в памяти для точечных изменений после нее.
+    Новый участник встраивается в разрыв одного ребра (a -> b становится a -> новый -> b),
+    выбывший обходится (s -> выбывший -> r становится s -> r) - меняются 1-2 пары, остальные остаются.
+    После исключений назначения могут состоять из нескольких циклов: операции это допускают.
+    plan_* только подбирают новые пары {santa_id: recipient_id}, apply() применяет их.
+    """
+
+    # Сколько случайных ребер пробовать до полного перебора
+    SAMPLES = 32
+
+    def __init__(self, recipient_of):
+        self.recipient_of = dict(recipient_of)
+        self.santa_of = {r: s for s, r in self.recipient_of.items()}
+        # Санты в списке - случайное ребро за O(1); удаление - обменом с последним
+        self._santas = list(self.recipient_of)
+        self._position = {s: i for i, s in enumerate(self._santas)}
+
+    def __len__(self):
+        return len(self._santas)
+
+    def __contains__(self, user_id):
+        return user_id in self.recipient_of
+
+    def _candidates(self, rng, skip):
+        """Санты в случайном порядке: сначала выборка, затем (если не нашлось) все по кругу"""
+        n = len(self._santas)
+        if not n:
+            return
+        for _ in range(min(n, self.SAMPLES)):
+            santa_id = self._santas[rng.randrange(n)]
+            if santa_id not in skip:
+                yield santa_id
+        offset = rng.randrange(n)
+        for i in range(n):
+            santa_id = self._santas[(offset + i) % n]
+            if santa_id not in skip:
+                yield santa_id
+
+    def plan_insert(self, user_id, exclusions=None, rng=None, skip=()):
+        """Пары для встраивания user_id в ребро a -> b (кроме ребер сант из skip)"""
+        rng = rng or random
+        exclusions = exclusions or {}
+        banned = exclusions.get(user_id, ())
+        for santa_id in self._candidates(rng, skip):
+            recipient_id = self.recipient_of[santa_id]
+            if (user_id not in (santa_id, recipient_id)
+                    and user_id not in exclusions.get(santa_id, ()) and recipient_id not in banned):
+                return {santa_id: user_id, user_id: recipient_id}
+        raise DrawError("Ограничения не позволяют добавить участника")
+
+    def plan_remove(self, user_id, exclusions=None, rng=None):
+        """Пары после выбывания user_id: его санта получает его получателя"""
+        rng = rng or random
+        exclusions = exclusions or {}
+        if len(self._santas) <= 2:
+            raise DrawError("После выбывания останется меньше 2 участников")
+        santa_id = self.santa_of[user_id]
+        recipient_id = self.recipient_of[user_id]
+        if santa_id == recipient_id:
+            # Выбывший и его санта дарили друг другу: санту встраиваем в другое ребро
+            return self.plan_insert(santa_id, exclusions, rng, skip=(user_id, santa_id))
+        if recipient_id not in exclusions.get(santa_id, ()):
+            return {santa_id: recipient_id}
+        # Прямая пара запрещена: меняемся получателями с другим сантой c -> d (s -> d, c -> r)
+        banned = exclusions.get(santa_id, ())
+        for other_id in self._candidates(rng, (user_id, santa_id, recipient_id)):
+            other_recipient = self.recipient_of[other_id]
+            if (other_recipient != santa_id and other_recipient not in banned
+                    and recipient_id not in exclusions.get(other_id, ())):
+                return {santa_id: other_recipient, other_id: recipient_id}
+        raise DrawError("Ограничения не позволяют исключить участника")
+
+    def apply(self, pairs, removed=None):
+        """Применяет пары из plan_*; removed - выбывший участник"""
+        if removed is not None:
+            del self.recipient_of[removed]
+            self.santa_of.pop(removed, None)
+            position = self._position.pop(removed)
+            last = self._santas.pop()
+            if last != removed:
+                self._santas[position] = last
+                self._position[last] = position
+        for santa_id, recipient_id in pairs.items():
+            if santa_id not in self.recipient_of:
+                self._position[santa_id] = len(self._santas)
+                self._santas.append(santa_id)
+            self.recipient_of[santa_id] = recipient_id
+            self.santa_of[recipient_id] = santa_id
+
+
+if __name__ == "__main__":
+    # Замер скорости: python draw.py [число участников]
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    ids = list(range(1, n + 1))
+    # Пары: 1-2, 3-4, ... не должны дарить друг другу
+    couples = {}
+    for a in range(1, n, 2):
+        couples[a] = {a + 1}
+        couples[a + 1] = {a}
+
+    for title, exclusions in (("без ограничений", None), ("с исключениями пар", couples)):
+        started = time.perf_counter()
+        pairs = draw_pairs(ids, exclusions)
+        elapsed = (time.perf_counter() - started) * 1000
+        assert all(s != r and r not in (exclusions or {}).get(s, ()) for s, r in pairs.items())
+        assert sorted(pairs.values()) == ids
+        print(f"{n} участников, {title}: {elapsed:.1f} мс")
+
+    # Точечные изменения после жеребьевки: 1000 опоздавших и 1000 выбывших
+    cycle = DrawCycle(pairs)
+    started = time.perf_counter()
+    for user_id in range(n + 1, n + 1001):
+        cycle.apply(cycle.plan_insert(user_id, couples))
+    for user_id in range(1, 1001):
+        cycle.apply(cycle.plan_remove(user_id, couples), removed=user_id)
+    elapsed = (time.perf_counter() - started) * 1000
+    assert sorted(cycle.recipient_of) == sorted(cycle.recipient_of.values()) == list(range(1001, n + 1001))
+    assert all(s != r and r not in couples.get(s, ()) for s, r in cycle.recipient_of.items())
+    print(f"1000 добавлений и 1000 исключений: {elapsed:.1f} мс")
@@ -1,65 +1,108 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from texts import BUTTONS, DEFAULT_LOCALE, get_text
+
 # Основная клавиатура
-def get_main_keyboard():
-    """
-    Создает и возвращает основную клавиатуру для пользователя.
-    """
+def _build_main_keyboard(buttons):
     keyboard = [
-        [KeyboardButton(text="🎅 Стать участником")],
-        [KeyboardButton(text="📦 Указать адрес доставки")],
-        [KeyboardButton(text="🎁 Узнать своего получателя")],
-        [KeyboardButton(text="📦 Отправить QR-код и адрес выдачи")],
-        [KeyboardButton(text="ℹ️ Помощь")]
+        [KeyboardButton(text=buttons['join'])],
+        [KeyboardButton(text=buttons['set_address'])],
+        [KeyboardButton(text=buttons['my_recipient'])],
+        [KeyboardButton(text=buttons['send_qr'])],
+        [KeyboardButton(text=buttons['help'])]
     ]
     
     return ReplyKeyboardMarkup(
         keyboard=keyboard,
         resize_keyboard=True,
-        input_field_placeholder="Выберите действие..."
+        input_field_placeholder=buttons['main_placeholder']
     )
 
 # Клавиатура администратора
-def get_admin_keyboard():
-    """
-    Создает и возвращает клавиатуру для администратора.
-    """
+def _build_admin_keyboard(buttons):
     keyboard = [
-        [KeyboardButton(text="👥 Список участников")],
-        [KeyboardButton(text="🎲 Провести жеребьевку")],
-        [KeyboardButton(text="📢 Сделать рассылку")],
-        [KeyboardButton(text="◀️ Назад")]
+        [KeyboardButton(text=buttons['participants'])],
+        [KeyboardButton(text=buttons['draw'])],
+        [KeyboardButton(text=buttons['resend'])],
+        [KeyboardButton(text=buttons['broadcast'])],
+        [KeyboardButton(text=buttons['back'])]
     ]
     
     return ReplyKeyboardMarkup(
         keyboard=keyboard,
         resize_keyboard=True,
-        input_field_placeholder="Панель управления..."
+        input_field_placeholder=buttons['admin_placeholder']
     )
 
 # Инлайн кнопка для подтверждения участия
-def get_confirm_keyboard():
-    """
-    Создает и возвращает инлайн-клавиатуру для подтверждения участия.
-    """
-    buttons = [
-        [InlineKeyboardButton(text="✅ Да, я участвую!", callback_data="confirm_participation")]
-    ]
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def _build_confirm_keyboard(buttons):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=buttons['confirm'], callback_data="confirm_participation")]
+    ])
 
 # Клавиатура только с кнопкой отмены (для FSM состояний)
-def get_cancel_keyboard():
+def _build_cancel_keyboard(buttons):
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=buttons['cancel'])]],
+        resize_keyboard=True,
+        one_time_keyboard=True  # Скрывается после нажатия
+    )
+
+# Постоянные клавиатуры собираются один раз для каждого языка: обработчики
+# отдают готовые объекты и не создают модели pydantic на каждое сообщение
+KEYBOARDS = {
+    (name, locale): build(buttons)
+    for locale, buttons in BUTTONS.items()
+    for name, build in (
+        ('main', _build_main_keyboard),
+        ('admin', _build_admin_keyboard),
+        ('confirm', _build_confirm_keyboard),
+        ('cancel', _build_cancel_keyboard),
+    )
+}
+
+def get_main_keyboard(locale=DEFAULT_LOCALE):
+    """Основная клавиатура пользователя"""
+    return KEYBOARDS['main', locale]
+
+def get_admin_keyboard(locale=DEFAULT_LOCALE):
+    """Клавиатура администратора"""
+    return KEYBOARDS['admin', locale]
+
+def get_confirm_keyboard(locale=DEFAULT_LOCALE):
+    """Инлайн-клавиатура подтверждения участия"""
+    return KEYBOARDS['confirm', locale]
+
+def get_cancel_keyboard(locale=DEFAULT_LOCALE):
+    """Клавиатура с кнопкой отмены для состояний, где пользователь вводит текст"""
+    return KEYBOARDS['cancel', locale]
+
+# Фильтры списка участников (подписи - в texts.py)
+PARTICIPANT_FILTERS = ('all', 'no_address', 'no_gift')
+
+# Инлайн-клавиатура страницы списка участников
+def get_participants_page_keyboard(filter_name, first_id, last_id, has_prev, has_next, locale=DEFAULT_LOCALE):
     """
-    Создает простую клавиатуру с кнопкой отмены.
-    Полезна для состояний, где пользователь вводит текст.
+    Создает клавиатуру для листания списка участников.
+    callback_data: plist:<фильтр>:<направление>:<user_id-граница>
+    (n - следующая страница после user_id, p - предыдущая перед user_id).
     """
-    keyboard = [
-        [KeyboardButton(text="❌ Отмена")]
+    filters = [
+        InlineKeyboardButton(
+            text=("• " if name == filter_name else "") + get_text(f"filter_{name}", locale),
+            callback_data=f"plist:{name}:n:0"
+        )
+        for name in PARTICIPANT_FILTERS
     ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"plist:{filter_name}:p:{first_id}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"plist:{filter_name}:n:{last_id}"))
     
-    return ReplyKeyboardMarkup(
-        keyboard=keyboard,
-        resize_keyboard=True,
-        one_time_keyboard=True  # Скрывается после нажатия
-    )
\ No newline at end of file
+    buttons = [filters]
+    if navigation:
+        buttons.append(navigation)
+    buttons.append([InlineKeyboardButton(text=get_text("export_csv", locale), callback_data="plist_export")])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
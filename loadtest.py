@@ -0,0 +1,713 @@
+# loadtest.py
+"""
+Нагрузочное тестирование: python loadtest.py [--users 10000] [--output loadtest-results.json]
+
+Поднимает локальный фейковый Bot API (getUpdates, sendMessage, sendPhoto, editMessageText
+с задержкой, ответами 429 и заблокированными пользователями), запускает бота отдельным
+процессом против него (TELEGRAM_API_URL) и прогоняет сценарии:
+- registration: все пользователи одновременно присылают /start;
+- menu: все пользователи нажимают кнопки меню (процессорное время на апдейт);
+- draw: жеребьевка и рассылка результатов всем участникам;
+- broadcast: рассылка организатора всем участникам;
+- qr_handoff: санты отправляют QR-код и адрес выдачи своим получателям (gifts_delivered - сколько фото дошло).
+- reminders: организатор включает /remind gift (через секунду после жеребьевки) - напоминания сантам, не отправившим подарок;
+- spam: пользователи многократно жмут одну кнопку (suppressed - сколько нажатий отсечено);
+- webhook: все пользователи одновременно нажимают кнопку через webhook (только --mode webhook):
+  сколько апдейтов в секунду принимает бот (rejected - ответы с ошибкой).
+
+Для каждого сценария считаются пропускная способность, p50/p99 задержки, пиковая память
+и процессорное время процесса бота (для --cluster - только супервизора). Результаты пишутся в JSON, чтобы сравнивать запуски между собой.
+Сравнение настроек: --env DB_BATCH_SIZE=1 (коммит на каждую запись), --cluster 4 (cluster.py вместо bot.py),
+--mode webhook (апдейты приходят бот POST-запросами вместо getUpdates).
+Масштабирование по воркерам: --cluster-sweep 1,2,4 - те же сценарии для каждого числа воркеров
+(отдельный запуск cluster.py с чистой базой) и сводка апдейтов в секунду.
+
+Хранилища FSM без бота: python loadtest.py --fsm-bench [--users 10000] - шаги диалога
+(get_state, get_data, set_data, set_state) на MemoryStorage и SQLiteStorage.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+TOKEN = '123456:loadtest'
+ADMIN_ID = 1
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeBotAPI:
+    """
+    Минимальный Bot API: отдает апдейты через getUpdates и принимает ответы бота.
+    latency - задержка каждого ответа, rate_limit_ratio - доля отправок, получающих 429,
+    blocked - чаты, заблокировавшие бота (403); задаются после регистрации.
+    Пока бот не вызвал setWebhook, апдейты отдаются через getUpdates, после - отправляются ему POST-запросом.
+    """
+
+    def __init__(self, latency=0.03, rate_limit_ratio=0.01, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.blocked = set()
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.ready = asyncio.Event()  # Бот запросил апдейты (getUpdates или setWebhook)
+        self.webhook = None  # (url, secret_token) после setWebhook
+        self.webhook_statuses = Counter()
+        self._rng = random.Random(seed)
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self._waiters = {}  # chat_id -> [future следующего sendMessage в чат]
+        self._collectors = []
+        self._session = None
+        self._posts = set()  # Незавершенные POST-запросы webhook (задачи без ссылок собрал бы сборщик мусора)
+
+    # Апдейты от пользователей
+
+    def push(self, chat_id, text=None, photo_id=None):
+        """Апдейт от пользователя; в режиме webhook возвращает задачу POST-запроса (результат - HTTP-статус)"""
+        message = {
+            'message_id': self._message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {
+                'id': chat_id, 'is_bot': False, 'first_name': f'Участник {chat_id}', 'username': f'user{chat_id}',
+            },
+        }
+        if text is not None:
+            message['text'] = text
+        if photo_id is not None:
+            message['photo'] = [{'file_id': photo_id, 'file_unique_id': photo_id[-16:], 'width': 800, 'height': 800}]
+        update = {'update_id': self._next_update_id, 'message': message}
+        self._next_update_id += 1
+        if self.webhook is not None:
+            task = asyncio.create_task(self._post_update(update))
+            self._posts.add(task)
+            task.add_done_callback(self._posts.discard)
+            return task
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def _post_update(self, update):
+        url, secret_token = self.webhook
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret_token} if secret_token else {}
+        try:
+            async with self._session.post(url, json=update, headers=headers) as response:
+                status = response.status
+        except aiohttp.ClientError:
+            status = 0
+        self.webhook_statuses[status] += 1
+        return status
+
+    async def wait_webhook(self, timeout):
+        """Ждет, пока сервер webhook начнет отвечать (setWebhook бот вызывает до запуска сервера)"""
+        health = self.webhook[0].rsplit('/', 1)[0] + '/health'
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                async with self._session.get(health):
+                    return
+            except aiohttp.ClientError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+    def next_message(self, chat_id):
+        """
+        Future следующей попытки sendMessage в чат (ответ бота пользователю).
+        Срабатывает и на попытку, получившую 429: бот ответил, ошибку видно в логе бота.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    def collect(self, predicate):
+        """Время первой доставки в каждый чат для сообщений, подходящих под predicate(method, text)"""
+        collector = Collector(predicate)
+        self._collectors.append(collector)
+        return collector
+
+    def _message_id(self):
+        self._next_message_id += 1
+        return self._next_message_id
+
+    # HTTP
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.requests[method] += 1
+        # cluster.py опрашивает getUpdates GET-запросом и вызывает setWebhook с телом JSON
+        body = await request.json() if request.content_type == 'application/json' else await request.post()
+        params = {**request.query, **body}
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(params))
+        if method == 'setWebhook':
+            self.webhook = (params['url'], params.get('secret_token'))
+            self.ready.set()
+            return self._ok(True)
+
+        await asyncio.sleep(self.latency * self._rng.uniform(0.5, 1.5))
+        if method == 'getMe':
+            return self._ok({'id': 123456, 'is_bot': True, 'first_name': 'Santa', 'username': 'santa_loadtest_bot'})
+        if method not in ('sendMessage', 'sendPhoto', 'editMessageText'):
+            return self._ok(True)
+
+        chat_id = int(params['chat_id'])
+        now = time.perf_counter()
+        if method == 'sendMessage':
+            waiters = self._waiters.get(chat_id)
+            # Ожидание могло быть отменено по таймауту шага (wait_for)
+            while waiters and waiters[0].done():
+                waiters.pop(0)
+            if waiters:
+                waiters.pop(0).set_result(now)
+        if method != 'editMessageText':
+            if chat_id in self.blocked:
+                return self._error(403, 'Forbidden: bot was blocked by the user')
+            if self._rng.random() < self.rate_limit_ratio:
+                self.rate_limited += 1
+                return self._error(429, 'Too Many Requests: retry after 1', {'retry_after': 1})
+
+        text = params.get('text') or params.get('caption') or ''
+        for collector in self._collectors:
+            collector.add(method, chat_id, text, time.perf_counter())
+        result = {
+            'message_id': int(params.get('message_id') or self._message_id()),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        }
+        return self._ok(result)
+
+    async def _get_updates(self, params):
+        self.ready.set()
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code, description, parameters=None):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        self._session = aiohttp.ClientSession()
+        return self._runner.addresses[0][1]
+
+    async def stop(self):
+        await self._session.close()
+        await self._runner.cleanup()
+
+
+class Collector:
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.times = {}  # chat_id -> время первой доставки
+        self._changed = asyncio.Event()
+
+    def add(self, method, chat_id, text, now):
+        if chat_id not in self.times and self.predicate(method, text):
+            self.times[chat_id] = now
+            self._changed.set()
+
+    async def wait(self, count, timeout):
+        deadline = time.perf_counter() + timeout
+        while len(self.times) < count:
+            self._changed.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def peak_rss_mb(pid):
+    """Пиковый RSS процесса (Linux, /proc); None, если недоступно"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def cpu_seconds(pid):
+    """Процессорное время процесса (user + system) по /proc; None, если недоступно"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def summarize(count, expected, started, finished, latencies, pid):
+    duration = finished - started
+    return {
+        'count': count,
+        'expected': expected,
+        'duration_s': round(duration, 3),
+        'throughput_per_s': round(count / duration, 1) if duration > 0 else None,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'peak_rss_mb': peak_rss_mb(pid),
+    }
+
+
+# Сценарии
+
+async def scenario_registration(api, bot_process, args, db_path):
+    """Все пользователи одновременно присылают /start; задержка - до ответа бота"""
+    users = range(1, args.users + 1)
+    started = time.perf_counter()
+    pushed = {}
+    waiters = []
+    for user_id in users:
+        waiters.append(api.next_message(user_id))
+        pushed[user_id] = time.perf_counter()
+        api.push(user_id, '/start')
+    await asyncio.wait(waiters, timeout=args.timeout)
+    latencies = [future.result() - pushed[user_id] for user_id, future in zip(users, waiters) if future.done()]
+    # Регистрация засчитывается, когда запись дошла до базы (групповой коммит)
+    registered, finished = await wait_for_participants(db_path, args.users, started + args.timeout)
+
+    # Часть пользователей блокирует бота после регистрации
+    rng = random.Random(args.seed)
+    api.blocked = {user_id for user_id in users if user_id != ADMIN_ID and rng.random() < args.blocked_ratio}
+    report = summarize(registered, args.users, started, finished, latencies, bot_process.pid)
+    if registered < args.users:
+        # Каждый /start должен дойти до базы: потерянная регистрация - ошибка бота, а не нагрузки
+        conn = sqlite3.connect(db_path)
+        try:
+            present = {row[0] for row in conn.execute('SELECT user_id FROM participants')}
+        finally:
+            conn.close()
+        report['missing_users'] = sorted(set(users) - present)[:20]
+        print(f"  ⚠️ Не зарегистрированы {args.users - registered} из {args.users}: "
+              f"{report['missing_users']}", flush=True)
+    return report
+
+
+async def scenario_menu(api, bot_process, args, db_path):
+    """Пользователи нажимают кнопки меню (помощь, участие): стоимость обработки одного апдейта"""
+    users = [user_id for user_id in range(1, args.users + 1) if user_id not in api.blocked]
+    started = time.perf_counter()
+    latencies = []
+
+    async def press(user_id, button):
+        reply = api.next_message(user_id)
+        pushed = time.perf_counter()
+        api.push(user_id, button)
+        latencies.append(await asyncio.wait_for(reply, args.step_timeout) - pushed)
+
+    for button in ('ℹ️ Помощь', '🎅 Стать участником'):
+        await asyncio.gather(*(press(user_id, button) for user_id in users), return_exceptions=True)
+    return summarize(len(latencies), 2 * len(users), started, time.perf_counter(), latencies, bot_process.pid)
+
+
+async def scenario_spam(api, bot_process, args, db_path):
+    """
+    Каждый пользователь быстро нажимает «Узнать своего получателя» spam_taps раз:
+    count - сколько ответов отправил бот (остальные нажатия отсек ThrottlingMiddleware)
+    """
+    users = [user_id for user_id in range(1, args.users + 1) if user_id not in api.blocked][:args.qr_users]
+    sent_before = api.requests['sendMessage']
+    started = time.perf_counter()
+    for _ in range(args.spam_taps):
+        for user_id in users:
+            api.push(user_id, '🎁 Узнать своего получателя')
+    # Ждем, пока бот перестанет отвечать
+    replies = -1
+    while api.requests['sendMessage'] != replies:
+        replies = api.requests['sendMessage']
+        await asyncio.sleep(1)
+    replies -= sent_before
+    report = summarize(replies, args.spam_taps * len(users), started, time.perf_counter(), [], bot_process.pid)
+    report['suppressed'] = report['expected'] - replies
+    return report
+
+
+async def wait_for_participants(db_path, count, deadline, settle=2.0):
+    """
+    Ждет count участников в базе; сдается, если число не растет settle секунд.
+    Возвращает (число участников, когда оно последний раз изменилось).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        registered, changed = -1, time.perf_counter()
+        while True:
+            current = conn.execute('SELECT COUNT(*) FROM participants WHERE is_active = 1').fetchone()[0]
+            now = time.perf_counter()
+            if current != registered:
+                registered, changed = current, now
+            if registered >= count or now > deadline or now - changed > settle:
+                return registered, changed
+            await asyncio.sleep(0.1)
+    finally:
+        conn.close()
+
+
+async def run_fanout(api, bot_process, args, prefix, trigger, db_path):
+    """Запускает рассылку trigger() и ждет, пока сообщения с prefix дойдут до всех незаблокированных"""
+    conn = sqlite3.connect(db_path)
+    user_ids = {row[0] for row in conn.execute('SELECT user_id FROM participants WHERE is_active = 1')}
+    conn.close()
+    expected = len(user_ids - api.blocked)
+    collector = api.collect(lambda method, text: method == 'sendMessage' and text.startswith(prefix))
+    started = time.perf_counter()
+    await trigger()
+    await collector.wait(expected, args.timeout)
+    latencies = [delivered - started for delivered in collector.times.values()]
+    return summarize(len(collector.times), expected, started, time.perf_counter(), latencies, bot_process.pid)
+
+
+async def scenario_draw(api, bot_process, args, db_path):
+    async def trigger():
+        api.push(ADMIN_ID, '🎲 Провести жеребьевку')
+    return await run_fanout(api, bot_process, args, '🎉 Жеребьевка проведена!', trigger, db_path)
+
+
+async def scenario_broadcast(api, bot_process, args, db_path):
+    async def trigger():
+        reply = api.next_message(ADMIN_ID)
+        api.push(ADMIN_ID, '📢 Сделать рассылку')
+        await asyncio.wait_for(reply, args.timeout)
+        api.push(ADMIN_ID, 'Нагрузочный тест')
+    return await run_fanout(api, bot_process, args, '📢 Сообщение от организатора', trigger, db_path)
+
+
+async def scenario_qr_handoff(api, bot_process, args, db_path):
+    """Санты проходят диалог: кнопка -> фото QR-кода -> адрес; задержка - весь диалог"""
+    santas = [user_id for user_id in range(2, args.users + 1) if user_id not in api.blocked][:args.qr_users]
+
+    async def handoff(santa_id):
+        began = time.perf_counter()
+        for step in (
+            {'text': '📦 Отправить QR-код и адрес выдачи'},
+            {'photo_id': f'AgACAgIAAxkBAAI{santa_id:012d}QRCodePhotoFileIdForLoadTest{santa_id:08d}'},
+            {'text': f'Москва, ПВЗ №{santa_id}, Пн-Пт 10:00-20:00'},
+        ):
+            reply = api.next_message(santa_id)
+            api.push(santa_id, **step)
+            # Ответ с 429 обрывает шаг диалога: такой санта застрянет, ждем его недолго
+            await asyncio.wait_for(reply, args.step_timeout)
+        return time.perf_counter() - began
+
+    # Фото получателям уходят из очереди передач (outbox.py) уже после ответа санте
+    photos = api.collect(lambda method, text: method == 'sendPhoto')
+    started = time.perf_counter()
+    results = await asyncio.gather(*(handoff(santa_id) for santa_id in santas), return_exceptions=True)
+    latencies = [result for result in results if not isinstance(result, BaseException)]
+    finished = time.perf_counter()
+    await photos.wait(len(latencies), args.timeout)
+    report = summarize(len(latencies), len(santas), started, finished, latencies, bot_process.pid)
+    report['gifts_delivered'] = len(photos.times)
+    return report
+
+
+async def scenario_reminders(api, bot_process, args, db_path):
+    """Напоминания по расписанию: все санты без подарка получают напоминание; задержка - до доставки"""
+    conn = sqlite3.connect(db_path)
+    user_ids = {row[0] for row in conn.execute('''
+        SELECT p.user_id FROM participants p
+        JOIN draw_results dr ON dr.event_id = p.event_id AND dr.santa_id = p.user_id
+        WHERE p.is_active = 1 AND p.gift_code IS NULL
+    ''')}
+    conn.close()
+    expected = len(user_ids - api.blocked)
+    collector = api.collect(
+        lambda method, text: method == 'sendMessage' and text.startswith('🔔 Напоминание от Тайного Санты')
+    )
+    started = time.perf_counter()
+    api.push(ADMIN_ID, '/remind gift 0.00001')
+    await collector.wait(expected, args.timeout)
+    latencies = [delivered - started for delivered in collector.times.values()]
+    return summarize(len(collector.times), expected, started, time.perf_counter(), latencies, bot_process.pid)
+
+
+async def scenario_webhook(api, bot_process, args, db_path):
+    """
+    Все пользователи одновременно нажимают «Помощь» через webhook.
+    throughput_per_s - принятые апдейты (HTTP 200) в секунду, задержка - до ответа бота пользователю.
+    """
+    users = [user_id for user_id in range(1, args.users + 1) if user_id not in api.blocked]
+    replies = [api.next_message(user_id) for user_id in users]
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(api.push(user_id, 'ℹ️ Помощь') for user_id in users))
+    accepted_at = time.perf_counter()
+    await asyncio.wait(replies, timeout=args.timeout)
+    latencies = [future.result() - started for future in replies if future.done()]
+    accepted = statuses.count(200)
+    report = summarize(accepted, len(users), started, accepted_at, latencies, bot_process.pid)
+    report['rejected'] = len(statuses) - accepted
+    report['replied'] = len(latencies)
+    return report
+
+
+SCENARIOS = {
+    'registration': scenario_registration,
+    'menu': scenario_menu,
+    'draw': scenario_draw,
+    'broadcast': scenario_broadcast,
+    'qr_handoff': scenario_qr_handoff,
+    'reminders': scenario_reminders,
+    'spam': scenario_spam,
+    'webhook': scenario_webhook,
+}
+
+
+async def fsm_benchmark(args):
+    """
+    Хранилища FSM без бота: каждый пользователь делает steps шагов диалога, как обработчик
+    QR-кода (get_state, get_data, set_data, set_state), все пользователи одновременно.
+    Для SQLiteStorage в замер входит итоговая запись в базу (close).
+    """
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from database import AsyncDatabase
+    from storage import SQLiteStorage
+
+    async def measure(storage):
+        latencies = []
+
+        async def dialog(user_id):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            for step in range(args.fsm_steps):
+                began = time.perf_counter()
+                await storage.get_state(None, key)
+                data = await storage.get_data(None, key)
+                data[f'step{step}'] = f'AgACAgIAAxkBAAI{user_id:012d}'
+                await storage.set_data(None, key, data)
+                await storage.set_state(None, key, f'Form:step{step}')
+                latencies.append(time.perf_counter() - began)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(dialog(user_id) for user_id in range(1, args.users + 1)))
+        await storage.close()
+        finished = time.perf_counter()
+        report = summarize(4 * len(latencies), 4 * args.users * args.fsm_steps, started, finished, latencies, os.getpid())
+        # Шаг в памяти занимает микросекунды: точность выше, чем у задержек сценариев
+        del report['latency_p50_ms'], report['latency_p99_ms']
+        report['step_p50_ms'] = round(percentile(latencies, 50) * 1000, 3)
+        report['step_p99_ms'] = round(percentile(latencies, 99) * 1000, 3)
+        return report
+
+    workdir = tempfile.mkdtemp(prefix='santa-loadtest-')
+    db = AsyncDatabase(os.path.join(workdir, 'santa.db'))
+    results = {}
+    try:
+        for name, storage in (('memory', MemoryStorage()), ('sqlite', SQLiteStorage(db))):
+            print(f"Хранилище FSM {name}...", flush=True)
+            results[name] = await measure(storage)
+            print(f"  {results[name]}", flush=True)
+    finally:
+        await db.close()
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'params': {'users': args.users, 'fsm_steps': args.fsm_steps},
+        'fsm': results,
+    }
+
+
+async def cluster_sweep(args):
+    """Прогоняет сценарии на cluster.py с каждым числом воркеров из --cluster-sweep"""
+    runs = {}
+    for workers in args.cluster_sweep:
+        print(f"Воркеров: {workers}", flush=True)
+        args.cluster = workers
+        runs[workers] = await run(args)
+    print("Апдейтов в секунду по числу воркеров:")
+    for name in args.scenarios:
+        line = ', '.join(
+            f"{workers}: {runs[workers]['scenarios'][name]['throughput_per_s']}"
+            for workers in args.cluster_sweep if name in runs[workers]['scenarios']
+        )
+        print(f"  {name:<14}{line}")
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'sweep': {
+            workers: {name: result['throughput_per_s'] for name, result in runs[workers]['scenarios'].items()}
+            for workers in args.cluster_sweep
+        },
+        'runs': runs,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency_ms / 1000, args.rate_limit_ratio, seed=args.seed)
+    port = await api.start()
+
+    workdir = tempfile.mkdtemp(prefix='santa-loadtest-')
+    db_path = os.path.join(workdir, 'santa.db')
+    env = {
+        **os.environ,
+        'BOT_TOKEN': TOKEN,
+        'ADMIN_ID': str(ADMIN_ID),
+        'DB_NAME': db_path,
+        'TELEGRAM_API_URL': f'http://127.0.0.1:{port}',
+        'TELEGRAM_RATE': str(args.telegram_rate),
+        'BOT_MODE': args.mode,
+        'METRICS_PORT': '0',
+        'FSM_STORAGE': 'sqlite',
+    }
+    if args.mode == 'webhook':
+        webhook_port = free_port()
+        env.update({
+            'WEBHOOK_BASE_URL': f'http://127.0.0.1:{webhook_port}',
+            'WEBHOOK_HOST': '127.0.0.1',
+            'WEBHOOK_PORT': str(webhook_port),
+            'WEBHOOK_SECRET': 'loadtest-secret',
+        })
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    command = [sys.executable, 'bot.py']
+    if args.cluster:
+        env['WORKERS'] = str(args.cluster)
+        command = [sys.executable, 'cluster.py']
+
+    log_path = os.path.join(workdir, 'bot.log')
+    with open(log_path, 'w') as log:
+        bot_process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    results = {}
+    try:
+        await asyncio.wait_for(api.ready.wait(), 60)
+        if api.webhook is not None:
+            await api.wait_webhook(60)
+        for name in args.scenarios:
+            print(f"Сценарий {name}...", flush=True)
+            cpu_before = cpu_seconds(bot_process.pid)
+            results[name] = await SCENARIOS[name](api, bot_process, args, db_path)
+            cpu_after = cpu_seconds(bot_process.pid)
+            # Процессорное время бота на один апдейт или одно отправленное сообщение
+            if cpu_before is not None and cpu_after is not None and results[name]['count']:
+                results[name]['cpu_s'] = round(cpu_after - cpu_before, 3)
+                results[name]['cpu_ms_per_item'] = round((cpu_after - cpu_before) * 1000 / results[name]['count'], 3)
+            print(f"  {results[name]}", flush=True)
+            await asyncio.sleep(args.pause)
+    finally:
+        bot_process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, bot_process.wait, 60)
+        except subprocess.TimeoutExpired:
+            bot_process.kill()
+        await api.stop()
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'scenarios': results,
+        'api': {
+            'requests': dict(api.requests), 'rate_limited': api.rate_limited, 'blocked_users': len(api.blocked),
+            'webhook_statuses': dict(api.webhook_statuses),
+        },
+        'bot_log': log_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота на фейковом Bot API")
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--qr-users', type=int, default=500, help="Сколько сант проходят отправку QR-кода")
+    parser.add_argument('--scenarios', default=None, type=lambda value: value.split(','),
+                        help="По умолчанию все (webhook - только с --mode webhook)")
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling', help="Как бот получает апдейты")
+    parser.add_argument('--fsm-bench', action='store_true', help="Только сравнить хранилища FSM, без бота")
+    parser.add_argument('--fsm-steps', type=int, default=3, help="Шагов диалога на пользователя в --fsm-bench")
+    parser.add_argument('--spam-taps', type=int, default=10, help="Нажатий подряд на пользователя в сценарии spam")
+    parser.add_argument('--latency-ms', type=float, default=30, help="Задержка ответа Bot API")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.01, help="Доля отправок с ответом 429")
+    parser.add_argument('--blocked-ratio', type=float, default=0.01, help="Доля пользователей, заблокировавших бота")
+    parser.add_argument('--telegram-rate', type=float, default=1000, help="TELEGRAM_RATE бота")
+    parser.add_argument('--cluster', type=int, default=0, help="Запустить cluster.py с этим числом воркеров")
+    parser.add_argument('--cluster-sweep', type=lambda value: [int(part) for part in value.split(',')],
+                        help="Числа воркеров через запятую: прогнать сценарии для каждого")
+    parser.add_argument('--env', action='append', default=[], help="Дополнительная настройка бота KEY=VALUE")
+    parser.add_argument('--timeout', type=float, default=600, help="Предел на один сценарий, секунд")
+    parser.add_argument('--step-timeout', type=float, default=10, help="Ожидание ответа на шаг диалога, секунд")
+    parser.add_argument('--pause', type=float, default=2, help="Пауза между сценариями, секунд")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='loadtest-results.json')
+    args = parser.parse_args()
+    if args.scenarios is None:
+        args.scenarios = [name for name in SCENARIOS if name != 'webhook' or args.mode == 'webhook']
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    if 'webhook' in args.scenarios and args.mode != 'webhook':
+        parser.error("Сценарий webhook требует --mode webhook")
+
+    if args.fsm_bench:
+        report = asyncio.run(fsm_benchmark(args))
+    elif args.cluster_sweep:
+        report = asyncio.run(cluster_sweep(args))
+    else:
+        report = asyncio.run(run(args))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
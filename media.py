@@ -0,0 +1,109 @@
+# media.py
+"""
+Проверка фото QR-кода до того, как оно уйдет получателю.
+
+Фото скачивается один раз в буфер ограниченного размера, QR-код распознается
+в отдельном процессе (пул процессов, цикл событий не блокируется), результат
+кэшируется по file_unique_id: повторная отправка того же фото не скачивается заново.
+Распознавание - опциональная зависимость (пакеты pyzbar и Pillow); без них фото
+принимается без проверки, как раньше.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from database import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Результат проверки фото
+QR_OK = 'ok'                  # QR-код распознан
+QR_UNREADABLE = 'unreadable'  # QR-кода на фото не нашли
+QR_TOO_LARGE = 'too_large'    # Фото больше max_bytes
+QR_UNCHECKED = 'unchecked'    # Распознавание недоступно (нет pyzbar/Pillow)
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class BoundedBuffer(io.BytesIO):
+    """Буфер для потокового скачивания: не дает файлу занять больше max_bytes памяти"""
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self._max_bytes = max_bytes
+
+    def write(self, data):
+        if self.tell() + len(data) > self._max_bytes:
+            raise MediaTooLarge(f"Файл больше {self._max_bytes} байт")
+        return super().write(data)
+
+
+def decoder_available():
+    try:
+        import PIL.Image  # noqa: F401
+        import pyzbar.pyzbar  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def decode_qr(data):
+    """Содержимое первого QR-кода на изображении или None. Выполняется в процессе пула"""
+    from PIL import Image
+    from pyzbar.pyzbar import ZBarSymbol, decode
+
+    image = Image.open(io.BytesIO(data)).convert('L')
+    symbols = decode(image, symbols=[ZBarSymbol.QRCODE])
+    return symbols[0].data.decode('utf-8', 'replace') if symbols else None
+
+
+class QRChecker:
+    """
+    Проверка фото QR-кода: check(bot, photo) -> (результат, содержимое).
+    Пул процессов создается при первом распознавании, а не при запуске бота.
+    """
+
+    def __init__(self, workers=2, max_bytes=10 * 1024 * 1024, cache_size=10_000):
+        self._workers = workers
+        self._max_bytes = max_bytes
+        self._payloads = LRUCache(cache_size)  # file_unique_id -> (результат, содержимое)
+        self._available = None
+        self._pool = None
+
+    async def check(self, bot, photo):
+        cached = self._payloads.get(photo.file_unique_id, None)
+        if cached is not None:
+            return cached
+        if self._available is None:
+            self._available = decoder_available()
+            if not self._available:
+                logger.warning("pyzbar/Pillow не установлены: QR-коды принимаются без проверки")
+        if not self._available:
+            return QR_UNCHECKED, None
+        if photo.file_size and photo.file_size > self._max_bytes:
+            return QR_TOO_LARGE, None
+
+        try:
+            buffer = await bot.download(photo, destination=BoundedBuffer(self._max_bytes))
+        except MediaTooLarge:
+            return QR_TOO_LARGE, None
+        if self._pool is None:
+            # spawn: процесс бота многопоточный (потоки базы), fork в нем небезопасен
+            self._pool = ProcessPoolExecutor(self._workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            payload = await asyncio.get_running_loop().run_in_executor(self._pool, decode_qr, buffer.getvalue())
+        except Exception as e:
+            # Сбой проверки - не вина пользователя: принимаем фото как без распознавания
+            logger.error(f"Не удалось распознать QR-код: {e}")
+            return QR_UNCHECKED, None
+        result = (QR_OK, payload) if payload else (QR_UNREADABLE, None)
+        self._payloads.put(photo.file_unique_id, result)
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+# metrics.py
+"""
+Метрики в текстовом формате Prometheus, без внешних зависимостей.
+Запись метрики - пара операций со словарем; текст собирается только при запросе /metrics.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        # Метрики пишутся и из потоков базы данных
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    async def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _labels_text(self.labels, key), value) for key, value in values]
+
+
+class Gauge(Counter):
+    """
+    Текущее значение. Если задан collector (корутина, возвращающая {значение метки: число}),
+    значения вычисляются в момент запроса /metrics.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.collector = None
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    async def samples(self):
+        if self.collector is not None:
+            values = await self.collector()
+            with self._lock:
+                self._values = {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+        return await super().samples()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # метки -> [счетчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    async def samples(self):
+        with self._lock:
+            values = [(key, list(row)) for key, row in self._values.items()]
+        samples = []
+        for key, row in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _labels_text(self.labels, key, [('le', bound)]), cumulative))
+            samples.append((f'{self.name}_bucket', _labels_text(self.labels, key, [('le', '+Inf')]), row[-1]))
+            samples.append((f'{self.name}_sum', _labels_text(self.labels, key), row[-2]))
+            samples.append((f'{self.name}_count', _labels_text(self.labels, key), row[-1]))
+        return samples
+
+
+# Метрики бота
+
+HANDLER_LATENCY = Histogram('santa_handler_seconds', 'Время работы обработчика', ('handler',))
+HANDLER_ERRORS = Counter('santa_handler_errors_total', 'Обработчики, завершившиеся исключением', ('handler',))
+DB_LATENCY = Histogram('santa_db_query_seconds', 'Время выполнения метода Database', ('method',))
+TELEGRAM_SENDS = Counter('santa_telegram_sends_total', 'Отправки через Sender по результату', ('result',))
+TELEGRAM_RETRIES = Counter('santa_telegram_retries_total', 'Повторы отправки после 429 (RetryAfter)')
+SUPPRESSED_UPDATES = Counter('santa_updates_suppressed_total', 'Апдейты, отброшенные ThrottlingMiddleware', ('reason',))
+FSM_STATES = Gauge('santa_fsm_states', 'Пользователи в каждом состоянии FSM', ('state',))
+
+
+async def render():
+    lines = []
+    for metric in REGISTRY:
+        samples = await metric.samples()
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+async def start_metrics_server(host, port):
+    """Отдельный HTTP-сервер с /metrics; возвращает runner для остановки (runner.cleanup())"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(
+            body=(await render()).encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,142 @@
+# middlewares.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY, SUPPRESSED_UPDATES
+
+logger = logging.getLogger(__name__)
+
+
+class InflightMiddleware(BaseMiddleware):
+    """
+    Считает апдейты, которые сейчас обрабатываются.
+    При остановке бота drain() дожидается их завершения, прежде чем закрыть базу.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def drain(self, timeout):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Остановка: {self.count} апдейтов не успели обработаться за {timeout} с")
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время работы обработчиков по имени функции (process_pickup_address, perform_draw, ...).
+    Подключается как внутренний middleware: к этому моменту обработчик уже выбран фильтрами.
+    Для кнопок меню (bot.dispatch_button) учитывается обработчик кнопки из data['button'].
+    """
+
+    async def __call__(self, handler, event, data):
+        name = (data.get('button') or data['handler'].callback).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Защита обработчиков от частых нажатий, подключается внешним middleware на message и callback_query:
+    - у каждого пользователя корзина токенов (burst штук, пополняется со скоростью rate в секунду),
+      апдейты сверх нее отбрасываются;
+    - одинаковый апдейт (тот же текст или callback_data), пока первый еще обрабатывается,
+      не запускает обработчик второй раз, а дожидается результата первого;
+    - callback_query с уже виденным id (повторная доставка) пропускается.
+    Память ограничена: корзины и id колбэков хранятся в LRU на max_users / max_callbacks записей,
+    забытая корзина просто начинается заново полной. В cluster.py апдейты пользователя
+    всегда попадают в один процесс, поэтому состояние может быть локальным.
+    """
+
+    def __init__(self, rate=1.0, burst=5, max_users=100_000, max_callbacks=10_000):
+        self._rate = rate
+        self._burst = burst
+        self._max_users = max_users
+        self._max_callbacks = max_callbacks
+        self._buckets = OrderedDict()  # user_id -> (токены, время последнего пополнения)
+        self._callbacks = OrderedDict()  # id обработанных callback_query
+        self._inflight = {}  # (user_id, тип, текст) -> Future с результатом обработчика
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+        is_callback = isinstance(event, CallbackQuery)
+
+        if is_callback:
+            if event.id in self._callbacks:
+                SUPPRESSED_UPDATES.inc('duplicate')
+                return None
+            self._remember_callback(event.id)
+
+        if not self._take_token(user.id):
+            SUPPRESSED_UPDATES.inc('throttled')
+            if is_callback:
+                # Иначе у пользователя будут "часики" на кнопке
+                await event.answer()
+            return None
+
+        payload = event.data if is_callback else event.text
+        if payload is None:
+            return await handler(event, data)
+        key = (user.id, is_callback, payload)
+        first = self._inflight.get(key)
+        if first is not None:
+            SUPPRESSED_UPDATES.inc('coalesced')
+            if is_callback:
+                await event.answer()
+            return await asyncio.shield(first)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await handler(event, data)
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку получат дождавшиеся дубликаты; если их нет, она не должна попасть в лог asyncio
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def _take_token(self, user_id):
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(user_id, (self._burst, now))
+        tokens = min(self._burst, tokens + (now - updated) * self._rate)
+        allowed = tokens >= 1
+        self._buckets[user_id] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > self._max_users:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def _remember_callback(self, callback_id):
+        self._callbacks[callback_id] = None
+        if len(self._callbacks) > self._max_callbacks:
+            self._callbacks.popitem(last=False)
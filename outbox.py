@@ -0,0 +1,109 @@
+# outbox.py
+import asyncio
+import logging
+import random
+import time
+
+from broadcast import SENT, BLOCKED
+
+logger = logging.getLogger(__name__)
+
+
+def gift_text(santa_name, santa_username, pickup_address, qr_payload=None):
+    """Подпись к фото QR-кода для получателя подарка; qr_payload - распознанный код, если есть"""
+    return (
+        "🎁 **ВАШ ПОДАРОК ГОТОВ К ПОЛУЧЕНИЮ!**\n\n"
+        f"🎅 **От Тайного Санты:** {santa_name}\n"
+        f"📱 @{santa_username if santa_username else 'без username'}\n\n"
+        "📍 **АДРЕС ПУНКТА ВЫДАЧИ:**\n"
+        f"{pickup_address}\n\n"
+        "📷 **QR-код прикреплен выше**\n"
+        "Покажите его на кассе для получения посылки.\n"
+        + (f"Код в QR: `{qr_payload}`\n" if qr_payload else "")
+        + "\n⏰ **Не забудьте взять с собой паспорт!**"
+    )
+
+
+class GiftOutbox:
+    """
+    Фоновая доставка передач подарков из таблицы gift_handoffs.
+    Обработчик только записывает передачу в базу и сразу отвечает санте;
+    воркер забирает готовые передачи пачками и отправляет их через общий Sender.
+    Неудачная попытка откладывается с экспоненциальной задержкой, после max_attempts
+    (или если получатель заблокировал бота) передача помечается 'dead' и санте приходит сообщение.
+    Доставка "хотя бы один раз": при падении между отправкой и отметкой фото уйдет повторно.
+    """
+
+    def __init__(self, bot, db, sender, batch_size=50, poll_interval=1.0,
+                 max_attempts=8, base_delay=2.0, max_delay=600.0, lease=60.0):
+        self._bot = bot
+        self._db = db
+        self._sender = sender
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._lease = lease
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает воркер; взятые, но не доставленные передачи вернутся в очередь по истечении lease"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def wake(self):
+        """Новая передача в очереди: не ждать следующего опроса базы"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                handoffs = await self._db.claim_gift_handoffs(time.time(), self._batch_size, self._lease)
+            except Exception as e:
+                logger.error(f"Не удалось получить передачи подарков: {e}")
+                handoffs = []
+            if handoffs:
+                results = await asyncio.gather(*(self._deliver(handoff) for handoff in handoffs), return_exceptions=True)
+                for handoff, result in zip(handoffs, results):
+                    if isinstance(result, Exception):
+                        # Передача вернется в очередь по истечении lease
+                        logger.error(f"Ошибка доставки передачи подарка #{handoff['id']}: {result}")
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, handoff):
+        recipient_id = handoff['recipient_id']
+        caption = gift_text(handoff['full_name'], handoff['username'], handoff['pickup_address'], handoff['qr_payload'])
+        result = await self._sender.deliver(
+            recipient_id,
+            lambda: self._bot.send_photo(chat_id=recipient_id, photo=handoff['qr_file_id'], caption=caption),
+        )
+        attempts = handoff['attempts'] + 1
+        if result == SENT:
+            await self._db.finish_gift_handoff(handoff['id'], 'sent')
+        elif result == BLOCKED or attempts >= self._max_attempts:
+            logger.warning(f"Передача подарка #{handoff['id']} не доставлена: {result}, попыток {attempts}")
+            await self._db.finish_gift_handoff(handoff['id'], 'dead', result)
+            await self._notify_santa(handoff, result)
+        else:
+            # Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли волной
+            delay = min(self._max_delay, self._base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+            await self._db.retry_gift_handoff(handoff['id'], time.time() + delay, result)
+
+    async def _notify_santa(self, handoff, result):
+        reason = "получатель заблокировал бота" if result == BLOCKED else "Telegram не принимает сообщение"
+        await self._sender.deliver(handoff['santa_id'], lambda: self._bot.send_message(
+            handoff['santa_id'],
+            "❌ Не удалось передать QR-код и адрес выдачи получателю "
+            f"({reason}).\nСвяжитесь с организатором игры."
+        ))
@@ -0,0 +1,97 @@
+# reminders.py
+import asyncio
+import logging
+import time
+
+from broadcast import SENT
+
+logger = logging.getLogger(__name__)
+
+# Вид напоминания -> текст участнику
+REMINDER_TEXTS = {
+    'no_address': (
+        "🔔 Напоминание от Тайного Санты\n\n"
+        "Вы еще не указали адрес доставки - вашему Санте некуда отправить подарок.\n"
+        "Нажмите «📦 Указать адрес доставки»."
+    ),
+    'no_gift': (
+        "🔔 Напоминание от Тайного Санты\n\n"
+        "Ваш получатель ждет подарок! Когда отправите его, нажмите "
+        "«📦 Отправить QR-код и адрес выдачи»."
+    ),
+}
+
+
+class ReminderScheduler:
+    """
+    Напоминания по расписанию из таблицы reminder_jobs.
+    Каждое задание проходит по своим адресатам пачками по user_id: один тик - одна пачка,
+    позиция сохраняется в базе, поэтому после перезапуска проход продолжается с того же места.
+    Адресаты выбираются по частичным индексам (см. Database.REMINDER_TARGETS) - тем, кто уже
+    указал адрес или отправил подарок, ничего не приходит, и их строки не читаются.
+    Тем, кому напоминали меньше cooldown секунд назад, напоминание не отправляется.
+    Сообщения уходят через общий Sender - с его лимитами на бота и на чат.
+    """
+
+    def __init__(self, bot, db, sender, chunk_size=200, poll_interval=60.0):
+        self._bot = bot
+        self._db = db
+        self._sender = sender
+        self._chunk_size = chunk_size
+        self._poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает планировщик; прерванный проход продолжится после запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def wake(self):
+        """Задание добавлено или изменено: не ждать следующего опроса базы"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                jobs = await self._db.get_due_reminder_jobs(time.time())
+            except Exception as e:
+                logger.error(f"Не удалось получить задания напоминаний: {e}")
+                jobs = []
+            progressed = False
+            for job in jobs:
+                try:
+                    await self._tick(job)
+                    progressed = True
+                except Exception as e:
+                    logger.error(f"Ошибка напоминания #{job['id']}: {e}")
+            # Сразу дальше - только если проходы продвинулись; после ошибок (например, база
+            # заблокирована) ждем poll_interval, а не повторяем в цикле без паузы
+            if progressed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self, job):
+        """Одна пачка задания: отправка и сохранение позиции"""
+        now = time.time()
+        user_ids = await self._db.get_reminder_targets(job, now, self._chunk_size)
+        text = REMINDER_TEXTS[job['kind']]
+        results = await asyncio.gather(*(
+            self._sender.deliver(user_id, lambda user_id=user_id: self._bot.send_message(user_id, text))
+            for user_id in user_ids
+        ))
+        reminded = [user_id for user_id, result in zip(user_ids, results) if result == SENT]
+        finished = len(user_ids) < self._chunk_size
+        await self._db.advance_reminder_job(
+            job, user_ids[-1] if user_ids else 0, reminded, len(user_ids) - len(reminded), now, finished
+        )
+        if finished:
+            logger.info(f"Напоминание #{job['id']} ({job['kind']}): проход завершен")
@@ -0,0 +1,10 @@
+# states.py
+from aiogram.fsm.state import State, StatesGroup
+
+
+# Состояния FSM
+class Form(StatesGroup):
+    waiting_for_address = State()
+    waiting_for_qr_photo = State()       # Для фото QR-кода
+    waiting_for_pickup_address = State()  # Для адреса пункта выдачи
+    admin_message = State()
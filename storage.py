@@ -0,0 +1,131 @@
+# storage.py
+import asyncio
+import dataclasses
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from database import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в базе бота: состояние и данные (например, qr_photo_id)
+    переживают перезапуск и доступны всем процессам, работающим с одной базой.
+
+    Горячие записи лежат в LRU-кэше, изменения копятся и сбрасываются в базу
+    одной транзакцией раз в flush_interval секунд. Брошенные состояния старше ttl
+    считаются пустыми и периодически удаляются. После close() (aiogram вызывает его
+    до on_shutdown, пока обработчики еще дорабатывают) изменения пишутся в базу сразу.
+    """
+
+    def __init__(self, db, ttl=7 * 24 * 3600, flush_interval=1.0, hot_size=10_000):
+        self._db = db
+        self._ttl = ttl
+        self._flush_interval = flush_interval
+        self._hot = LRUCache(hot_size)  # ключ -> (state, data, updated_at)
+        self._dirty = {}  # ключ -> (state, data, updated_at), еще не записанные в базу
+        self._flusher = None
+        self._closed = False
+        self._last_cleanup = 0.0
+
+    @staticmethod
+    def _key(key):
+        return ':'.join(str(part) for part in dataclasses.astuple(key))
+
+    async def _load(self, key):
+        record = self._dirty.get(key)
+        if record is None:
+            record = self._hot.get(key, None)
+        if record is None:
+            version = self._hot.version
+            row = await self._db.get_fsm_record(key)
+            # Пока шел запрос, _store мог записать новее: прочитанное из базы его не затирает
+            record = self._dirty.get(key) or self._hot.get(key, None)
+            if record is None:
+                record = (row[0], json.loads(row[1]) if row[1] else {}, row[2]) if row else (None, {}, 0.0)
+                self._hot.put(key, record, version)
+        state, data, updated_at = record
+        if updated_at and time.time() - updated_at > self._ttl:
+            return None, {}
+        return state, data
+
+    async def _store(self, key, state, data):
+        record = (state, data, time.time())
+        self._hot.put(key, record)
+        self._dirty[key] = record
+        if self._closed:
+            await self.flush()
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if self._dirty:
+            dirty, self._dirty = self._dirty, {}
+            records = [
+                (key, state, json.dumps(data, ensure_ascii=False) if data else None, updated_at)
+                for key, (state, data, updated_at) in dirty.items()
+            ]
+            try:
+                await self._db.save_fsm_records(records)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояния FSM: {e}")
+                # Не теряем изменения: более свежие записи за это время остаются приоритетными
+                self._dirty = {**dirty, **self._dirty}
+                return
+
+        now = time.time()
+        if now - self._last_cleanup > self._ttl / 10:
+            self._last_cleanup = now
+            await self._db.delete_expired_fsm_records(now - self._ttl)
+
+    async def set_state(self, bot, key, state=None):
+        key = self._key(key)
+        _, data = await self._load(key)
+        await self._store(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, bot, key):
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, bot, key, data):
+        key = self._key(key)
+        state, _ = await self._load(key)
+        await self._store(key, state, data.copy())
+
+    async def get_data(self, bot, key):
+        _, data = await self._load(self._key(key))
+        return data.copy()
+
+    async def count_states(self):
+        """Число пользователей в каждом состоянии (для метрик)"""
+        await self.flush()
+        return await self._db.count_fsm_states(time.time() - self._ttl)
+
+    async def close(self):
+        self._closed = True
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        await self.flush()
+
+
+def create_storage(kind, db=None, redis_url=None, ttl=7 * 24 * 3600):
+    """Хранилище FSM по настройке FSM_STORAGE: memory, sqlite или redis"""
+    if kind == 'sqlite':
+        return SQLiteStorage(db, ttl=ttl)
+    if kind == 'redis':
+        # Опциональная зависимость: нужен пакет redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(redis_url, state_ttl=ttl, data_ttl=ttl)
+    from aiogram.fsm.storage.memory import MemoryStorage
+    return MemoryStorage()
@@ -0,0 +1,419 @@
+# texts.py
+"""
+Подписи кнопок и тексты ответов бота по языкам.
+Язык - language_code пользователя; чего нет в переводе, берется из DEFAULT_LOCALE.
+"""
+
+DEFAULT_LOCALE = 'ru'
+
+# Кнопки: действие -> подпись
+BUTTONS = {
+    'ru': {
+        'join': "🎅 Стать участником",
+        'set_address': "📦 Указать адрес доставки",
+        'my_recipient': "🎁 Узнать своего получателя",
+        'send_qr': "📦 Отправить QR-код и адрес выдачи",
+        'help': "ℹ️ Помощь",
+        'participants': "👥 Список участников",
+        'draw': "🎲 Провести жеребьевку",
+        'resend': "📨 Дослать уведомления",
+        'broadcast': "📢 Сделать рассылку",
+        'back': "◀️ Назад",
+        'cancel': "❌ Отмена",
+        'confirm': "✅ Да, я участвую!",
+        'main_placeholder': "Выберите действие...",
+        'admin_placeholder': "Панель управления...",
+    },
+    'en': {
+        'join': "🎅 Join the game",
+        'set_address': "📦 Set delivery address",
+        'my_recipient': "🎁 Who is my recipient",
+        'send_qr': "📦 Send QR code and pickup address",
+        'help': "ℹ️ Help",
+        'participants': "👥 Participants",
+        'draw': "🎲 Run the draw",
+        'resend': "📨 Resend notifications",
+        'broadcast': "📢 Broadcast",
+        'back': "◀️ Back",
+        'cancel': "❌ Cancel",
+        'confirm': "✅ Yes, count me in!",
+        'main_placeholder': "Choose an action...",
+        'admin_placeholder': "Control panel...",
+    },
+}
+
+TEXTS = {
+    'ru': {
+        'start': (
+            "🎅 Добро пожаловать в Тайного Санту! 🎄\n"
+            "Игра: «{title}»\n\n"
+            "Я помогу организовать обмен подарками. Вот что вы можете сделать:\n\n"
+            "🎅 Стать участником - зарегистрироваться в игре\n"
+            "📦 Указать адрес доставки - куда отправить вам подарок\n"
+            "🎁 Узнать своего получателя - после жеребьевки\n"
+            "📦 Отправить QR-код и адрес выдачи - чтобы получатель мог забрать подарок\n\n"
+            "Для администрирования используйте /admin"
+        ),
+        'help': (
+            "🎅 **Помощь по Тайному Санте** 🎄\n\n"
+            "**Как это работает:**\n"
+            "1. 🎅 **Стать участником** - регистрация в игре\n"
+            "2. 📦 **Указать адрес доставки** - куда вам отправят подарок\n"
+            "3. 🎁 **Узнать своего получателя** - после жеребьевки\n"
+            "4. 📦 **Отправить QR-код и адрес выдачи** - когда отправили подарок\n\n"
+            "**Про отправку QR-кода:**\n"
+            "• Сфотографируйте QR-код из приложения доставки\n"
+            "• Отправьте фото боту\n"
+            "• Введите адрес пункта выдачи\n"
+            "• Получатель получит всё для получения подарка!\n\n"
+            "**Ваш Санта также отправит вам QR-код для получения!**\n\n"
+            "Вопросы? Обращайтесь к организатору."
+        ),
+        'already_joined': (
+            "✅ Вы уже зарегистрированы как участник!\n"
+            "Ваше имя: {name}\n"
+            "Не забудьте указать адрес доставки!"
+        ),
+        'join_rules': (
+            "🎅 Отлично! Вы хотите стать участником Тайного Санты?\n\n"
+            "Правила:\n"
+            "1. Вы получите имя другого участника\n"
+            "2. Пришлете ему подарок\n"
+            "3. Получите подарок от своего Тайного Санты\n\n"
+            "Подтвердите участие:"
+        ),
+        'address_prompt': (
+            "📝 Пожалуйста, введите ваш адрес доставки в формате:\n"
+            "Город, улица, дом, квартира, индекс\n\n"
+            "Пример: Москва, ул. Пушкина, д. 10, кв. 5, 123456"
+        ),
+        'qr_prompt': (
+            "📦 **Отправка данных для получения подарка**\n\n"
+            "1️⃣ **Сначала отправьте фото QR-кода**\n"
+            "(сфотографируйте или загрузите готовое изображение)\n\n"
+            "2️⃣ **Затем введите адрес пункта выдачи**\n"
+            "Формат: Город, адрес пункта, время работы\n\n"
+            "Пример QR-кода от СДЭК/Boxberry/Почты России:"
+        ),
+        'qr_accepted': (
+            "✅ **QR-код принят!**\n\n"
+            "Теперь введите адрес пункта выдачи:\n\n"
+            "**Формат:**\n"
+            "• Город\n"
+            "• Адрес пункта\n"
+            "• Время работы\n"
+            "• Дополнительная информация (если нужно)\n\n"
+            "Пример:\n"
+            "Москва, ул. Тверская, д. 10, ПВЗ СДЭК\n"
+            "Пн-Пт: 10:00-20:00, Сб: 11:00-18:00\n"
+            "Код для получения: 123-456"
+        ),
+        # Ответы участникам (bot.py)
+        'event_not_found': "❌ Игра по этой ссылке не найдена. Уточните приглашение у организатора.",
+        'joined': (
+            "🎉 Поздравляем! Вы стали участником Тайного Санты!\n\n"
+            "Теперь укажите адрес доставки, куда ваш Санта сможет отправить подарок."
+        ),
+        'address_cancelled': "❌ Ввод адреса отменен.",
+        'address_saved': (
+            "✅ Адрес успешно сохранен!\n"
+            "Теперь ваш Тайный Санта знает, куда отправить подарок."
+        ),
+        'draw_not_done': "Жеребьевка еще не проведена! Ожидайте начала.",
+        'not_in_draw': "Вы не участвуете в текущей жеребьевке.",
+        'recipient': "🎅 Ваш получатель: {name}\n👤 Username: @{username}\n",
+        'username_unknown': "не указан",
+        'recipient_address': "📦 Адрес доставки: {address}",
+        'recipient_no_address': "📦 Адрес еще не указан. Напомните получателю указать адрес!",
+        'qr_unreadable': (
+            "❌ Не удалось прочитать QR-код на фото.\n"
+            "Сфотографируйте его крупнее и без бликов и отправьте еще раз."
+        ),
+        'qr_too_large': "❌ Фото слишком большое. Отправьте его как фото, а не как файл.",
+        'qr_cancelled': "❌ Отправка QR-кода отменена.",
+        'qr_wrong_format': (
+            "❌ Пожалуйста, отправьте именно **фото QR-кода**.\n"
+            "Нажмите на скрепку 📎 и выберите фото из галереи."
+        ),
+        'handoff_cancelled': "❌ Отправка данных отменена.",
+        'qr_missing': "❌ Ошибка: QR-код не найден. Начните заново.",
+        'handoff_accepted': (
+            "✅ **Отлично! Данные приняты и отправляются получателю!**\n\n"
+            "Ваш получатель получит:\n"
+            "• Фото QR-кода\n"
+            "• Адрес пункта выдачи\n"
+            "• Инструкции по получению\n\n"
+            "Если доставить не получится, я сообщу.\n"
+            "Теперь осталось только ждать, когда он заберет подарок! 🎄"
+        ),
+        'recipient_not_found': "❌ Получатель не найден. Проверьте, проведена ли жеребьевка.",
+        'cancelled': "❌ Действие отменено.",
+        # Ответы организатору (admin.py)
+        'newevent_usage': "Использование: /newevent <название игры>",
+        'event_created': (
+            "🎄 Игра «{title}» создана!\n\n"
+            "Отправьте участникам ссылку-приглашение:\n"
+            "{link}\n\n"
+            "Вы - организатор этой игры, панель управления: /admin"
+        ),
+        'not_admin': "У вас нет прав администратора!",
+        'admin_panel': "Панель администратора игры «{title}»:",
+        'exclude_usage': "Использование: /exclude <user_id> <user_id>",
+        'exclusion_added': "✅ Эти участники не попадут друг к другу при жеребьевке.",
+        'user_id_usage': "Использование: {command} <user_id>",
+        'late_joined': "✅ Участник добавлен в жеребьевку.",
+        'dropped_out': "✅ Участник исключен из жеребьевки.",
+        'draw_changed': "{done}\nНовые пары получили участников: {count}",
+        'qr_not_sent': "❌ Этот участник еще не отправлял QR-код.",
+        'qr_caption': "QR-код от {name}",
+        'qr_caption_code': "\nКод: {code}",
+        'participants_header': (
+            "📋 Список участников:\n"
+            "Всего: {total} • С адресом: {with_address} • Отправили подарок: {with_gift}\n"
+            "Фильтр: {filter}\n\n"
+        ),
+        'participant_line': "{name} (@{username}) - Адрес: {address} Подарок: {gift}",
+        'nobody_found': "Никого не найдено.",
+        'no_participants': "Участников пока нет.",
+        'filter_all': "Все",
+        'filter_no_address': "Без адреса",
+        'filter_no_gift': "Без подарка",
+        'export_csv': "📄 Выгрузить CSV",
+        'preparing_file': "Готовим файл...",
+        'participants_caption': "📄 Участники Тайного Санты",
+        'import_usage': (
+            "Отправьте файл .csv или .jsonl с подписью /import.\n"
+            "Колонки: user_id, username, full_name, address"
+        ),
+        'import_done': "✅ Загружено участников: {imported}\nПропущено строк: {skipped}",
+        'draw_not_done_admin': "Жеребьевка еще не проведена.",
+        'draw_export_caption': "📄 Результаты жеребьевки: {count} пар",
+        'draw_need_two': "❌ Для жеребьевки нужно минимум 2 участника!",
+        'draw_done': "✅ Жеребьевка успешно проведена для {count} участников!",
+        'draw_failed': (
+            "❌ Ошибка при проведении жеребьевки!\n"
+            "Возможно, исключения (/exclude) не оставляют допустимых пар."
+        ),
+        'draw_restored': "↩️ Восстановлены пары прошлой жеребьевки: {count}",
+        'all_notified': "✅ Все участники уже получили результаты жеребьевки.",
+        'reminder_usage': (
+            "Использование:\n"
+            "/remind address [каждые N часов] - напоминать указать адрес\n"
+            "/remind gift <дней после жеребьевки> [каждые N часов] - напоминать отправить подарок\n"
+            "/remind stop - выключить напоминания"
+        ),
+        'reminder_no_address': "адрес доставки",
+        'reminder_no_gift': "отправка подарка",
+        'reminders_list': "🔔 Напоминания:\n",
+        'reminder_line': "• {title}: каждые {hours:g} ч, {status}, отправлено {sent}",
+        'reminder_active': "включено",
+        'reminder_stopped': "выключено",
+        'reminders_stopped': "🔕 Напоминания выключены: {count}",
+        'reminder_bad_numbers': "❌ Число дней и часов должно быть больше нуля.",
+        'reminder_enabled': "🔔 Напоминание «{title}» включено: каждые {hours:g} ч",
+        'reminder_delay': ", через {days:g} дн. после жеребьевки",
+        'broadcast_prompt': "Введите сообщение для рассылки всем участникам:",
+        'broadcast_text_only': "❌ Рассылать можно только текст. Отправьте сообщение текстом или нажмите «Отмена».",
+        'broadcast_queued': "📢 Рассылка поставлена в очередь. Прогресс будет обновляться ниже.",
+    },
+    'en': {
+        'start': (
+            "🎅 Welcome to Secret Santa! 🎄\n"
+            "Game: «{title}»\n\n"
+            "I will help you organise a gift exchange. Here is what you can do:\n\n"
+            "🎅 Join the game - register as a participant\n"
+            "📦 Set delivery address - where to send your gift\n"
+            "🎁 Who is my recipient - after the draw\n"
+            "📦 Send QR code and pickup address - so your recipient can collect the gift\n\n"
+            "Organisers: use /admin"
+        ),
+        'help': (
+            "🎅 **Secret Santa help** 🎄\n\n"
+            "**How it works:**\n"
+            "1. 🎅 **Join the game** - register as a participant\n"
+            "2. 📦 **Set delivery address** - where your gift will be sent\n"
+            "3. 🎁 **Who is my recipient** - after the draw\n"
+            "4. 📦 **Send QR code and pickup address** - once you have sent the gift\n\n"
+            "**Sending the QR code:**\n"
+            "• Take a photo of the QR code from the delivery app\n"
+            "• Send the photo to the bot\n"
+            "• Enter the pickup point address\n"
+            "• Your recipient gets everything needed to collect the gift!\n\n"
+            "**Your Santa will send you a QR code as well!**\n\n"
+            "Questions? Ask the organiser."
+        ),
+        'already_joined': (
+            "✅ You are already registered!\n"
+            "Your name: {name}\n"
+            "Don't forget to set your delivery address!"
+        ),
+        'join_rules': (
+            "🎅 Great! Do you want to join Secret Santa?\n\n"
+            "Rules:\n"
+            "1. You get the name of another participant\n"
+            "2. You send them a gift\n"
+            "3. You receive a gift from your Secret Santa\n\n"
+            "Confirm to join:"
+        ),
+        'address_prompt': (
+            "📝 Please enter your delivery address as:\n"
+            "City, street, house, apartment, postcode\n\n"
+            "Example: London, 10 Baker Street, flat 5, NW1 6XE"
+        ),
+        'qr_prompt': (
+            "📦 **Sending the gift pickup details**\n\n"
+            "1️⃣ **First send a photo of the QR code**\n"
+            "(take a picture or upload a ready image)\n\n"
+            "2️⃣ **Then enter the pickup point address**\n"
+            "Format: city, pickup point address, opening hours\n\n"
+            "QR code from the delivery service app:"
+        ),
+        'qr_accepted': (
+            "✅ **QR code accepted!**\n\n"
+            "Now enter the pickup point address:\n\n"
+            "**Format:**\n"
+            "• City\n"
+            "• Pickup point address\n"
+            "• Opening hours\n"
+            "• Anything else (if needed)\n\n"
+            "Example:\n"
+            "London, 10 Baker Street, parcel locker\n"
+            "Mon-Fri: 10:00-20:00, Sat: 11:00-18:00\n"
+            "Pickup code: 123-456"
+        ),
+        # Replies to participants (bot.py)
+        'event_not_found': "❌ No game found for this link. Check the invitation with the organiser.",
+        'joined': (
+            "🎉 Congratulations! You have joined Secret Santa!\n\n"
+            "Now set your delivery address so your Santa knows where to send the gift."
+        ),
+        'address_cancelled': "❌ Address entry cancelled.",
+        'address_saved': (
+            "✅ Address saved!\n"
+            "Your Secret Santa now knows where to send the gift."
+        ),
+        'draw_not_done': "The draw has not taken place yet! Please wait.",
+        'not_in_draw': "You are not part of the current draw.",
+        'recipient': "🎅 Your recipient: {name}\n👤 Username: @{username}\n",
+        'username_unknown': "not set",
+        'recipient_address': "📦 Delivery address: {address}",
+        'recipient_no_address': "📦 No address yet. Remind your recipient to set one!",
+        'qr_unreadable': (
+            "❌ Could not read the QR code in the photo.\n"
+            "Take a closer photo without glare and send it again."
+        ),
+        'qr_too_large': "❌ The photo is too large. Send it as a photo, not as a file.",
+        'qr_cancelled': "❌ QR code sending cancelled.",
+        'qr_wrong_format': (
+            "❌ Please send a **photo of the QR code**.\n"
+            "Tap the paperclip 📎 and choose a photo from the gallery."
+        ),
+        'handoff_cancelled': "❌ Sending cancelled.",
+        'qr_missing': "❌ Error: QR code not found. Please start again.",
+        'handoff_accepted': (
+            "✅ **Great! The details are accepted and are being sent to your recipient!**\n\n"
+            "Your recipient will get:\n"
+            "• The QR code photo\n"
+            "• The pickup point address\n"
+            "• Pickup instructions\n\n"
+            "If delivery fails, I will let you know.\n"
+            "Now just wait for them to collect the gift! 🎄"
+        ),
+        'recipient_not_found': "❌ Recipient not found. Check whether the draw has taken place.",
+        'cancelled': "❌ Action cancelled.",
+        # Replies to organisers (admin.py)
+        'newevent_usage': "Usage: /newevent <game title>",
+        'event_created': (
+            "🎄 Game «{title}» created!\n\n"
+            "Send participants the invitation link:\n"
+            "{link}\n\n"
+            "You are the organiser of this game, control panel: /admin"
+        ),
+        'not_admin': "You are not an administrator!",
+        'admin_panel': "Admin panel of the game «{title}»:",
+        'exclude_usage': "Usage: /exclude <user_id> <user_id>",
+        'exclusion_added': "✅ These participants will not be drawn for each other.",
+        'user_id_usage': "Usage: {command} <user_id>",
+        'late_joined': "✅ Participant added to the draw.",
+        'dropped_out': "✅ Participant removed from the draw.",
+        'draw_changed': "{done}\nParticipants with new pairs: {count}",
+        'qr_not_sent': "❌ This participant has not sent a QR code yet.",
+        'qr_caption': "QR code from {name}",
+        'qr_caption_code': "\nCode: {code}",
+        'participants_header': (
+            "📋 Participants:\n"
+            "Total: {total} • With address: {with_address} • Gift sent: {with_gift}\n"
+            "Filter: {filter}\n\n"
+        ),
+        'participant_line': "{name} (@{username}) - Address: {address} Gift: {gift}",
+        'nobody_found': "Nobody found.",
+        'no_participants': "No participants yet.",
+        'filter_all': "All",
+        'filter_no_address': "No address",
+        'filter_no_gift': "No gift",
+        'export_csv': "📄 Export CSV",
+        'preparing_file': "Preparing the file...",
+        'participants_caption': "📄 Secret Santa participants",
+        'import_usage': (
+            "Send a .csv or .jsonl file with the caption /import.\n"
+            "Columns: user_id, username, full_name, address"
+        ),
+        'import_done': "✅ Participants imported: {imported}\nRows skipped: {skipped}",
+        'draw_not_done_admin': "The draw has not taken place yet.",
+        'draw_export_caption': "📄 Draw results: {count} pairs",
+        'draw_need_two': "❌ The draw needs at least 2 participants!",
+        'draw_done': "✅ Draw completed for {count} participants!",
+        'draw_failed': (
+            "❌ The draw failed!\n"
+            "The exclusions (/exclude) may leave no valid pairs."
+        ),
+        'draw_restored': "↩️ Pairs of the previous draw restored: {count}",
+        'all_notified': "✅ All participants have already received the draw results.",
+        'reminder_usage': (
+            "Usage:\n"
+            "/remind address [every N hours] - remind to set the address\n"
+            "/remind gift <days after the draw> [every N hours] - remind to send the gift\n"
+            "/remind stop - turn reminders off"
+        ),
+        'reminder_no_address': "delivery address",
+        'reminder_no_gift': "sending the gift",
+        'reminders_list': "🔔 Reminders:\n",
+        'reminder_line': "• {title}: every {hours:g} h, {status}, sent {sent}",
+        'reminder_active': "on",
+        'reminder_stopped': "off",
+        'reminders_stopped': "🔕 Reminders turned off: {count}",
+        'reminder_bad_numbers': "❌ Days and hours must be greater than zero.",
+        'reminder_enabled': "🔔 Reminder «{title}» is on: every {hours:g} h",
+        'reminder_delay': ", starting {days:g} days after the draw",
+        'broadcast_prompt': "Enter the message to send to all participants:",
+        'broadcast_text_only': "❌ Only text can be broadcast. Send the message as text or press «Cancel».",
+        'broadcast_queued': "📢 Broadcast queued. Progress will be updated below.",
+    },
+}
+
+# Переводы дополняются строками языка по умолчанию один раз, при импорте
+for _locale in TEXTS:
+    TEXTS[_locale] = {**TEXTS[DEFAULT_LOCALE], **TEXTS[_locale]}
+    BUTTONS[_locale] = {**BUTTONS[DEFAULT_LOCALE], **BUTTONS.get(_locale, {})}
+
+# Подпись кнопки меню на любом языке -> действие.
+# Отмены здесь нет: ее обрабатывают состояния FSM (см. CANCEL_BUTTONS)
+BUTTON_ACTIONS = {
+    label: action
+    for buttons in BUTTONS.values()
+    for action, label in buttons.items()
+    if action not in ('cancel', 'confirm', 'main_placeholder', 'admin_placeholder')
+}
+CANCEL_BUTTONS = frozenset(buttons['cancel'] for buttons in BUTTONS.values())
+
+
+def locale_of(user):
+    """Язык пользователя aiogram (User) из поддерживаемых"""
+    code = (user.language_code or '')[:2] if user else ''
+    return code if code in TEXTS else DEFAULT_LOCALE
+
+
+def get_text(key, locale=DEFAULT_LOCALE, **kwargs):
+    """Текст по ключу на языке пользователя"""
+    template = TEXTS[locale][key]
+    return template.format(**kwargs) if kwargs else template
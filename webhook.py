@@ -0,0 +1,21 @@
+# webhook.py
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+def create_webhook_app(dp, bot, inflight, path, secret_token=None):
+    """
+    aiohttp-приложение для режима webhook.
+    Апдейты принимаются на path (с проверкой X-Telegram-Bot-Api-Secret-Token),
+    /health отвечает балансировщику. Запуск и остановка диспетчера (dp.startup/dp.shutdown)
+    привязаны к жизненному циклу приложения.
+    """
+    app = web.Application()
+
+    async def health(request):
+        return web.json_response({'status': 'ok', 'inflight': inflight.count})
+
+    app.router.add_get('/health', health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app